@@ -0,0 +1,365 @@
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import Blueprint, current_app, g, jsonify, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from auth import access, authenticate, create_user_token
+from models import Customer, Product, Order, OrderItem, Payment
+from passwords import PasswordBusy
+from permissions import scope_of
+from storage import db
+from utils import calculate_commissions, decode_order_cursor, encode_order_cursor, get_order_amounts, parse_date
+
+# Versioned JSON API for integrations: bearer tokens instead of the session, so
+# no cookie, CSRF token or template is involved. Collections are paged with an
+# opaque cursor, take ?fields= to return only some attributes and ?ids= to
+# fetch a list of rows in one request.
+api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_MAX_IDS = 1000
+
+ORDER_AMOUNT_FIELDS = ('total_amount', 'paid_amount', 'balance')
+ITEM_AMOUNT_FIELDS = ('total', 'commission_amount')
+
+
+class ApiError(Exception):
+    """Abort an API request with a JSON error"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@api_v1.errorhandler(ApiError)
+def _api_error(error):
+    return jsonify({'error': error.message}), error.status
+
+
+def init_api(app, csrf, jwt):
+    """Register the API, exempt from CSRF, and answer token errors in JSON"""
+    app.register_blueprint(api_v1)
+    csrf.exempt(api_v1)
+
+    @jwt.unauthorized_loader
+    def _missing_token(reason):
+        return jsonify({'error': 'Token di accesso mancante'}), 401
+
+    @jwt.invalid_token_loader
+    def _invalid_token(reason):
+        return jsonify({'error': 'Token di accesso non valido'}), 401
+
+    @jwt.expired_token_loader
+    def _expired_token(jwt_header, jwt_payload):
+        return jsonify({'error': 'Token di accesso scaduto'}), 401
+
+
+# ---------- Authentication ----------
+
+def token_required(f):
+    """Decorator to authenticate a request by its bearer token alone"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        verify_jwt_in_request()
+        claims = get_jwt()
+        # The principal travels in the token, so no user is looked up per request
+        g.principal = (claims.get('role'), int(claims['sub']), claims.get('agent_id'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@api_v1.route('/token', methods=['POST'])
+def token():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('username'), str) \
+            or not isinstance(data.get('password'), str):
+        raise ApiError('Corpo JSON non valido')
+    try:
+        user = authenticate(data['username'], data['password'])
+    except PasswordBusy:
+        raise ApiError('Troppi accessi in corso, riprova tra qualche secondo', 503)
+    if user is None:
+        raise ApiError('Nome utente o password non validi', 401)
+    access.load(user.role, user.id, user.agent_id)
+    expires = current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    if isinstance(expires, timedelta):
+        expires = int(expires.total_seconds())
+    return jsonify({'access_token': create_user_token(user), 'token_type': 'Bearer', 'expires_in': expires})
+
+
+# ---------- Query parameters ----------
+
+def _id_list(name):
+    """Comma separated IDs of a query parameter, None when it is missing"""
+    if name not in request.args:
+        return None
+    values = [value.strip() for value in request.args[name].split(',') if value.strip()]
+    if not all(value.isdigit() for value in values):
+        raise ApiError(f'Parametro {name}: ID non valido')
+    if len(values) > API_MAX_IDS:
+        raise ApiError(f'Parametro {name}: troppi ID (massimo {API_MAX_IDS})')
+    # Repeated IDs are returned once, in the order first asked
+    return list(dict.fromkeys(int(value) for value in values))
+
+
+def _limit():
+    limit = request.args.get('limit', API_PAGE_SIZE, type=int)
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        raise ApiError(f'Il limite deve essere tra 1 e {API_MAX_PAGE_SIZE}')
+    return limit
+
+
+def _id_cursor():
+    value = request.args.get('cursor')
+    if value is None:
+        return None
+    if not value.isdigit():
+        raise ApiError('Cursore non valido')
+    return int(value)
+
+
+def _fields(available):
+    """Attributes asked for with ?fields=, all of them without it"""
+    if 'fields' not in request.args:
+        return available
+    fields = tuple(dict.fromkeys(field.strip() for field in request.args['fields'].split(',') if field.strip()))
+    unknown = [field for field in fields if field not in available]
+    if unknown or not fields:
+        raise ApiError(f"Campo non valido: {', '.join(unknown) or request.args['fields']}")
+    return fields
+
+
+def _rows(rows, fields, extra=None):
+    """Serialize rows keeping only fields; extra(rows) adds {row_id: computed attributes}"""
+    computed = extra(rows) if extra is not None else {}
+    result = []
+    for row in rows:
+        data = row.to_dict()
+        data.update(computed.get(row.id, ()))
+        result.append({field: data[field] for field in fields})
+    return result
+
+
+def _page(data, next_cursor):
+    return jsonify({'data': data, 'next_cursor': next_cursor})
+
+
+def _in_order(ids, rows_by_id):
+    return [rows_by_id[i] for i in ids if i in rows_by_id]
+
+
+# ---------- Customers ----------
+
+CUSTOMER_FIELDS = Customer._fields
+
+
+@api_v1.route('/customers')
+@token_required
+def customers():
+    fields = _fields(CUSTOMER_FIELDS)
+    ids = _id_list('ids')
+    if ids is not None:
+        ids = access.visible_customer_ids(*g.principal, ids)
+        return _page(_rows(_in_order(ids, db.get_customers_by_ids(ids)), fields), None)
+
+    role, user_id, agent_id = g.principal
+    scope = scope_of(role, user_id, agent_id)
+    if role != 'admin' and scope is None:
+        return _page([], None)
+    rows, next_cursor = db.get_customers_page(agent_id=scope, after_id=_id_cursor(), limit=_limit())
+    return _page(_rows(rows, fields), str(next_cursor) if next_cursor else None)
+
+
+@api_v1.route('/customers/<int:customer_id>')
+@token_required
+def customer(customer_id):
+    fields = _fields(CUSTOMER_FIELDS)
+    if not access.can_view_customer(*g.principal, customer_id):
+        raise ApiError('Permesso negato', 403)
+    row = db.get_customer_by_id(customer_id)
+    if row is None:
+        raise ApiError('Cliente non trovato', 404)
+    return jsonify(_rows([row], fields)[0])
+
+
+# ---------- Products ----------
+
+PRODUCT_FIELDS = Product._fields
+
+
+@api_v1.route('/products')
+@token_required
+def products():
+    fields = _fields(PRODUCT_FIELDS)
+    ids = _id_list('ids')
+    if ids is not None:
+        return _page(_rows(_in_order(ids, db.get_products_by_ids(ids)), fields), None)
+
+    rows, next_cursor = db.get_products_page(after_id=_id_cursor(), limit=_limit())
+    return _page(_rows(rows, fields), str(next_cursor) if next_cursor else None)
+
+
+@api_v1.route('/products/<int:product_id>')
+@token_required
+def product(product_id):
+    fields = _fields(PRODUCT_FIELDS)
+    row = db.get_product_by_id(product_id)
+    if row is None:
+        raise ApiError('Prodotto non trovato', 404)
+    return jsonify(_rows([row], fields)[0])
+
+
+# ---------- Orders, items and payments ----------
+
+ORDER_FIELDS = Order._fields + ORDER_AMOUNT_FIELDS
+ITEM_FIELDS = OrderItem._fields + ITEM_AMOUNT_FIELDS
+PAYMENT_FIELDS = Payment._fields
+
+
+def _order_rows(orders, fields):
+    # Amounts cost two batched lookups, made only when one of them is asked for
+    if not any(field in ORDER_AMOUNT_FIELDS for field in fields):
+        return _rows(orders, fields)
+    return _rows(orders, fields, lambda rows: get_order_amounts(order.id for order in rows))
+
+
+def _item_rows(items, fields):
+    return _rows(items, fields, lambda rows: {
+        item.id: {'total': item.total, 'commission_amount': item.commission_amount} for item in rows
+    })
+
+
+def _visible_order(order_id):
+    if not access.can_view_order(*g.principal, order_id):
+        raise ApiError('Permesso negato', 403)
+    order = db.get_order_by_id(order_id)
+    if order is None:
+        raise ApiError('Ordine non trovato', 404)
+    return order
+
+
+@api_v1.route('/orders')
+@token_required
+def orders():
+    fields = _fields(ORDER_FIELDS)
+    ids = _id_list('ids')
+    if ids is not None:
+        ids = access.visible_order_ids(*g.principal, ids)
+        return _page(_order_rows(_in_order(ids, db.get_orders_by_ids(ids)), fields), None)
+
+    # The same orders as the HTML list: agents see their customers' orders,
+    # collaborators the orders they created
+    role, user_id, agent_id = g.principal
+    if role == 'admin':
+        scope = {}
+    elif role == 'agent':
+        scope = {'agent_id': user_id}
+    else:
+        scope = {'user_id': user_id}
+
+    cursor = None
+    if 'cursor' in request.args:
+        cursor = decode_order_cursor(request.args['cursor'])
+        if cursor is None:
+            raise ApiError('Cursore non valido')
+    start_date = parse_date(request.args.get('start_date'))
+    end_date = parse_date(request.args.get('end_date'))
+    if end_date:
+        end_date = datetime.combine(end_date, datetime.max.time())
+    rows, next_cursor = db.get_orders_page(
+        customer_id=request.args.get('customer_id', type=int),
+        status=request.args.get('status') or None,
+        start_date=start_date,
+        end_date=end_date,
+        descending=request.args.get('sort') != 'asc',
+        cursor=cursor,
+        limit=_limit(),
+        **scope
+    )
+    return _page(_order_rows(rows, fields), encode_order_cursor(next_cursor) if next_cursor else None)
+
+
+@api_v1.route('/orders/<int:order_id>')
+@token_required
+def order(order_id):
+    fields = _fields(ORDER_FIELDS)
+    return jsonify(_order_rows([_visible_order(order_id)], fields)[0])
+
+
+@api_v1.route('/orders/<int:order_id>/items')
+@token_required
+def order_items(order_id):
+    fields = _fields(ITEM_FIELDS)
+    _visible_order(order_id)
+    return _page(_item_rows(db.get_items_by_order(order_id), fields), None)
+
+
+@api_v1.route('/orders/<int:order_id>/payments')
+@token_required
+def order_payments(order_id):
+    fields = _fields(PAYMENT_FIELDS)
+    _visible_order(order_id)
+    return _page(_rows(db.get_payments_by_order(order_id), fields), None)
+
+
+def _visible_order_ids():
+    order_ids = _id_list('order_ids')
+    if order_ids is None:
+        raise ApiError('Parametro order_ids obbligatorio')
+    return access.visible_order_ids(*g.principal, order_ids)
+
+
+# Items and payments of many orders at once: ?order_ids=1,2,3, skipping orders not visible
+@api_v1.route('/items')
+@token_required
+def items():
+    fields = _fields(ITEM_FIELDS)
+    items_by_order = db.get_items_by_orders(_visible_order_ids())
+    return _page(_item_rows([item for rows in items_by_order.values() for item in rows], fields), None)
+
+
+@api_v1.route('/payments')
+@token_required
+def payments():
+    fields = _fields(PAYMENT_FIELDS)
+    payments_by_order = db.get_payments_by_orders(_visible_order_ids())
+    return _page(_rows([payment for rows in payments_by_order.values() for payment in rows], fields), None)
+
+
+# ---------- Reports ----------
+
+@api_v1.route('/reports/monthly-sales')
+@token_required
+def monthly_sales():
+    year = request.args.get('year', datetime.now().year, type=int)
+    role, user_id, _ = g.principal
+    if role == 'admin':
+        sales = db.get_monthly_sales_data(year=year)
+    elif role == 'agent':
+        sales = db.get_monthly_sales_data(agent_id=user_id, year=year)
+    else:
+        sales = db.get_monthly_sales_data(user_id=user_id, year=year)
+    return jsonify({'year': year, 'months': [{'month': month, 'sales': value} for month, value in enumerate(sales, 1)]})
+
+
+@api_v1.route('/reports/commissions')
+@token_required
+def commissions():
+    start_date = parse_date(request.args.get('start_date'))
+    end_date = parse_date(request.args.get('end_date'))
+    if end_date:
+        end_date = datetime.combine(end_date, datetime.max.time())
+
+    # The same users as the HTML report: everyone, an agent's team, or oneself
+    role, user_id, _ = g.principal
+    if role == 'admin':
+        users = db.get_all_users()
+    elif role == 'agent':
+        users = db.get_collaborators_by_agent(user_id) + [db.get_user_by_id(user_id)]
+    else:
+        users = [db.get_user_by_id(user_id)]
+    users = [user for user in users if user is not None]
+
+    # Without dates the figures cover the current month
+    return jsonify({'data': calculate_commissions(users, start_date, end_date)})
@@ -1,11 +1,12 @@
 import os
-import logging
 from flask import Flask, session
 from flask_jwt_extended import JWTManager
 from flask_wtf.csrf import CSRFProtect
+from metrics import init_metrics, watch_cache
+from telemetry import configure_logging, init_tracing
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging: JSON lines written from a background thread, WARNING unless LOG_LEVEL says otherwise
+configure_logging()
 
 # Create Flask app
 app = Flask(__name__)
@@ -30,3 +31,22 @@ jwt = JWTManager(app)
 
 # Import routes after app initialization to avoid circular imports
 from routes import *
+
+# JSON API for integrations on /api/v1, authenticated by bearer tokens instead of the session
+from api_v1 import init_api
+init_api(app, csrf, jwt)
+
+# Say once per worker whether report aggregations are vectorized with NumPy
+from columnar import log_aggregation_path
+log_aggregation_path()
+
+# Request IDs, request logs and sampled spans (TRACE_SAMPLE_RATE)
+from storage import db
+init_tracing(app, db)
+
+# Prometheus metrics on /metrics: request latency, Storage calls, caches and templates
+from auth import access
+from routes import api_responses
+init_metrics(app, db)
+watch_cache('access', access)
+watch_cache('api_responses', api_responses)
@@ -1,22 +1,40 @@
-from functools import wraps, lru_cache
+from functools import wraps
 from flask import request, redirect, url_for, session, flash
-from flask_jwt_extended import create_access_token, get_jwt_identity
+from flask_jwt_extended import create_access_token
 from storage import db
+from permissions import AccessIndex
+from passwords import needs_rehash, password_pool
+
+# Customers each agent's team may see, shared by every request of the process
+access = AccessIndex(db)
 
 # ---------- Authentication functions ----------
 
+def authenticate(username, password):
+    """Return the user with these credentials, or None"""
+    user = db.get_user_by_username(username)
+    # The key derivation runs on the password pool; PasswordBusy propagates when it is saturated
+    if user and password_pool.verify(user.password_hash, password):
+        # Upgrade hashes made with another method or cost than the configured one
+        if needs_rehash(user.password_hash):
+            user.password_hash = password_pool.hash(password)
+            db.update_user(user)
+        return user
+    return None
+
+def create_user_token(user):
+    """Create a JWT access token carrying the user ID as subject and the role as claims"""
+    return create_access_token(identity=str(user.id), additional_claims={
+        'username': user.username,
+        'role': user.role,
+        'agent_id': user.agent_id
+    })
+
 def login_user(username, password):
     """Authenticate a user and create a session"""
-    user = db.get_user_by_username(username)
-    if user and user.check_password(password):
-        # Create JWT token with user details
-        identity = {
-            'id': user.id,
-            'username': user.username,
-            'role': user.role,
-            'agent_id': user.agent_id
-        }
-        access_token = create_access_token(identity=identity)
+    user = authenticate(username, password)
+    if user:
+        access_token = create_user_token(user)
         
         # Store user info in session
         session.update({
@@ -26,6 +44,7 @@ def login_user(username, password):
             'agent_id': user.agent_id,
             'token': access_token
         })
+        access.load(user.role, user.id, user.agent_id)
         
         return True, access_token
     return False, None
@@ -91,55 +110,13 @@ def is_collaborator():
     """Check if current user is collaborator"""
     return get_user_role() == 'collaborator'
 
-@lru_cache(maxsize=128)
+def _principal():
+    return session.get('role'), session.get('user_id'), session.get('agent_id')
+
 def can_view_customer(customer_id):
     """Check if current user can view a customer"""
-    # Admins can view all customers
-    if is_admin():
-        return True
-    
-    # Retrieve customer data
-    customer = db.get_customer_by_id(customer_id)
-    if not customer:
-        return False
-    
-    # Agents can view their customers
-    if is_agent() and customer.agent_id == session.get('user_id'):
-        return True
-    
-    # Collaborators can view customers of their agent
-    if is_collaborator() and customer.agent_id == session.get('agent_id'):
-        return True
-    
-    return False
-
-@lru_cache(maxsize=128)
+    return access.can_view_customer(*_principal(), customer_id)
+
 def can_view_order(order_id):
     """Check if current user can view an order"""
-    # Admins can view all orders
-    if is_admin():
-        return True
-    
-    # Retrieve order data
-    order = db.get_order_by_id(order_id)
-    if not order:
-        return False
-    
-    # Users who created the order can view it
-    if order.user_id == session.get('user_id'):
-        return True
-    
-    # Retrieve customer data for order
-    customer = db.get_customer_by_id(order.customer_id)
-    if not customer:
-        return False
-    
-    # Agents can view orders for their customers
-    if is_agent() and customer.agent_id == session.get('user_id'):
-        return True
-    
-    # Collaborators can view orders for customers of their agent
-    if is_collaborator() and customer.agent_id == session.get('agent_id'):
-        return True
-    
-    return False
+    return access.can_view_order(*_principal(), order_id)
@@ -0,0 +1,115 @@
+"""Throughput of the /api/v1 JSON API against the HTML routes serving the same data.
+
+Fills the application storage with the synthetic data of benchmarks.datagen,
+then runs each pair of tasks for about --seconds: the HTML side with a
+session cookie, the API side with a bearer token. Run from the application
+directory:
+
+    python -m benchmarks.bench_api --scale 10k
+"""
+import argparse
+import logging
+import time
+from app import app
+from storage import db
+from benchmarks.datagen import PASSWORD, SCALES, generate
+
+# Orders per HTML list page, and the same page size for the API
+PAGE = 25
+
+
+def tasks(html, api, token):
+    """(label, HTML call, API call) of tasks that fetch the same rows both ways"""
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def get(client, url, **kwargs):
+        response = client.get(url, **kwargs)
+        if response.status_code != 200:
+            raise SystemExit(f'GET {url}: HTTP {response.status_code}')
+        return response
+
+    def api_get(url):
+        return get(api, url, headers=headers).get_json()
+
+    # Orders and a customer the user may open, from the first page of their list
+    first_page = api_get(f'/api/v1/orders?limit={PAGE}&fields=id,customer_id')['data']
+    page_ids = [order['id'] for order in first_page]
+    customer_id = first_page[0]['customer_id']
+    id_list = ','.join(map(str, page_ids))
+
+    def html_orders_pages():
+        response = get(html, '/orders')
+        # Follow the next-page link once, like a scraper walking the list
+        text = response.get_data(as_text=True)
+        start = text.find('/orders?cursor=')
+        if start != -1:
+            get(html, text[start:text.find('"', start)].replace('&amp;', '&'))
+
+    def api_orders_pages(fields=''):
+        page = api_get(f'/api/v1/orders?limit={PAGE}{fields}')
+        if page['next_cursor']:
+            api_get(f"/api/v1/orders?limit={PAGE}{fields}&cursor={page['next_cursor']}")
+
+    def html_order_details():
+        for order_id in page_ids:
+            get(html, f'/orders/{order_id}')
+
+    def api_order_details():
+        api_get(f'/api/v1/orders?ids={id_list}')
+        api_get(f'/api/v1/items?order_ids={id_list}')
+        api_get(f'/api/v1/payments?order_ids={id_list}')
+
+    return [
+        ('2 pages of orders', html_orders_pages, api_orders_pages),
+        ('2 pages of orders, 3 fields', html_orders_pages, lambda: api_orders_pages('&fields=id,status,total_amount')),
+        (f'{PAGE} orders with items and payments', html_order_details, api_order_details),
+        ('one customer', lambda: get(html, f'/customers/{customer_id}'), lambda: api_get(f'/api/v1/customers/{customer_id}')),
+        ('all customers', lambda: get(html, '/customers'), lambda: _all_pages(api_get, '/api/v1/customers?limit=1000')),
+        ('all products', lambda: get(html, '/products'), lambda: _all_pages(api_get, '/api/v1/products?limit=1000')),
+        ('reports', lambda: get(html, '/reports'), lambda: (
+            api_get('/api/v1/reports/monthly-sales'), api_get('/api/v1/reports/commissions')))
+    ]
+
+
+def _all_pages(api_get, url):
+    page = api_get(url)
+    while page['next_cursor']:
+        page = api_get(f"{url}&cursor={page['next_cursor']}")
+
+
+def rate(call, seconds):
+    """Calls per second over about seconds, after one warm-up call"""
+    call()
+    calls, started = 0, time.perf_counter()
+    while True:
+        call()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='10k', help='synthetic data preset')
+    parser.add_argument('--seconds', type=float, default=1.0, help='time per task and side')
+    parser.add_argument('--user', default='admin', help="'admin' or a generated user such as bench-agent-0")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    app.config['WTF_CSRF_ENABLED'] = False
+    generate(db, **SCALES[args.scale])
+
+    password = 'admin123' if args.user == 'admin' else PASSWORD
+    html, api = app.test_client(), app.test_client()
+    html.post('/login', data={'username': args.user, 'password': password})
+    token = api.post('/api/v1/token', json={'username': args.user, 'password': password}).get_json()['access_token']
+
+    print(f"{'calls/s as ' + args.user:<40}{'HTML':>10}{'API':>10}{'ratio':>8}")
+    for label, html_call, api_call in tasks(html, api, token):
+        html_rate, api_rate = rate(html_call, args.seconds), rate(api_call, args.seconds)
+        print(f'{label:<40}{html_rate:>10.1f}{api_rate:>10.1f}{api_rate / html_rate:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
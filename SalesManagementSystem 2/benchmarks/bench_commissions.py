@@ -0,0 +1,93 @@
+"""Cost of the commission report as the number of users grows.
+
+Adds agents with collaborators and orders spread across all of them, then
+computes the report of the first 10, 100, 1,000... users two ways: one
+storage aggregate per user, as the reports page used to do, and the
+single-pass commission engine. The cache is cleared before every run, so
+both pay for their scans. Run from the application directory:
+
+    python -m benchmarks.bench_commissions --users 1000 --orders 50000
+"""
+import argparse
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from models import User, Order, OrderItem
+from storage import db
+from utils import calculate_commissions
+
+
+def add_team(agents, collaborators_per_agent):
+    """Add agents, each with its collaborators; return every new user"""
+    users = []
+    with db.batch():
+        for n in range(agents):
+            agent = db.add_user(User(None, f'bench-agent-{n}', f'agent{n}@bench', '', 'agent', password_hash='-'))
+            users.append(agent)
+            for c in range(collaborators_per_agent):
+                users.append(db.add_user(User(
+                    None, f'bench-collab-{n}-{c}', f'collab{n}.{c}@bench', '', 'collaborator',
+                    agent_id=agent.id, password_hash='-'
+                )))
+    return users
+
+
+def add_orders(users, count, seed):
+    """Orders of the last 30 days for the demo customer, credited to random users"""
+    rnd = random.Random(seed)
+    now = datetime.now()
+    with db.batch():
+        for _ in range(count):
+            items = [OrderItem(None, None, rnd.randint(1, 6), rnd.randint(1, 5), 10.0, 5.0) for _ in range(3)]
+            order_date = now - timedelta(days=rnd.random() * 30)
+            db.add_order_with_items(Order(None, 999, order_date, rnd.choice(users).id), items)
+
+
+def timed(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        db.cache.clear()
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000, help='largest report size')
+    parser.add_argument('--collaborators', type=int, default=9, help='collaborators per agent')
+    parser.add_argument('--orders', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    users = add_team(-(-args.users // (args.collaborators + 1)), args.collaborators)[:args.users]
+    add_orders(users, args.orders, args.seed)
+    now = datetime.now()
+    start_date = now - timedelta(days=30)
+
+    print(f"{len(db.order_items)} order items")
+    print(f"{'users':>8}{'per-user queries':>20}{'single pass':>16}{'speedup':>10}")
+    size = 10
+    while True:
+        listed = users[:size]
+        per_user, expected = timed(lambda: [
+            db.get_sales_and_commissions(user_id=user.id, start_date=start_date, end_date=now) for user in listed
+        ], args.repeat)
+        single, rows = timed(lambda: calculate_commissions(listed, start_date, now), args.repeat)
+
+        # Both ways must agree on every user's own figures
+        for (sales, commission), row in zip(expected, rows):
+            if abs(sales - row['total_sales']) > 1e-6 * max(1.0, sales) or abs(commission - row['total_commission']) > 1e-6 * max(1.0, commission):
+                raise SystemExit(f"user {row['id']}: {row['total_sales']} != {sales}")
+        print(f"{len(listed):>8}{per_user * 1000:>17.2f} ms{single * 1000:>13.2f} ms{per_user / single:>9.1f}x")
+        if size >= len(users):
+            break
+        size = min(size * 10, len(users))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Per-request cost of logging and tracing.
+
+Each mode runs in its own process, since logging and the request hooks are
+set up when the app is imported:
+
+    legacy   the previous setup: root logger at DEBUG, synchronous text handler
+    default  the production default: WARNING, queue handler, request IDs only
+    info     one JSON request log line per request
+    trace    every request sampled, with storage and template spans
+
+Log output goes to a temporary file. Run from the application directory:
+
+    python -m benchmarks.bench_logging --requests 2000
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = {
+    'legacy': {'LOG_LEVEL': 'ERROR', 'TRACE_SAMPLE_RATE': '0'},
+    'default': {'LOG_LEVEL': 'WARNING', 'TRACE_SAMPLE_RATE': '0'},
+    'info': {'LOG_LEVEL': 'INFO', 'TRACE_SAMPLE_RATE': '0'},
+    'trace': {'LOG_LEVEL': 'INFO', 'TRACE_SAMPLE_RATE': '1'}
+}
+ORDER_FORM = {'customer_id': '999', 'status': 'pending', 'item_count': '20'}
+for _line in range(20):
+    ORDER_FORM.update({
+        f'product_id_{_line}': str(1 + _line % 6),
+        f'quantity_{_line}': '2',
+        f'price_{_line}': '10.0',
+        f'commission_rate_{_line}': '5'
+    })
+
+
+def run_mode(mode, requests, log_path):
+    """Time the requests in this process and return {request: microseconds per request}"""
+    from app import app
+    from telemetry import configure_logging
+
+    log_file = open(log_path, 'a')
+    if mode == 'legacy':
+        logging.basicConfig(level=logging.DEBUG, stream=log_file, force=True)
+    else:
+        configure_logging(stream=log_file)
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+
+    results = {}
+    for label, call in (
+        ('GET /dashboard', lambda: client.get('/dashboard')),
+        ('GET /orders', lambda: client.get('/orders')),
+        ('POST /orders/new (20 lines)', lambda: client.post('/orders/new', data=ORDER_FORM))
+    ):
+        call()
+        started = time.perf_counter()
+        for _ in range(requests):
+            call()
+        results[label] = (time.perf_counter() - started) / requests * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per page and mode')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--log', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.requests, args.log)))
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench-logging-') as directory:
+        for mode, env in MODES.items():
+            log_path = os.path.join(directory, f'{mode}.log')
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_logging', '--mode', mode,
+                 '--requests', str(args.requests), '--log', log_path],
+                env={**os.environ, **env}, capture_output=True, text=True, check=True
+            ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+            results[mode]['log bytes/request'] = os.path.getsize(log_path) / (3 * args.requests + 3)
+
+    labels = list(results['default'])
+    print(f"{'':<30}" + ''.join(f'{mode:>12}' for mode in MODES))
+    for label in labels:
+        unit = '' if label.startswith('log') else ' µs'
+        print(f'{label:<30}' + ''.join(f'{results[mode][label]:>9.1f}{unit:<3}' for mode in MODES))
+
+
+if __name__ == '__main__':
+    main()
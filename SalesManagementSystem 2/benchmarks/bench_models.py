@@ -0,0 +1,73 @@
+"""Memory footprint and to_dict speed of the slotted model classes.
+
+Each model is compared with a copy of the same rows kept in per-instance
+__dict__ objects, which is how every model was stored before.
+Run from the application directory:
+
+    python -m benchmarks.bench_models --rows 1000000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import datetime
+from models import BaseModel, Order, OrderItem, Payment, PriceList
+
+NOW = datetime(2024, 1, 1)
+
+# Constructor arguments of one row of each model, given its index
+ROW_ARGS = {
+    OrderItem: lambda i: (i, i // 10, 1 + i % 6, 1 + i % 5, 10.0, 5.0),
+    Order: lambda i: (i, 999, NOW, 2),
+    Payment: lambda i: (i, i, 100.0, NOW, 'bank_transfer'),
+    PriceList: lambda i: (i, 999, 1 + i % 6, 9.5)
+}
+
+
+def _dict_factory(model):
+    """Build rows of model as instances of an unslotted class with the same fields"""
+    cls = type(f"{model.__name__}WithDict", (BaseModel,), {
+        '_fields': model._fields,
+        '_datetime_fields': model._datetime_fields
+    })
+
+    def make(*args):
+        row = model(*args)
+        obj = cls.__new__(cls)
+        obj.__dict__.update((key, getattr(row, key)) for key in model._fields)
+        return obj
+    return make
+
+
+def _measure(factory, make_args, rows):
+    """Return (bytes per row, to_dict microseconds per row)"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [factory(*make_args(i)) for i in range(rows)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    # The list holding the rows is not part of their footprint
+    used -= instances.__sizeof__()
+
+    started = time.perf_counter()
+    for instance in instances:
+        instance.to_dict()
+    seconds = time.perf_counter() - started
+    return used / rows, seconds / rows * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000, help='rows of each model to create')
+    args = parser.parse_args()
+
+    print(f"{'model':<12}{'slots B/row':>14}{'dict B/row':>14}{'slots to_dict us':>20}{'dict to_dict us':>20}")
+    for model, make_args in ROW_ARGS.items():
+        slotted = _measure(model, make_args, args.rows)
+        with_dict = _measure(_dict_factory(model), make_args, args.rows)
+        print(f"{model.__name__:<12}{slotted[0]:>14.0f}{with_dict[0]:>14.0f}{slotted[1]:>20.2f}{with_dict[1]:>20.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Worker cold start and login throughput under a burst of concurrent logins.
+
+Cold start is the time to import the app in a fresh interpreter, next to
+what hashing the demo passwords at boot used to add. The login burst posts
+--logins logins at once, one thread each, while a probe thread keeps
+requesting the login page to show how other requests fare. Each
+PASSWORD_WORKERS setting runs in its own process, 0 being verification on
+the request thread. Run from the application directory:
+
+    python -m benchmarks.bench_passwords --logins 200
+    PASSWORD_HASH_METHOD=pbkdf2:sha256:600000 python -m benchmarks.bench_passwords
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+LOGINS = (('admin', 'admin123'), ('agent1', 'agent123'), ('collab1', 'collab123'))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def cold_start(runs):
+    """Seconds to import the app in a fresh interpreter, median of runs"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import app'], check=True, env={**os.environ, 'METRICS_ENABLED': '0'})
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def boot_hashing():
+    """Seconds hashing the demo passwords takes, which boot no longer pays"""
+    from passwords import hash_password
+    started = time.perf_counter()
+    for _, password in LOGINS:
+        hash_password(password)
+    return time.perf_counter() - started
+
+
+def login_burst(logins):
+    """Post the logins at once in this process and return the timings"""
+    from app import app
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    gate = threading.Barrier(logins + 1)
+    latencies, statuses = [], []
+    lock = threading.Lock()
+
+    def login(number):
+        client = app.test_client()
+        username, password = LOGINS[number % len(LOGINS)]
+        gate.wait()
+        started = time.perf_counter()
+        response = client.post('/login', data={'username': username, 'password': password})
+        with lock:
+            latencies.append(time.perf_counter() - started)
+            statuses.append(response.status_code)
+
+    probes = []
+    done = threading.Event()
+
+    def probe():
+        client = app.test_client()
+        while not done.is_set():
+            started = time.perf_counter()
+            client.get('/login')
+            probes.append(time.perf_counter() - started)
+            time.sleep(0.005)
+
+    threads = [threading.Thread(target=login, args=(n,)) for n in range(logins)]
+    for thread in threads:
+        thread.start()
+    prober = threading.Thread(target=probe)
+    prober.start()
+    started = time.perf_counter()
+    gate.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    prober.join()
+
+    return {
+        'logins/s': logins / elapsed,
+        'login p50 ms': percentile(latencies, 0.5) * 1e3,
+        'login p99 ms': percentile(latencies, 0.99) * 1e3,
+        'refused (503)': statuses.count(503),
+        'failed': sum(1 for status in statuses if status not in (302, 503)),
+        'other request p50 ms': percentile(probes, 0.5) * 1e3,
+        'other request max ms': max(probes, default=0.0) * 1e3
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=200, help='concurrent logins in the burst')
+    parser.add_argument('--workers', default='0,1,4', help='PASSWORD_WORKERS settings to compare')
+    parser.add_argument('--runs', type=int, default=5, help='cold starts to time')
+    parser.add_argument('--burst', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.burst:
+        print(json.dumps(login_burst(args.logins)))
+        return
+
+    print(f"cold start (import app): {cold_start(args.runs) * 1e3:.0f} ms, "
+          f"demo password hashing no longer at boot: {boot_hashing() * 1e3:.0f} ms")
+
+    results = {}
+    for workers in args.workers.split(','):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_passwords', '--burst', '--logins', str(args.logins)],
+            env={**os.environ, 'PASSWORD_WORKERS': workers, 'METRICS_ENABLED': '0', 'LOG_LEVEL': 'ERROR'},
+            capture_output=True, text=True, check=True
+        ).stdout
+        results[workers] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"\n{args.logins} concurrent logins, by PASSWORD_WORKERS")
+    print(f"{'':<24}" + ''.join(f'{workers:>10}' for workers in results))
+    for label in results[next(iter(results))]:
+        print(f'{label:<24}' + ''.join(f'{result[label]:>10.1f}' for result in results.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Write throughput and boot time of Storage with the write-ahead log enabled.
+
+Run from the application directory:
+
+    python -m benchmarks.bench_persistence --items 1000000
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from models import Order, OrderItem
+from persistence import Persistence
+from storage import Storage
+
+
+def _open(directory, args):
+    return Storage(persistence=Persistence(
+        directory,
+        snapshot_interval=0,
+        fsync_batch=args.fsync_batch,
+        synchronous=args.sync
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=1_000_000, help='order items to write')
+    parser.add_argument('--items-per-order', type=int, default=10)
+    parser.add_argument('--fsync-batch', type=int, default=1, help='group commits per fsync, 0 = never')
+    parser.add_argument('--sync', action='store_true', help='block each write until its group is written')
+    parser.add_argument('--dir', help='data directory (default: a temporary directory)')
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix='storage-bench-')
+    try:
+        storage = _open(directory, args)
+        start_date = datetime(2024, 1, 1)
+        orders = args.items // args.items_per_order
+
+        started = time.perf_counter()
+        item_id = 0
+        for order_id in range(1, orders + 1):
+            storage.add_order(Order(order_id, 999, start_date + timedelta(minutes=order_id), 2))
+            for _ in range(args.items_per_order):
+                item_id += 1
+                storage.add_order_item(OrderItem(item_id, order_id, 1 + item_id % 6, 1 + item_id % 5, 10.0, 5.0))
+        storage._journal.close()
+        write_seconds = time.perf_counter() - started
+        rows = orders + item_id
+        print(f"write: {rows} rows in {write_seconds:.2f}s ({rows / write_seconds:,.0f} rows/s)")
+
+        started = time.perf_counter()
+        storage = _open(directory, args)
+        print(f"boot from log: {time.perf_counter() - started:.2f}s ({len(storage.order_items)} items)")
+
+        started = time.perf_counter()
+        storage._journal.snapshot()
+        print(f"snapshot: {time.perf_counter() - started:.2f}s")
+        storage._journal.close()
+
+        started = time.perf_counter()
+        storage = _open(directory, args)
+        print(f"boot from snapshot: {time.perf_counter() - started:.2f}s ({len(storage.order_items)} items)")
+        storage._journal.close()
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Check that page requests make a constant number of storage calls.
+
+Every public method of the storage is wrapped with a call counter. Each page
+is requested once with a few orders in the system and once with many, and
+the number of storage calls per request must not grow with it: a count
+that grows with the data is an N+1 lookup pattern. Counts may shrink when
+the first request warmed a cache.
+Run from the application directory:
+
+    python -m benchmarks.check_query_counts --orders 500
+"""
+import argparse
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from functools import wraps
+from app import app
+from models import Order, OrderItem, Payment
+from storage import db
+
+PAGES = (
+    '/dashboard',
+    '/orders',
+    '/customers/999',
+    '/orders/{order_id}',
+    '/orders/{order_id}/edit',
+    '/api/orders/{order_id}/items',
+    '/reports'
+)
+
+
+class CallCounter:
+    """Count the calls made to the public methods of an object"""
+
+    def __init__(self, target):
+        self.calls = Counter()
+        for name in dir(type(target)):
+            method = getattr(target, name)
+            if not name.startswith('_') and callable(method) and name != 'batch':
+                setattr(target, name, self._wrap(name, method))
+
+    def _wrap(self, name, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            self.calls[name] += 1
+            return method(*args, **kwargs)
+        return wrapper
+
+
+def add_orders(count):
+    """Add orders for the demo customer, each with three items and a payment"""
+    now = datetime.now()
+    with db.batch():
+        for n in range(count):
+            items = [OrderItem(None, None, product_id, 1 + n % 4, 10.0, 5.0) for product_id in (1, 2, 3)]
+            order = db.add_order_with_items(Order(None, 999, now - timedelta(hours=n), 3), items)
+            db.add_payment(Payment(None, order.id, 5.0, now, 'cash'))
+    return order.id
+
+
+def measure(client, counter, order_id):
+    """Storage calls made by each page"""
+    result = {}
+    for page in PAGES:
+        url = page.format(order_id=order_id)
+        counter.calls.clear()
+        response = client.get(url)
+        if response.status_code != 200:
+            raise SystemExit(f"{url}: HTTP {response.status_code}")
+        result[page] = sum(counter.calls.values()), dict(counter.calls)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=500, help='orders added for the second measurement')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+
+    order_id = add_orders(5)
+    counter = CallCounter(db)
+    small = measure(client, counter, order_id)
+    add_orders(args.orders)
+    large = measure(client, counter, order_id)
+
+    failures = 0
+    print(f"{'page':<32}{'few orders':>12}{f'+{args.orders} orders':>16}")
+    for page in PAGES:
+        grew = large[page][0] > small[page][0]
+        failures += grew
+        print(f"{page:<32}{small[page][0]:>12}{large[page][0]:>16}{'  GREW' if grew else ''}")
+        if grew:
+            for name, count in sorted(large[page][1].items()):
+                if count != small[page][1].get(name):
+                    print(f"    {name}: {small[page][1].get(name, 0)} -> {count}")
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
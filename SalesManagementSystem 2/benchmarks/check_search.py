@@ -0,0 +1,75 @@
+"""Check that search gives the same matches on both storage backends.
+
+Fills an in-memory storage and a temporary SQLite database with the demo
+data plus customers and products whose optional searchable fields are
+empty or hold accented capitals, then runs the same queries on both. A term found nowhere must match
+no row, and every other query must match the same rows. Run from the
+application directory:
+
+    python -m benchmarks.check_search
+"""
+import os
+import sys
+import tempfile
+from models import Customer, Product
+from sqlite_storage import SQLiteStorage
+from storage import Storage
+
+# (entity type, query, agent_id); the first ones occur in no row, all others in some
+QUERIES = (
+    ('customers', 'zzzqqq', None),
+    ('products', 'zzzqqq', None),
+    ('customers', 'zzzqqq', 2),
+    ('customers', 'cliente', None),
+    ('customers', 'milano', None),
+    ('customers', 'srl', 2),
+    ('products', 'office', None),
+    ('products', 'tech', None),
+    ('products', 'basic 001', None),
+    # Non-ASCII letters fold like str.casefold() on both backends
+    ('customers', 'società', None),
+    ('customers', 'ÉLITE', None),
+    ('customers', 'forlì', 2),
+    ('products', 'straße', None)
+)
+
+
+def fill(storage):
+    """Add rows with NULL optional fields next to the demo data"""
+    storage.add_customer(Customer(None, 'Senza Referente SRL', 'IT00000000001', 'Via Po 1', 'Torino', '10100', 'Italia', agent_id=2))
+    storage.add_customer(Customer(None, 'Anonimo SPA', None, None, None, None, None))
+    storage.add_customer(Customer(None, 'SOCIETÀ ÉLITE', 'IT00000000002', 'Corso Ercole I', 'FORLÌ', '47121', 'Italia', agent_id=2))
+    storage.add_product(Product(None, 'Senza Categoria', 'NOCAT-001', None, 10.0, 'pezzo'))
+    storage.add_product(Product(None, 'STRASSE Ordner', 'DE-001', None, 4.5, 'pezzo', 'Büro'))
+    return storage
+
+
+def main():
+    problems = []
+    with tempfile.TemporaryDirectory(prefix='check-search-') as directory:
+        backends = {
+            'memory': fill(Storage()),
+            'sqlite': fill(SQLiteStorage(os.path.join(directory, 'search.db')))
+        }
+        for entity_type, query, agent_id in QUERIES:
+            found = {
+                name: sorted(row.id for row in storage.search(entity_type, query, limit=100, agent_id=agent_id))
+                for name, storage in backends.items()
+            }
+            if query == 'zzzqqq' and any(found.values()):
+                problems.append(f"{entity_type} {query!r}: unexpected matches {found}")
+            elif query != 'zzzqqq' and not found['memory']:
+                problems.append(f"{entity_type} {query!r}: no matches in memory either, the query checks nothing")
+            elif found['memory'] != found['sqlite']:
+                problems.append(f"{entity_type} {query!r} agent {agent_id}: {found}")
+        backends['sqlite'].close()
+
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    print(f"{len(QUERIES)} queries, {len(problems)} mismatches")
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
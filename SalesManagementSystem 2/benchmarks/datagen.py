@@ -0,0 +1,178 @@
+"""Deterministic synthetic data for benchmarks.
+
+Fills a storage with agents and their collaborators, customers assigned to
+the agents, products, customer price lists, orders with items and payments.
+The same seed and counts always produce the same rows; order and payment
+dates are offsets from end_date, which defaults to today so that the
+current-month figures of the dashboard have data. Only the public storage
+API is used, so both backends can be filled.
+
+Presets are named after the approximate number of order items. Run from the
+application directory to fill a SQLite database or, with STORAGE_DATA_DIR
+set, the persistent in-memory storage:
+
+    STORAGE_BACKEND=sqlite SQLITE_PATH=bench.db python -m benchmarks.datagen --scale 100k
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from passwords import hash_password
+from models import User, Customer, Product, PriceList, Order, OrderItem, Payment
+
+SCALES = {
+    '10k': {
+        'agents': 10, 'collaborators_per_agent': 4, 'customers': 500, 'products': 200,
+        'price_lists': 2_000, 'orders': 2_000, 'items_per_order': 5, 'payments': 1_500
+    },
+    '100k': {
+        'agents': 50, 'collaborators_per_agent': 5, 'customers': 5_000, 'products': 1_000,
+        'price_lists': 20_000, 'orders': 20_000, 'items_per_order': 5, 'payments': 15_000
+    },
+    '1m': {
+        'agents': 200, 'collaborators_per_agent': 5, 'customers': 50_000, 'products': 5_000,
+        'price_lists': 200_000, 'orders': 200_000, 'items_per_order': 5, 'payments': 150_000
+    }
+}
+
+# Every generated user logs in with this password
+PASSWORD = 'bench123'
+
+STATUSES = ('pending', 'confirmed', 'shipped', 'delivered', 'cancelled')
+STATUS_WEIGHTS = (2, 3, 2, 6, 1)
+PAYMENT_METHODS = ('bank_transfer', 'credit_card', 'cash', 'check', 'other')
+COMMISSION_RATES = (3.0, 5.0, 8.0, 10.0)
+CATEGORIES = ('Furniture', 'Technology', 'Base', 'Cancelleria', 'Consumabili')
+CITIES = ('Milano', 'Roma', 'Torino', 'Napoli', 'Bologna', 'Firenze', 'Verona', 'Bari')
+WORDS = (
+    'Alfa', 'Beta', 'Centro', 'Delta', 'Europa', 'Forniture', 'Globale', 'Italia',
+    'Nord', 'Ovest', 'Servizi', 'Sistemi', 'Sud', 'Tecno', 'Ufficio', 'Verde'
+)
+
+# Orders added per storage batch
+CHUNK = 5_000
+
+
+def generate(storage, agents=10, collaborators_per_agent=4, customers=500, products=200, price_lists=2_000,
+             orders=2_000, items_per_order=5, payments=1_500, days=730, seed=1, end_date=None):
+    """Add the synthetic rows to storage and return the generated IDs.
+
+    Orders are credited to agents and collaborators and placed for customers
+    of their agent; order item counts average items_per_order. The result
+    maps 'agents', 'collaborators', 'customers', 'products', 'price_lists',
+    'orders' and 'payments' to lists of IDs in creation order."""
+    rnd = random.Random(seed)
+    end_date = end_date or datetime.combine(datetime.now().date(), datetime.max.time())
+    password_hash = hash_password(PASSWORD)
+    ids = {name: [] for name in ('agents', 'collaborators', 'customers', 'products', 'price_lists', 'orders', 'payments')}
+
+    # Users: a team of collaborators under every agent
+    team_of = {}  # user ID -> agent ID
+    with storage.batch():
+        for a in range(agents):
+            agent = storage.add_user(User(
+                None, f'bench-agent-{a}', f'agent{a}@bench.example', None, 'agent',
+                full_name=f'Agente {rnd.choice(WORDS)} {a}', password_hash=password_hash
+            ))
+            ids['agents'].append(agent.id)
+            team_of[agent.id] = agent.id
+            for c in range(collaborators_per_agent):
+                collaborator = storage.add_user(User(
+                    None, f'bench-collab-{a}-{c}', f'collab{a}.{c}@bench.example', None, 'collaborator',
+                    full_name=f'Collaboratore {rnd.choice(WORDS)} {a}.{c}', agent_id=agent.id,
+                    password_hash=password_hash
+                ))
+                ids['collaborators'].append(collaborator.id)
+                team_of[collaborator.id] = agent.id
+
+    # Customers, spread over the agents
+    customers_of = {agent_id: [] for agent_id in ids['agents']}
+    with storage.batch():
+        for n in range(customers):
+            agent_id = rnd.choice(ids['agents']) if ids['agents'] else None
+            customer = storage.add_customer(Customer(
+                None, f'{rnd.choice(WORDS)} {rnd.choice(WORDS)} {n} SRL', f'IT9{n:010d}',
+                f'Via {rnd.choice(WORDS)} {rnd.randint(1, 200)}', rnd.choice(CITIES),
+                f'{rnd.randint(10, 98)}100', 'Italia', contact_person=f'Referente {n}',
+                email=f'cliente{n}@bench.example', phone=f'+39 02 {n:07d}', agent_id=agent_id
+            ))
+            ids['customers'].append(customer.id)
+            if agent_id is not None:
+                customers_of[agent_id].append(customer.id)
+
+    # Products and their list prices
+    list_price = {}
+    with storage.batch():
+        for n in range(products):
+            price = round(rnd.uniform(5, 1500), 2)
+            product = storage.add_product(Product(
+                None, f'{rnd.choice(WORDS)} {rnd.choice(CATEGORIES)} {n}', f'GEN-{n:06d}',
+                f'Articolo generato {n}', price, 'pezzo', category=rnd.choice(CATEGORIES)
+            ))
+            ids['products'].append(product.id)
+            list_price[product.id] = price
+
+    # Custom prices on distinct (customer, product) pairs
+    custom_price = {}
+    price_lists = min(price_lists, len(ids['customers']) * len(ids['products']))
+    with storage.batch():
+        while len(custom_price) < price_lists:
+            pair = (rnd.choice(ids['customers']), rnd.choice(ids['products']))
+            if pair in custom_price:
+                continue
+            custom_price[pair] = round(list_price[pair[1]] * rnd.uniform(0.7, 0.95), 2)
+            ids['price_lists'].append(storage.add_price_list(PriceList(None, pair[0], pair[1], custom_price[pair])).id)
+
+    # Orders with their items, credited to users of the agent managing the customer
+    sellers = [user_id for user_id, agent_id in team_of.items() if customers_of[agent_id]]
+    if sellers and ids['products']:
+        max_items = max(1, 2 * items_per_order - 1)
+        for start in range(0, orders, CHUNK):
+            with storage.batch():
+                for _ in range(start, min(start + CHUNK, orders)):
+                    user_id = rnd.choice(sellers)
+                    customer_id = rnd.choice(customers_of[team_of[user_id]])
+                    order_date = end_date - timedelta(seconds=rnd.randrange(days * 86400))
+                    items = []
+                    for product_id in rnd.sample(ids['products'], min(rnd.randint(1, max_items), len(ids['products']))):
+                        price = custom_price.get((customer_id, product_id), list_price[product_id])
+                        items.append(OrderItem(
+                            None, None, product_id, rnd.randint(1, 10), price, rnd.choice(COMMISSION_RATES)
+                        ))
+                    order = storage.add_order_with_items(Order(
+                        None, customer_id, order_date, user_id,
+                        status=rnd.choices(STATUSES, STATUS_WEIGHTS)[0]
+                    ), items)
+                    ids['orders'].append(order.id)
+
+    # Payments on random orders, some orders paid more than once
+    if ids['orders']:
+        with storage.batch():
+            for _ in range(payments):
+                order = storage.get_order_by_id(rnd.choice(ids['orders']))
+                payment_date = min(end_date, order.order_date + timedelta(days=rnd.randint(0, 60)))
+                ids['payments'].append(storage.add_payment(Payment(
+                    None, order.id, round(rnd.uniform(10, 2000), 2), payment_date, rnd.choice(PAYMENT_METHODS)
+                )).id)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='10k', help='preset counts')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--days', type=int, default=730, help='orders are spread over this many days')
+    for name in SCALES['10k']:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, help='override the preset')
+    args = parser.parse_args()
+
+    from storage import db
+    counts = dict(SCALES[args.scale])
+    counts.update({name: getattr(args, name) for name in counts if getattr(args, name) is not None})
+    started = time.perf_counter()
+    ids = generate(db, days=args.days, seed=args.seed, **counts)
+    print(', '.join(f'{len(rows)} {name}' for name, rows in ids.items()) + f' in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
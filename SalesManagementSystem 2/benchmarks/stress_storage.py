@@ -0,0 +1,172 @@
+"""Concurrent stress test of the storage behind the web app.
+
+Worker threads mix page requests (through the Flask test client, logged in
+as each demo role) with direct Storage writes: orders with items added
+atomically, order deletions, customer reassignments and payments. Each
+worker remembers what it wrote, and at the end the storage is checked
+against the union of those records: IDs are unique, surviving orders have
+exactly their items, deleted orders left nothing behind, sales totals
+match and the monthly rollups are consistent.
+Run from the application directory:
+
+    python -m benchmarks.stress_storage --threads 32 --seconds 10
+"""
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from app import app
+from models import Order, OrderItem, Payment
+from storage import db
+
+PAGES = ('/dashboard', '/orders', '/customers', '/reports', '/api/customers/999/price-list')
+# Customer 999 is reassigned during the run, so agent1 and collab1 are refused it at times
+REFUSABLE = {'/api/customers/999/price-list'}
+LOGINS = (('admin', 'admin123'), ('agent1', 'agent123'), ('collab1', 'collab123'))
+
+
+class Worker(threading.Thread):
+    def __init__(self, number, deadline, read_ratio):
+        super().__init__(name=f'stress-{number}', daemon=True)
+        self.random = random.Random(number)
+        self.deadline = deadline
+        self.read_ratio = read_ratio
+        self.orders = {}  # order_id -> (item ids, sales) of orders this worker created
+        self.deleted = set()
+        self.counts = Counter()
+        self.errors = []
+
+    def run(self):
+        client = app.test_client()
+        username, password = LOGINS[self.random.randrange(len(LOGINS))]
+        client.post('/login', data={'username': username, 'password': password})
+        while time.monotonic() < self.deadline:
+            try:
+                if self.random.random() < self.read_ratio:
+                    self._read(client)
+                else:
+                    self._write()
+            except Exception as e:  # every failure is reported at the end
+                self.errors.append(repr(e))
+
+    def _read(self, client):
+        if self.random.random() < 0.5:
+            response = client.get(self.random.choice(PAGES))
+            if response.status_code != 200 and not (response.status_code == 403 and response.request.path in REFUSABLE):
+                self.errors.append(f"{response.request.path}: HTTP {response.status_code}")
+            self.counts['page'] += 1
+            return
+        # An order is always seen with all of its items or not at all
+        if self.orders:
+            order_id = self.random.choice(list(self.orders))
+            item_ids = sorted(item.id for item in db.get_items_by_order(order_id))
+            if order_id not in self.deleted and item_ids != self.orders[order_id][0]:
+                self.errors.append(f"order {order_id}: items {item_ids}, expected {self.orders[order_id][0]}")
+        db.get_orders_by_agent(2)
+        db.get_sales_and_commissions(agent_id=2)
+        self.counts['read'] += 1
+
+    def _write(self):
+        choice = self.random.random()
+        if choice < 0.6 or not self.orders:
+            items = [
+                OrderItem(None, None, self.random.randint(1, 6), self.random.randint(1, 5), 10.0, 5.0)
+                for _ in range(self.random.randint(1, 8))
+            ]
+            order_date = datetime.now() - timedelta(days=self.random.randint(0, 400))
+            order = db.add_order_with_items(Order(None, 999, order_date, 2), items)
+            self.orders[order.id] = (sorted(item.id for item in items), sum(item.total for item in items))
+            self.counts['add_order'] += 1
+        elif choice < 0.75:
+            order_id = self.random.choice(list(self.orders))
+            if order_id not in self.deleted and db.delete_order(order_id):
+                self.deleted.add(order_id)
+            self.counts['delete_order'] += 1
+        elif choice < 0.9:
+            customer = db.get_customer_by_id(999)
+            customer.agent_id = self.random.choice((2, 2, 7))
+            db.update_customer(customer)
+            self.counts['reassign'] += 1
+        else:
+            order_id = self.random.choice(list(self.orders))
+            if order_id not in self.deleted:
+                db.add_payment(Payment(None, order_id, 1.0, datetime.now(), 'cash'))
+            self.counts['payment'] += 1
+
+
+def check(workers, baseline_sales):
+    """Return the invariant violations found after the run"""
+    problems = []
+    created = {}
+    for worker in workers:
+        for order_id in worker.orders:
+            if order_id in created:
+                problems.append(f"order id {order_id} handed out twice")
+        created.update(worker.orders)
+    item_ids = [item_id for ids, _ in created.values() for item_id in ids]
+    if len(item_ids) != len(set(item_ids)):
+        problems.append("order item ids handed out twice")
+
+    deleted = set().union(*(worker.deleted for worker in workers))
+    expected_sales = baseline_sales
+    for order_id, (ids, sales) in created.items():
+        items = sorted(item.id for item in db.get_items_by_order(order_id))
+        if order_id in deleted:
+            if db.get_order_by_id(order_id) is not None or items:
+                problems.append(f"deleted order {order_id} left rows behind")
+        else:
+            expected_sales += sales
+            if items != ids:
+                problems.append(f"order {order_id} has items {items}, expected {ids}")
+
+    sales, _ = db.get_sales_and_commissions()
+    if abs(sales - expected_sales) > 1e-6 * max(1.0, expected_sales):
+        problems.append(f"total sales {sales:.2f}, expected {expected_sales:.2f}")
+    problems.extend(f"rollup {m['rollup']} {m['key']} is inconsistent" for m in db.check_rollups())
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--read-ratio', type=float, default=0.8, help='share of operations that only read')
+    parser.add_argument('--switch-interval', type=float, default=1e-5,
+                        help='interpreter thread switch interval; small values make races show up')
+    args = parser.parse_args()
+
+    sys.setswitchinterval(args.switch_interval)
+
+    logging.disable(logging.INFO)
+    app.config['WTF_CSRF_ENABLED'] = False
+    baseline_sales, _ = db.get_sales_and_commissions()
+
+    deadline = time.monotonic() + args.seconds
+    workers = [Worker(number, deadline, args.read_ratio) for number in range(args.threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    counts = sum((worker.counts for worker in workers), Counter())
+    total = sum(counts.values())
+    print(f"{args.threads} threads, {elapsed:.1f}s: {total} operations ({total / elapsed:,.0f} ops/s)")
+    for kind, count in sorted(counts.items()):
+        print(f"  {kind:<14}{count:>10}{count / elapsed:>12,.0f}/s")
+
+    errors = [error for worker in workers for error in worker.errors]
+    problems = check(workers, baseline_sales)
+    for message in (errors[:20] + problems[:20]):
+        print(f"FAIL {message}")
+    print(f"{len(errors)} errors during the run, {len(problems)} invariant violations")
+    raise SystemExit(1 if errors or problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""Timed scenarios for Storage, the utils enrichment functions and key routes.
+
+Fills the application storage with the synthetic data of benchmarks.datagen,
+then times every scenario twice: cold, with the storage read cache cleared
+before each call, and warm. Each scenario runs for about --seconds and at
+least --min-calls times. Results are written as JSON with the data counts
+and the environment, and --compare prints the change against an earlier
+run. Run from the application directory, with a fresh SQLITE_PATH when
+STORAGE_BACKEND=sqlite:
+
+    python -m benchmarks.suite --scale 100k --output before.json
+    python -m benchmarks.suite --scale 100k --output after.json --compare before.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from app import app
+from storage import db
+from benchmarks.datagen import PASSWORD, SCALES, generate
+import utils
+
+
+def storage_scenarios(ids, now):
+    """(name, call) of every Storage getter and analytics method; the name
+    starts with the method name, a suffix after ':' tells variants apart"""
+    agent_id, collaborator_id = ids['agents'][0], ids['collaborators'][0]
+    customer_id, order_id = ids['busiest_customer'], ids['orders'][len(ids['orders']) // 2]
+    product_id = ids['products'][0]
+    customer = db.get_customer_by_id(customer_id)
+    product = db.get_product_by_id(product_id)
+    price_list = db.get_price_lists_by_customer(ids['priced_customer'])[0]
+    item_id = db.get_items_by_order(order_id)[0].id
+    payment_id = ids['payments'][0]
+    page_ids = [order.id for order in db.get_orders_page(limit=25)[0]]
+    month_start = datetime(now.year, now.month, 1)
+    year_ago = now - timedelta(days=365)
+    return [
+        ('get_user_by_id', lambda: db.get_user_by_id(agent_id)),
+        ('get_user_by_username', lambda: db.get_user_by_username('bench-agent-0')),
+        ('get_all_users', db.get_all_users),
+        ('get_collaborators_by_agent', lambda: db.get_collaborators_by_agent(agent_id)),
+        ('get_users_by_ids', lambda: db.get_users_by_ids(ids['collaborators'][:100])),
+        ('get_customer_by_id', lambda: db.get_customer_by_id(customer_id)),
+        ('get_customer_by_vat_number', lambda: db.get_customer_by_vat_number(customer.vat_number)),
+        ('get_all_customers', db.get_all_customers),
+        ('get_customers_by_agent', lambda: db.get_customers_by_agent(agent_id)),
+        ('get_customers_page:admin', lambda: db.get_customers_page(after_id=customer_id, limit=100)),
+        ('get_customers_page:agent', lambda: db.get_customers_page(agent_id=agent_id, limit=100)),
+        ('get_customers_by_ids', lambda: db.get_customers_by_ids(ids['customers'][:100])),
+        ('get_product_by_id', lambda: db.get_product_by_id(product_id)),
+        ('get_product_by_code', lambda: db.get_product_by_code(product.code)),
+        ('get_all_products', db.get_all_products),
+        ('get_products_page', lambda: db.get_products_page(after_id=product_id, limit=100)),
+        ('get_products_by_ids', lambda: db.get_products_by_ids(ids['products'][:100])),
+        ('get_price_list_by_id', lambda: db.get_price_list_by_id(price_list.id)),
+        ('get_price_list_for_customer_product', lambda: db.get_price_list_for_customer_product(
+            price_list.customer_id, price_list.product_id)),
+        ('get_price_lists_by_customer', lambda: db.get_price_lists_by_customer(ids['priced_customer'])),
+        ('get_price_for_customer_product', lambda: db.get_price_for_customer_product(
+            price_list.customer_id, price_list.product_id)),
+        ('get_prices_for_customer', lambda: db.get_prices_for_customer(ids['priced_customer'], ids['products'][:100])),
+        ('get_prices_for_customer:catalog', lambda: db.get_prices_for_customer(ids['priced_customer'])),
+        ('get_order_prices', lambda: db.get_order_prices(
+            ids['priced_customer'], [(product_id, 1 + n % 20) for n, product_id in enumerate(ids['products'][:20])])),
+        ('get_order_by_id', lambda: db.get_order_by_id(order_id)),
+        ('get_orders_by_ids', lambda: db.get_orders_by_ids(ids['orders'][:100])),
+        ('get_all_orders', db.get_all_orders),
+        ('get_orders_by_user', lambda: db.get_orders_by_user(collaborator_id)),
+        ('get_orders_by_customer', lambda: db.get_orders_by_customer(customer_id)),
+        ('get_orders_by_agent', lambda: db.get_orders_by_agent(agent_id)),
+        ('get_orders_page:admin', lambda: db.get_orders_page(limit=25)),
+        ('get_orders_page:agent', lambda: db.get_orders_page(agent_id=agent_id, limit=25)),
+        ('get_orders_page:collaborator', lambda: db.get_orders_page(user_id=collaborator_id, limit=25)),
+        ('get_orders_page:status+dates', lambda: db.get_orders_page(
+            status='cancelled', start_date=year_ago, end_date=now, limit=25)),
+        ('get_order_item_by_id', lambda: db.get_order_item_by_id(item_id)),
+        ('get_items_by_order', lambda: db.get_items_by_order(order_id)),
+        ('get_items_by_orders', lambda: db.get_items_by_orders(page_ids)),
+        ('get_payment_by_id', lambda: db.get_payment_by_id(payment_id)),
+        ('get_payments_by_order', lambda: db.get_payments_by_order(order_id)),
+        ('get_payments_by_orders', lambda: db.get_payments_by_orders(page_ids)),
+        ('get_order_totals', lambda: db.get_order_totals(page_ids)),
+        ('get_paid_amounts', lambda: db.get_paid_amounts(page_ids)),
+        ('get_total_sales_by_user', lambda: db.get_total_sales_by_user(collaborator_id, month_start, now)),
+        ('get_total_sales_by_agent', lambda: db.get_total_sales_by_agent(agent_id, month_start, now)),
+        ('get_total_commissions_by_user', lambda: db.get_total_commissions_by_user(collaborator_id, month_start, now)),
+        ('get_sales_and_commissions:all', lambda: db.get_sales_and_commissions(start_date=year_ago, end_date=now)),
+        ('get_sales_and_commissions:agent', lambda: db.get_sales_and_commissions(
+            agent_id=agent_id, start_date=year_ago, end_date=now)),
+        ('get_sales_by_user', lambda: db.get_sales_by_user(month_start, now)),
+        ('get_monthly_sales_data:admin', lambda: db.get_monthly_sales_data(year=now.year)),
+        ('get_monthly_sales_data:agent', lambda: db.get_monthly_sales_data(agent_id=agent_id, year=now.year)),
+        ('get_period_totals', lambda: db.get_period_totals((now.year - 1, 1), (now.year, now.month))),
+        ('get_dashboard_snapshot:admin', lambda: db.get_dashboard_snapshot(1)),
+        ('get_dashboard_snapshot:agent', lambda: db.get_dashboard_snapshot(agent_id)),
+        ('search:customers', lambda: db.search('customers', 'ital', limit=20)),
+        ('search:products', lambda: db.search('products', 'tecno', limit=20))
+    ]
+
+
+def utils_scenarios(ids, now):
+    agent_id, order_id = ids['agents'][0], ids['orders'][len(ids['orders']) // 2]
+    page = db.get_orders_page(limit=25)[0]
+    page_ids = [order.id for order in page]
+    users = db.get_all_users()
+    return [
+        ('enrich_orders', lambda: utils.enrich_orders(page)),
+        ('get_order_amounts', lambda: utils.get_order_amounts(page_ids)),
+        ('get_order_total', lambda: utils.get_order_total(order_id)),
+        ('get_order_paid_amount', lambda: utils.get_order_paid_amount(order_id)),
+        ('get_order_balance', lambda: utils.get_order_balance(order_id)),
+        ('get_order_items_with_details', lambda: utils.get_order_items_with_details(order_id)),
+        ('get_order_with_details', lambda: utils.get_order_with_details(order_id)),
+        ('get_customer_orders', lambda: utils.get_customer_orders(ids['busiest_customer'])),
+        ('calculate_commission', lambda: utils.calculate_commission(agent_id)),
+        ('calculate_commissions', lambda: utils.calculate_commissions(users))
+    ]
+
+
+def route_scenarios(ids):
+    app.config['WTF_CSRF_ENABLED'] = False
+    clients = {}
+    for role, username, password in (
+        ('admin', 'admin', 'admin123'),
+        ('agent', 'bench-agent-0', PASSWORD),
+        ('collaborator', 'bench-collab-0-0', PASSWORD)
+    ):
+        client = clients[role] = app.test_client()
+        client.post('/login', data={'username': username, 'password': password})
+
+    def get(role, url):
+        def call():
+            response = clients[role].get(url)
+            if response.status_code != 200:
+                raise SystemExit(f"{role} GET {url}: HTTP {response.status_code}")
+        return call
+
+    order_id = ids['orders'][len(ids['orders']) // 2]
+    return [
+        ('dashboard:admin', get('admin', '/dashboard')),
+        ('dashboard:agent', get('agent', '/dashboard')),
+        ('dashboard:collaborator', get('collaborator', '/dashboard')),
+        ('orders_list:admin', get('admin', '/orders')),
+        ('orders_list:agent', get('agent', '/orders')),
+        ('orders_list:status', get('admin', '/orders?status=cancelled')),
+        ('order_detail', get('admin', f'/orders/{order_id}')),
+        ('reports:admin', get('admin', '/reports')),
+        ('reports:agent', get('agent', '/reports')),
+        ('api_customer_price_list', get('admin', f"/api/customers/{ids['priced_customer']}/price-list")),
+        ('api_customer_prices', get('admin', f"/api/customers/{ids['priced_customer']}/prices"))
+    ]
+
+
+def measure(call, seconds, min_calls, cold):
+    """Per-call timings in microseconds"""
+    timings = []
+    deadline = time.perf_counter() + seconds
+    while len(timings) < min_calls or time.perf_counter() < deadline:
+        if cold:
+            db.cache.clear()
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    return {
+        'calls': len(timings),
+        'min_us': round(timings[0], 2),
+        'median_us': round(statistics.median(timings), 2),
+        'p95_us': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        'mean_us': round(statistics.fmean(timings), 2)
+    }
+
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        revision = ''
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': revision or None,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': numpy_version,
+        'backend': os.environ.get('STORAGE_BACKEND', 'memory')
+    }
+
+
+def compare(results, previous):
+    """Print the warm median of every scenario against an earlier run"""
+    print(f"\n{'scenario':<52}{'before':>12}{'after':>12}{'change':>9}")
+    for group, scenarios in results['results'].items():
+        for name, timings in scenarios.items():
+            before = previous['results'].get(group, {}).get(name)
+            if before is None:
+                continue
+            old, new = before['warm']['median_us'], timings['warm']['median_us']
+            print(f"{group + '.' + name:<52}{old:>9.1f} µs{new:>9.1f} µs{(new / old - 1) * 100 if old else 0:>+8.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=SCALES, default='10k', help='benchmarks.datagen preset')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--seconds', type=float, default=0.2, help='time budget per scenario and mode')
+    parser.add_argument('--min-calls', type=int, default=3)
+    parser.add_argument('--filter', default='', help='only run scenarios whose name contains this')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    started = time.perf_counter()
+    ids = generate(db, seed=args.seed, **SCALES[args.scale])
+    generate_seconds = time.perf_counter() - started
+    now = datetime.now()
+
+    # The customers with the most orders and with the most custom prices
+    ids['busiest_customer'] = Counter(order.customer_id for order in db.get_all_orders()).most_common(1)[0][0]
+    ids['priced_customer'] = max(ids['customers'], key=lambda i: len(db.get_price_lists_by_customer(i)))
+
+    groups = {
+        'storage': storage_scenarios(ids, now),
+        'utils': utils_scenarios(ids, now),
+        'routes': route_scenarios(ids)
+    }
+    covered = {name.split(':')[0] for name, _ in groups['storage']}
+    missing = sorted(
+        name for name in dir(type(db))
+        if (name.startswith('get_') or name == 'search') and name not in covered
+    )
+    if missing:
+        print(f"Storage methods without a scenario: {', '.join(missing)}")
+
+    results = {
+        'scale': args.scale,
+        'seed': args.seed,
+        'counts': {
+            'users': len(db.get_all_users()),
+            'customers': len(db.get_all_customers()),
+            'products': len(db.get_all_products()),
+            'price_lists': len(ids['price_lists']),
+            'orders': len(db.get_all_orders()),
+            'payments': len(ids['payments'])
+        },
+        'generate_seconds': round(generate_seconds, 2),
+        'environment': environment(),
+        'results': {}
+    }
+
+    print(f"{'scenario':<52}{'cold median':>16}{'warm median':>16}")
+    for group, scenarios in groups.items():
+        results['results'][group] = {}
+        for name, call in scenarios:
+            if args.filter not in f'{group}.{name}':
+                continue
+            timings = {
+                'cold': measure(call, args.seconds, args.min_calls, cold=True),
+                'warm': measure(call, args.seconds, args.min_calls, cold=False)
+            }
+            results['results'][group][name] = timings
+            print(f"{group + '.' + name:<52}{timings['cold']['median_us']:>13.1f} µs{timings['warm']['median_us']:>13.1f} µs")
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == '__main__':
+    main()
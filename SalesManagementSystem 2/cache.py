@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+# Generation-keyed cache used by Storage and the helpers built on top of it
+class GenerationCache:
+    """Bounded LRU cache whose keys embed per-entity generation counters.
+
+    Every entry declares the entity types it was computed from. Invalidating an
+    entity type bumps its generation, so keys computed before the write can never
+    be looked up again, and drops the entries that depended on it right away.
+    The bookkeeping is guarded by a lock; computing a missing value is not.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._generations = {}
+        self._entries = OrderedDict()  # key -> (value, depends_on)
+        self._dependents = {}  # entity type -> set of keys computed from it
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def generation(self, entity_type):
+        """Current generation counter for an entity type"""
+        return self._generations.get(entity_type, 0)
+
+    def invalidate(self, *entity_types):
+        """Bump the generation of the given entity types and drop dependent entries"""
+        with self._lock:
+            for entity_type in entity_types:
+                self._generations[entity_type] = self._generations.get(entity_type, 0) + 1
+                for key in self._dependents.pop(entity_type, ()):
+                    self._discard(key)
+
+    def get_or_compute(self, name, args, depends_on, compute):
+        """Return the cached value for (name, args) or compute and store it"""
+        # The key is taken before computing, so a result computed while a write
+        # bumps a generation is stored under a key that is already unreachable
+        with self._lock:
+            key = (name, args, tuple(self._generations.get(e, 0) for e in depends_on))
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            if self.maxsize > 0 and key[2] == tuple(self._generations.get(e, 0) for e in depends_on):
+                self._entries[key] = (value, depends_on)
+                for entity_type in depends_on:
+                    self._dependents.setdefault(entity_type, set()).add(key)
+                while len(self._entries) > self.maxsize:
+                    oldest = next(iter(self._entries))
+                    self._discard(oldest)
+                    self.evictions += 1
+        return value
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for entity_type in entry[1]:
+            keys = self._dependents.get(entity_type)
+            if keys is not None:
+                keys.discard(key)
+
+    def memoize(self, *depends_on):
+        """Decorator caching a plain function on the given entity types"""
+        def decorator(func):
+            name = f"{func.__module__}.{func.__qualname__}"
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                key_args = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+                return self.get_or_compute(name, key_args, depends_on, lambda: func(*args, **kwargs))
+            return wrapper
+        return decorator
+
+    def clear(self):
+        """Drop every entry, keeping generations and counters"""
+        with self._lock:
+            self._entries.clear()
+            self._dependents.clear()
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'maxsize': self.maxsize
+        }
+
+
+def cached(*depends_on):
+    """Decorator caching a Storage method in the instance's GenerationCache.
+
+    The cache lives on the instance (``self.cache``), so it never keeps a
+    Storage alive and each Storage invalidates only its own entries.
+    """
+    def decorator(method):
+        name = method.__qualname__
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key_args = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+            return self.cache.get_or_compute(name, key_args, depends_on, lambda: method(self, *args, **kwargs))
+        return wrapper
+    return decorator
@@ -0,0 +1,250 @@
+import logging
+from array import array
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: without it the same columns are scanned in Python
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+def log_aggregation_path():
+    """Log which path the aggregations take: the pure-Python scan is far slower on large data"""
+    if np is not None:
+        logger.info("Report aggregations use NumPy %s", np.__version__)
+    else:
+        logger.warning("NumPy is not installed, report aggregations scan the columns in pure Python; "
+                       "install the 'analytics' extra to vectorize them")
+
+def _ticks(dt):
+    """Seconds since 1970 of a naive datetime, without any timezone conversion"""
+    return (dt - _EPOCH).total_seconds()
+
+def _month_key(dt):
+    """Months since year 0, so a year is the contiguous range [year * 12, year * 12 + 12)"""
+    return dt.year * 12 + dt.month - 1
+
+# Columnar mirror of order items for analytics
+class OrderItemColumns:
+    """Array-backed copy of every order item, joined with its order header.
+
+    Each item is one row across typed ``array.array`` columns. The header
+    columns (order date, month, user, customer and the customer's agent) are
+    denormalized into the item rows and rewritten when an order or a
+    customer changes, so aggregations never touch model objects. Deleting
+    an item moves the last row into its slot. The aggregation methods use
+    zero-copy NumPy views of the columns when NumPy is installed.
+
+    Registered as a Storage listener; it reads the Storage foreign-key
+    indexes to find the rows affected by header changes.
+    """
+
+    COLUMNS = (
+        ('item_id', 'q'), ('order_id', 'q'), ('product_id', 'q'),
+        ('quantity', 'd'), ('price', 'd'), ('commission_rate', 'd'),
+        ('total', 'd'), ('commission', 'd'),
+        ('order_date', 'd'), ('month', 'q'), ('user_id', 'q'), ('customer_id', 'q'), ('agent_id', 'q')
+    )
+    # Header values of items whose order is unknown; month -1 keeps them out of every aggregate
+    _NO_HEADER = (0.0, -1, 0, 0)
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._columns = []
+        for name, typecode in self.COLUMNS:
+            column = array(typecode)
+            setattr(self, name, column)
+            self._columns.append(column)
+        self._header_columns = (self.order_date, self.month, self.user_id, self.customer_id, self.agent_id)
+        self._row_by_item = {}
+        self._headers = {}  # order_id -> (order_date ticks, month, user_id, customer_id)
+        self._agent_by_customer = {}
+
+    def __len__(self):
+        return len(self._row_by_item)
+
+    # ---------- Storage listener ----------
+
+    def on_put(self, entity_type, entity):
+        if entity_type == 'order_items':
+            self._put_item(entity)
+        elif entity_type == 'orders':
+            self._put_order(entity)
+        elif entity_type == 'customers':
+            self._set_agent(entity.id, entity.agent_id or 0)
+
+    def on_remove(self, entity_type, entity):
+        if entity_type == 'order_items':
+            self._remove_item(entity.id)
+        elif entity_type == 'orders':
+            if self._headers.pop(entity.id, None) is not None:
+                self._rewrite_headers(entity.id)
+        elif entity_type == 'customers':
+            self._set_agent(entity.id, 0)
+            self._agent_by_customer.pop(entity.id, None)
+
+    # ---------- Row maintenance ----------
+
+    def _header_values(self, order_id):
+        ticks, month, user_id, customer_id = self._headers.get(order_id, self._NO_HEADER)
+        return ticks, month, user_id, customer_id, self._agent_by_customer.get(customer_id, 0)
+
+    def _put_item(self, item):
+        commission_rate = item.commission_rate or 0.0
+        total = item.price * item.quantity
+        values = (
+            item.id, item.order_id, item.product_id,
+            item.quantity, item.price, commission_rate,
+            total, total * commission_rate / 100
+        ) + self._header_values(item.order_id)
+
+        row = self._row_by_item.get(item.id)
+        if row is None:
+            self._row_by_item[item.id] = len(self.item_id)
+            for column, value in zip(self._columns, values):
+                column.append(value)
+        else:
+            for column, value in zip(self._columns, values):
+                column[row] = value
+
+    def _remove_item(self, item_id):
+        row = self._row_by_item.pop(item_id, None)
+        if row is None:
+            return
+        last = len(self.item_id) - 1
+        if row != last:
+            for column in self._columns:
+                column[row] = column[last]
+            self._row_by_item[self.item_id[row]] = row
+        for column in self._columns:
+            column.pop()
+
+    def _rewrite_headers(self, order_id):
+        values = self._header_values(order_id)
+        for item_id in self._storage._items_by_order.ids(order_id):
+            row = self._row_by_item.get(item_id)
+            if row is not None:
+                for column, value in zip(self._header_columns, values):
+                    column[row] = value
+
+    def _put_order(self, order):
+        header = (_ticks(order.order_date), _month_key(order.order_date), order.user_id or 0, order.customer_id or 0)
+        if self._headers.get(order.id) != header:
+            self._headers[order.id] = header
+            self._rewrite_headers(order.id)
+
+    def _set_agent(self, customer_id, agent_id):
+        if self._agent_by_customer.get(customer_id, 0) == agent_id:
+            return
+        self._agent_by_customer[customer_id] = agent_id
+        for order_id in self._storage._orders_by_customer.ids(customer_id):
+            for item_id in self._storage._items_by_order.ids(order_id):
+                row = self._row_by_item.get(item_id)
+                if row is not None:
+                    self.agent_id[row] = agent_id
+
+    # ---------- Aggregations ----------
+
+    def _mask(self, user_id, agent_id, start, end, months=None):
+        """NumPy boolean mask of the rows matching the filters"""
+        month = np.frombuffer(self.month, dtype=np.int64)
+        mask = month >= 0
+        if months is not None:
+            mask &= (month >= months[0]) & (month < months[1])
+        if user_id is not None:
+            mask &= np.frombuffer(self.user_id, dtype=np.int64) == user_id
+        if agent_id is not None:
+            mask &= np.frombuffer(self.agent_id, dtype=np.int64) == agent_id
+        if start is not None or end is not None:
+            order_date = np.frombuffer(self.order_date, dtype=np.float64)
+            if start is not None:
+                mask &= order_date >= start
+            if end is not None:
+                mask &= order_date <= end
+        return mask
+
+    def _matching_rows(self, user_id, agent_id, start, end, months=None):
+        """Pure-Python scan yielding (row, month) for the rows matching the filters"""
+        for row, (month, row_user, row_agent, ticks) in enumerate(zip(self.month, self.user_id, self.agent_id, self.order_date)):
+            if month < 0 or (months is not None and not months[0] <= month < months[1]):
+                continue
+            if user_id is not None and row_user != user_id:
+                continue
+            if agent_id is not None and row_agent != agent_id:
+                continue
+            if (start is not None and ticks < start) or (end is not None and ticks > end):
+                continue
+            yield row, month
+
+    def totals(self, user_id=None, agent_id=None, start_date=None, end_date=None):
+        """Return (sales, commission) of the items matching every given filter"""
+        start = _ticks(start_date) if start_date else None
+        end = _ticks(end_date) if end_date else None
+        if not self._row_by_item:
+            return 0.0, 0.0
+        if np is not None:
+            mask = self._mask(user_id, agent_id, start, end)
+            total = np.frombuffer(self.total, dtype=np.float64)
+            commission = np.frombuffer(self.commission, dtype=np.float64)
+            return float(total[mask].sum()), float(commission[mask].sum())
+
+        sales = commission = 0.0
+        total_column, commission_column = self.total, self.commission
+        for row, _ in self._matching_rows(user_id, agent_id, start, end):
+            sales += total_column[row]
+            commission += commission_column[row]
+        return sales, commission
+
+    def monthly_totals(self, year, user_id=None, agent_id=None):
+        """Return the sales of each month of a year for the matching items"""
+        first = year * 12
+        if not self._row_by_item:
+            return [0.0] * 12
+        if np is not None:
+            mask = self._mask(user_id, agent_id, None, None, months=(first, first + 12))
+            month = np.frombuffer(self.month, dtype=np.int64)[mask] - first
+            total = np.frombuffer(self.total, dtype=np.float64)[mask]
+            return np.bincount(month, weights=total, minlength=12).tolist()
+
+        monthly = [0.0] * 12
+        total_column = self.total
+        for row, month in self._matching_rows(user_id, agent_id, None, None, months=(first, first + 12)):
+            monthly[month - first] += total_column[row]
+        return monthly
+
+    def totals_by(self, key, start_date=None, end_date=None):
+        """Group the items in a date range by a key column ('user_id', 'agent_id',
+        'customer_id' or 'product_id') in a single pass; return
+        {key: (sales, commission, distinct orders)}"""
+        start = _ticks(start_date) if start_date else None
+        end = _ticks(end_date) if end_date else None
+        if not self._row_by_item:
+            return {}
+        if np is not None:
+            mask = self._mask(None, None, start, end)
+            keys = np.frombuffer(getattr(self, key), dtype=np.int64)[mask]
+            unique, inverse = np.unique(keys, return_inverse=True)
+            sales = np.bincount(inverse, weights=np.frombuffer(self.total, dtype=np.float64)[mask], minlength=len(unique))
+            commission = np.bincount(inverse, weights=np.frombuffer(self.commission, dtype=np.float64)[mask], minlength=len(unique))
+            # An order counts once per key however many of its items match: each
+            # distinct (key, order) pair is encoded as one integer to dedupe with a 1-D sort
+            order_ids = np.frombuffer(self.order_id, dtype=np.int64)[mask]
+            stride = int(order_ids.max()) + 1 if len(order_ids) else 1
+            pairs = np.unique(inverse * stride + order_ids)
+            orders = np.bincount(pairs // stride, minlength=len(unique))
+            return {int(k): (float(s), float(c), int(n)) for k, s, c, n in zip(unique, sales, commission, orders)}
+
+        totals = {}
+        key_column, order_column = getattr(self, key), self.order_id
+        total_column, commission_column = self.total, self.commission
+        for row, _ in self._matching_rows(None, None, start, end):
+            entry = totals.get(key_column[row])
+            if entry is None:
+                entry = totals[key_column[row]] = [0.0, 0.0, set()]
+            entry[0] += total_column[row]
+            entry[1] += commission_column[row]
+            entry[2].add(order_column[row])
+        return {k: (sales, commission, len(orders)) for k, (sales, commission, orders) in totals.items()}
@@ -0,0 +1,224 @@
+from bisect import insort
+from datetime import datetime
+
+RECENT_ORDERS = 5
+
+ADMIN = ('admin', None)
+
+
+def principal_of(user):
+    """The dashboard principal of a user: everything for admins, an agent's
+    customers for agents, and their own orders for collaborators"""
+    if user.role == 'admin':
+        return ADMIN
+    if user.role == 'agent':
+        return ('agent', user.id)
+    return ('user', user.id)
+
+
+def order_scope(principal):
+    """Filters selecting the orders a principal sees, as storage keyword arguments"""
+    kind, key = principal
+    if kind == 'agent':
+        return {'agent_id': key}
+    if kind == 'user':
+        return {'user_id': key}
+    return {}
+
+
+class _Snapshot:
+    __slots__ = ('recent', 'figures')
+
+    def __init__(self):
+        # The newest RECENT_ORDERS (order_date, id) pairs in ascending order; None
+        # when a member left a full list and the next read has to refill it
+        self.recent = None
+        # Counts and sales of the month stored in figures['month'], None when stale
+        self.figures = None
+
+
+# Per-principal dashboard snapshots
+class DashboardSnapshots:
+    """Dashboard figures of every principal, kept current by the writes that affect them.
+
+    A snapshot holds the principal's most recent orders, a bounded list
+    updated in place as orders are written, and the month figures: orders
+    count, sales and commission of the current month, the monthly sales
+    series and the customer and user counts. Writes drop the figures of the
+    principals they touch and the next dashboard read rebuilds them from the
+    monthly rollups and the indexes in constant time, so a dashboard read
+    never looks at the orders themselves.
+
+    Registered as a Storage listener.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._snapshots = {}
+        self._order_keys = {}  # order_id -> (order_date, principals)
+        self._agent_by_customer = {}
+
+    # ---------- Storage listener ----------
+
+    def on_put(self, entity_type, entity):
+        if entity_type == 'orders':
+            self._put_order(entity)
+        elif entity_type == 'order_items':
+            self._touch_order(entity.order_id)
+        elif entity_type == 'customers':
+            self._set_agent(entity.id, entity.agent_id)
+        elif entity_type == 'users':
+            self._touch_users()
+
+    def on_remove(self, entity_type, entity):
+        if entity_type == 'orders':
+            self._remove_order(entity.id)
+        elif entity_type == 'order_items':
+            self._touch_order(entity.order_id)
+        elif entity_type == 'customers':
+            self._set_agent(entity.id, None)
+            self._agent_by_customer.pop(entity.id, None)
+        elif entity_type == 'users':
+            self._touch_users()
+            self._snapshots.pop(('user', entity.id), None)
+            self._snapshots.pop(('agent', entity.id), None)
+
+    # ---------- Updates ----------
+
+    def _principals(self, order):
+        principals = [ADMIN, ('user', order.user_id)]
+        agent_id = self._agent_by_customer.get(order.customer_id)
+        if agent_id is not None:
+            principals.append(('agent', agent_id))
+        return tuple(principals)
+
+    def _put_order(self, order):
+        old = self._order_keys.pop(order.id, None)
+        key = (order.order_date, self._principals(order))
+        self._order_keys[order.id] = key
+        if old is not None:
+            self._unlist(order.id, old, keep=key[1] if old[0] == key[0] else ())
+        for principal in key[1]:
+            snapshot = self._snapshots.get(principal)
+            if snapshot is None:
+                continue
+            snapshot.figures = None
+            recent = snapshot.recent
+            entry = (key[0], order.id)
+            if recent is not None and entry not in recent:
+                insort(recent, entry)
+                del recent[:-RECENT_ORDERS]
+
+    def _remove_order(self, order_id):
+        old = self._order_keys.pop(order_id, None)
+        if old is not None:
+            self._unlist(order_id, old)
+
+    def _unlist(self, order_id, old, keep=()):
+        """Take an order out of the snapshots of the principals it belonged to"""
+        order_date, principals = old
+        for principal in principals:
+            snapshot = self._snapshots.get(principal)
+            if snapshot is None:
+                continue
+            snapshot.figures = None
+            recent = snapshot.recent
+            if recent is None or principal in keep:
+                continue
+            entry = (order_date, order_id)
+            if entry not in recent:
+                continue
+            # A full list may have hidden the order that now belongs in it
+            if len(recent) == RECENT_ORDERS:
+                snapshot.recent = None
+            else:
+                recent.remove(entry)
+
+    def _touch_order(self, order_id):
+        key = self._order_keys.get(order_id)
+        if key is None:
+            return
+        for principal in key[1]:
+            snapshot = self._snapshots.get(principal)
+            if snapshot is not None:
+                snapshot.figures = None
+
+    def _set_agent(self, customer_id, agent_id):
+        old_agent_id = self._agent_by_customer.get(customer_id)
+        self._agent_by_customer[customer_id] = agent_id
+        self._drop(ADMIN, figures_only=True)
+        if old_agent_id == agent_id:
+            return
+        # The customer's orders move between the two agents
+        for order_id in self._storage._orders_by_customer.ids(customer_id):
+            key = self._order_keys.get(order_id)
+            if key is not None:
+                self._order_keys[order_id] = (key[0], self._principals(self._storage.orders[order_id]))
+        self._drop(('agent', old_agent_id))
+        self._drop(('agent', agent_id))
+        # Collaborators see the customer count of their agent
+        users = self._storage.users
+        for (kind, key), snapshot in self._snapshots.items():
+            if kind == 'user' and key in users and users[key].agent_id in (old_agent_id, agent_id):
+                snapshot.figures = None
+
+    def _touch_users(self):
+        # User counts depend on roles and agent assignments; user writes are rare
+        for snapshot in self._snapshots.values():
+            snapshot.figures = None
+
+    def _drop(self, principal, figures_only=False):
+        snapshot = self._snapshots.get(principal)
+        if snapshot is not None:
+            snapshot.figures = None
+            if not figures_only:
+                snapshot.recent = None
+
+    # ---------- Reads ----------
+
+    def snapshot(self, user, now=None):
+        """Dashboard figures of a user's principal; the caller holds the storage read lock.
+
+        Concurrent readers may rebuild the same snapshot at once, which is
+        harmless: both compute the same value and the last assignment wins."""
+        now = now or datetime.now()
+        principal = principal_of(user)
+        snapshot = self._snapshots.get(principal)
+        if snapshot is None:
+            snapshot = self._snapshots[principal] = _Snapshot()
+
+        month = (now.year, now.month)
+        figures = snapshot.figures
+        if figures is None or figures['month'] != month:
+            figures = snapshot.figures = self._figures(principal, user, month)
+        recent = snapshot.recent
+        if recent is None:
+            orders, _ = self._storage.get_orders_page(limit=RECENT_ORDERS, **order_scope(principal))
+            recent = snapshot.recent = [(order.order_date, order.id) for order in reversed(orders)]
+
+        orders = self._storage.orders
+        return dict(figures, recent_orders=[orders[order_id] for _, order_id in reversed(recent)])
+
+    def _figures(self, principal, user, month):
+        storage = self._storage
+        kind, key = principal
+        scope = order_scope(principal)
+        sales, commission, orders_count = storage._rollups.period_totals(month, month, **scope)
+        if kind == 'admin':
+            customers_count = len(storage.customers)
+            users_count = len(storage.users)
+        elif kind == 'agent':
+            customers_count = storage._customers_by_agent.count(key)
+            users_count = len(storage.get_collaborators_by_agent(key)) + 1  # +1 for the agent
+        else:
+            customers_count = storage._customers_by_agent.count(user.agent_id)
+            users_count = 1  # Just themselves
+        return {
+            'month': month,
+            'orders_count': orders_count,
+            'total_sales': sales,
+            'total_commission': commission,
+            'customers_count': customers_count,
+            'users_count': users_count,
+            'sales_data': storage._rollups.monthly_sales(month[0], **scope)
+        }
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, SelectField, TextAreaField, FloatField, EmailField, TelField
+from wtforms import StringField, PasswordField, SubmitField, SelectField, TextAreaField, FloatField, IntegerField, EmailField, TelField
 from wtforms.validators import DataRequired, Email, Optional, NumberRange, Length
 
 class LoginForm(FlaskForm):
@@ -62,4 +62,5 @@ class PaymentForm(FlaskForm):
 class PriceListForm(FlaskForm):
     product_id = SelectField('Product', validators=[DataRequired()], coerce=int)
     custom_price = FloatField('Custom Price', validators=[DataRequired(), NumberRange(min=0)])
+    min_quantity = IntegerField('Min Quantity', validators=[Optional(), NumberRange(min=1)], default=1)
     submit = SubmitField('Save Custom Price')
\ No newline at end of file
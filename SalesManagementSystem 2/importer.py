@@ -0,0 +1,259 @@
+import csv
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from itertools import islice
+from werkzeug.datastructures import MultiDict
+from forms import CustomerForm, ProductForm, PriceListForm
+from models import Customer, Product, PriceList
+
+# ---------- Reading ----------
+
+FORMATS = ('csv', 'jsonl')
+
+def detect_format(filename):
+    """Guess the file format from its extension"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    raise ValueError(f"Formato file non supportato: {filename}")
+
+class MalformedRow:
+    """Stands for a line that could not be read as a row; import_rows rejects it"""
+
+    def __init__(self, errors):
+        self.errors = errors
+
+def read_rows(stream, fmt):
+    """Yield one dict per row of a CSV (with header) or JSON Lines text stream,
+    or a MalformedRow for a JSON line that is not an object"""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield MalformedRow({'row': [f'JSON non valido: {e}']})
+                continue
+            yield row if isinstance(row, dict) else MalformedRow({'row': ['La riga deve essere un oggetto JSON']})
+    else:
+        raise ValueError(f"Formato file non supportato: {fmt}")
+
+def _as_formdata(row):
+    """Turn a row into form data, as if every value had been typed in a form"""
+    return MultiDict({key: '' if value is None else str(value) for key, value in row.items()})
+
+def _optional_id(row, name, errors):
+    """Parse an optional ID column; a value that is not a whole number is recorded in errors"""
+    value = row.get(name)
+    if value is None or value == '':
+        return None
+    text = str(value).strip()
+    if isinstance(value, bool) or not text.isdigit():
+        errors[name] = ['ID non valido']
+        return None
+    return int(text)
+
+# ---------- Row handlers ----------
+
+class _RowImporter(ABC):
+    """Validates one kind of row with its form's field rules and upserts it"""
+    form_class = None
+    fields = ()
+
+    def __init__(self, storage, agent_id=None):
+        self.storage = storage
+        self.agent_id = agent_id
+        # One form is reused for every row; process() rebinds it to new data
+        self.form = self.form_class(meta={'csrf': False})
+
+    def validate(self, row):
+        """Return the form bound to row, or a dict of field errors"""
+        self.form.process(formdata=_as_formdata(row))
+        errors = {}
+        for name in self.fields:
+            field = self.form[name]
+            if not field.validate(self.form):
+                errors[name] = list(field.errors)
+        return errors or self.form
+
+    @abstractmethod
+    def upsert(self, row, form):
+        """Insert or update the row; return True if it was inserted"""
+
+
+class _CustomerImporter(_RowImporter):
+    form_class = CustomerForm
+    fields = ('name', 'vat_number', 'address', 'city', 'zip_code', 'country', 'contact_person', 'email', 'phone')
+
+    def validate(self, row):
+        result = super().validate(row)
+        errors = result if isinstance(result, dict) else {}
+        self._agent_id = _optional_id(row, 'agent_id', errors)
+        return errors or result
+
+    def upsert(self, row, form):
+        values = {name: form[name].data or None for name in self.fields}
+        agent_id = self._agent_id
+        customer = self.storage.get_customer_by_vat_number(values['vat_number'])
+        if customer:
+            for name, value in values.items():
+                setattr(customer, name, value)
+            if agent_id is not None:
+                customer.agent_id = agent_id
+            self.storage.update_customer(customer)
+            return False
+        self.storage.add_customer(Customer(id=None, agent_id=agent_id or self.agent_id, **values))
+        return True
+
+
+class _ProductImporter(_RowImporter):
+    form_class = ProductForm
+    fields = ('name', 'code', 'description', 'price', 'unit', 'category')
+
+    def upsert(self, row, form):
+        values = {name: form[name].data for name in self.fields}
+        values['description'] = values['description'] or None
+        values['category'] = values['category'] or None
+        product = self.storage.get_product_by_code(values['code'])
+        if product:
+            for name, value in values.items():
+                setattr(product, name, value)
+            self.storage.update_product(product)
+            return False
+        self.storage.add_product(Product(id=None, **values))
+        return True
+
+
+class _PriceListImporter(_RowImporter):
+    """Price rows name the customer by customer_vat_number (or customer_id)
+    and the product by product_code (or product_id); min_quantity, 1 when
+    missing, makes the row a quantity break"""
+    form_class = PriceListForm
+    fields = ('custom_price', 'min_quantity')
+
+    def validate(self, row):
+        result = super().validate(row)
+        errors = result if isinstance(result, dict) else {}
+
+        if row.get('customer_vat_number'):
+            customer = self.storage.get_customer_by_vat_number(row['customer_vat_number'])
+        else:
+            customer_id = _optional_id(row, 'customer_id', errors)
+            customer = self.storage.get_customer_by_id(customer_id) if customer_id is not None else None
+        if not customer and 'customer_id' not in errors:
+            errors['customer'] = ['Cliente non trovato']
+
+        if row.get('product_code'):
+            product = self.storage.get_product_by_code(row['product_code'])
+        else:
+            product_id = _optional_id(row, 'product_id', errors)
+            product = self.storage.get_product_by_id(product_id) if product_id is not None else None
+        if not product and 'product_id' not in errors:
+            errors['product'] = ['Prodotto non trovato']
+
+        if errors:
+            return errors
+        self._resolved = (customer.id, product.id)
+        return result
+
+    def upsert(self, row, form):
+        customer_id, product_id = self._resolved
+        custom_price = form.custom_price.data
+        min_quantity = form.min_quantity.data or 1
+        price_list = self.storage.get_price_list_for_customer_product(customer_id, product_id, min_quantity)
+        if price_list:
+            price_list.custom_price = custom_price
+            self.storage.update_price_list(price_list)
+            return False
+        self.storage.add_price_list(PriceList(
+            id=None, customer_id=customer_id, product_id=product_id, custom_price=custom_price,
+            min_quantity=min_quantity
+        ))
+        return True
+
+
+IMPORTERS = {
+    'customers': _CustomerImporter,
+    'products': _ProductImporter,
+    'price_lists': _PriceListImporter
+}
+
+# ---------- Pipeline ----------
+
+class ImportResult:
+    """Counters of an import run; only the first max_errors rejections are kept"""
+
+    def __init__(self, kind, max_errors=100):
+        self.kind = kind
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.batches = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def reject(self, row_number, errors):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+            'errors': self.errors
+        }
+
+
+def import_rows(storage, kind, rows, batch_size=1000, agent_id=None, max_errors=100):
+    """Validate and upsert rows of the given kind into storage.
+
+    rows may be any iterable, typically the read_rows generator, and is
+    consumed batch_size rows at a time: each batch is written inside
+    storage.batch(), so caches are invalidated once per batch, and only one
+    batch is held in memory. Must run inside an application context because
+    validation uses the forms in forms.py.
+    """
+    importer = IMPORTERS[kind](storage, agent_id=agent_id)
+    result = ImportResult(kind, max_errors=max_errors)
+    started = time.perf_counter()
+    rows = iter(rows)
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        with storage.batch():
+            for row in batch:
+                result.rows += 1
+                validated = row.errors if isinstance(row, MalformedRow) else importer.validate(row)
+                if isinstance(validated, dict):
+                    result.reject(result.rows, validated)
+                elif importer.upsert(row, validated):
+                    result.inserted += 1
+                else:
+                    result.updated += 1
+        result.batches += 1
+
+    result.seconds = time.perf_counter() - started
+    return result
@@ -0,0 +1,31 @@
+from functools import wraps
+from time import perf_counter
+
+
+def _observed(name, method, observers):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            seconds = perf_counter() - started
+            for observer in observers:
+                observer(name, seconds)
+    return wrapper
+
+
+def instrument_storage(storage, observer):
+    """Call observer(method name, seconds) after every call to a public method of storage.
+
+    The methods are wrapped the first time; later observers join the same
+    wrapper, so a call is timed once however many observers there are."""
+    observers = getattr(storage, '_call_observers', None)
+    if observers is None:
+        observers = storage._call_observers = []
+        for name in dir(type(storage)):
+            method = getattr(storage, name)
+            if not name.startswith('_') and callable(method) and name != 'batch':
+                setattr(storage, name, _observed(name, method, observers))
+    if observer not in observers:
+        observers.append(observer)
@@ -0,0 +1,269 @@
+import hmac
+import os
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from flask import Response, abort, before_render_template, g, request, template_rendered
+from instrumentation import instrument_storage
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Prometheus metric types, just enough of them for the text exposition format
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}' for labels, value in values]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class CallTimer(_Metric):
+    """Calls and the seconds spent in them, exposed as two counters but updated under one lock"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, seconds_name, seconds_documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.seconds_name = seconds_name
+        self.seconds_documentation = seconds_documentation
+
+    def observe(self, seconds, labels=()):
+        with self._lock:
+            child = self._values.get(labels)
+            if child is None:
+                child = self._values[labels] = [0, 0.0]
+            child[0] += 1
+            child[1] += seconds
+
+    def header(self):
+        return []
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, count, total) for labels, (count, total) in self._values.items()]
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{_labels(self.labelnames, labels)} {count}' for labels, count, _ in values)
+        lines += [f'# HELP {self.seconds_name} {self.seconds_documentation}', f'# TYPE {self.seconds_name} counter']
+        lines.extend(f'{self.seconds_name}{_labels(self.labelnames, labels)} {_number(total)}' for labels, _, total in values)
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        with self._lock:
+            child = self._values.get(labels)
+            if child is None:
+                # Per-bucket counts (the last one is +Inf), then count and sum
+                child = self._values[labels] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            child[0][bisect_left(self.buckets, value)] += 1
+            child[1] += 1
+            child[2] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), count, total) for labels, (counts, count, total) in self._values.items()]
+        lines = []
+        for labels, counts, count, total in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+        return lines
+
+
+class Registry:
+    """Metrics updated as things happen, plus collectors read when the endpoint is scraped"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """collector() returns metrics holding current values, e.g. cache statistics"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        metrics = list(self._metrics)
+        for collector in self._collectors:
+            metrics.extend(collector())
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    'http_request_duration_seconds', 'Time spent handling requests, by endpoint', ('endpoint', 'method')
+))
+REQUESTS = registry.register(Counter(
+    'http_requests_total', 'Requests handled, by endpoint and status', ('endpoint', 'method', 'status')
+))
+IN_FLIGHT = registry.register(Gauge('http_requests_in_flight', 'Requests being handled right now'))
+STORAGE_CALLS = registry.register(CallTimer(
+    'storage_calls_total', 'Calls to each Storage method',
+    'storage_call_seconds_total', 'Time spent in each Storage method, nested calls included', ('method',)
+))
+TEMPLATE_RENDER = registry.register(Histogram(
+    'template_render_duration_seconds', 'Time spent rendering each template', ('template',)
+))
+
+# name -> object with stats() (GenerationCache, AccessIndex) or cache_info() (functools.lru_cache)
+_caches = {}
+
+
+def watch_cache(name, cache):
+    """Report the hit, miss and size counters of a cache on /metrics"""
+    _caches[name] = cache
+
+
+def _cache_metrics():
+    hits = Counter('cache_hits_total', 'Cache lookups answered from the cache', ('cache',))
+    misses = Counter('cache_misses_total', 'Cache lookups that had to compute the value', ('cache',))
+    evictions = Counter('cache_evictions_total', 'Entries dropped to make room', ('cache',))
+    size = Gauge('cache_entries', 'Entries currently cached', ('cache',))
+    for name, cache in list(_caches.items()):
+        if hasattr(cache, 'stats'):
+            stats = cache.stats()
+            hits.inc((name,), stats['hits'])
+            misses.inc((name,), stats['misses'])
+            evictions.inc((name,), stats['evictions'])
+            size.inc((name,), stats['size'])
+        else:
+            info = cache.cache_info()
+            hits.inc((name,), info.hits)
+            misses.inc((name,), info.misses)
+            size.inc((name,), info.currsize)
+    return [hits, misses, evictions, size]
+
+
+registry.add_collector(_cache_metrics)
+
+
+# ---------- Instrumentation ----------
+
+def _count_storage_call(name, seconds):
+    STORAGE_CALLS.observe(seconds, (name,))
+
+
+# Clients allowed to read /metrics when no METRICS_TOKEN is configured
+_LOCAL_ADDRESSES = frozenset(('127.0.0.1', '::1'))
+
+
+def init_metrics(app, storage=None):
+    """Instrument the app and storage and serve the metrics on /metrics.
+
+    METRICS_ENABLED=0 turns everything off. The endpoint is closed by
+    default: with METRICS_TOKEN set it requires that bearer token, otherwise
+    it only answers direct requests from localhost. Requests relayed by a
+    proxy (X-Forwarded-For) never count as local."""
+    if os.environ.get('METRICS_ENABLED', '1') == '0':
+        return
+    token = os.environ.get('METRICS_TOKEN')
+    if storage is not None:
+        # Shares the wrapper of the tracing spans, so each call is timed once
+        instrument_storage(storage, _count_storage_call)
+        watch_cache('storage', storage.cache)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def _start_request():
+        IN_FLIGHT.inc()
+        g._metrics_started = perf_counter()
+
+    @app.after_request
+    def _count_request(response):
+        started = g.get('_metrics_started')
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.observe(perf_counter() - started, (endpoint, request.method))
+            REQUESTS.inc((endpoint, request.method, str(response.status_code)))
+        return response
+
+    @app.teardown_request
+    def _end_request(exc):
+        if g.pop('_metrics_started', None) is not None:
+            IN_FLIGHT.dec()
+
+    @app.route('/metrics')
+    def metrics():
+        if token:
+            if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+                abort(401)
+        elif request.remote_addr not in _LOCAL_ADDRESSES or 'X-Forwarded-For' in request.headers:
+            abort(403)
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def _template_started(app, template, context, **extra):
+    g._metrics_template_started = perf_counter()
+
+
+def _template_finished(app, template, context, **extra):
+    started = g.pop('_metrics_template_started', None)
+    if started is not None:
+        TEMPLATE_RENDER.observe(perf_counter() - started, (template.name,))
@@ -1,8 +1,24 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from operator import attrgetter
+from werkzeug.security import check_password_hash
+from passwords import hash_password
 
 # Base model class with common functionality
 class BaseModel:
+    # Subclasses list their attributes in _fields; the high-volume ones also use
+    # them as __slots__, so rows carry no per-instance __dict__
+    __slots__ = ()
+    _fields = ('created_at',)
+    # Attributes serialized as ISO strings by to_dict and parsed back by from_dict
+    _datetime_fields = ('created_at',)
+    # Values from_dict gives attributes missing from older serialized rows
+    _defaults = {}
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Read every field in one call when serializing
+        cls._get_fields = attrgetter(*cls._fields)
+    
     def __init__(self):
         self.created_at = datetime.now()
     
@@ -10,22 +26,34 @@ class BaseModel:
         return dt.isoformat() if dt else None
     
     def to_dict(self):
-        result = {}
-        for key, value in self.__dict__.items():
-            if isinstance(value, datetime):
-                result[key] = self._format_datetime(value)
-            else:
-                result[key] = value
+        result = dict(zip(self._fields, self._get_fields(self)))
+        for key in self._datetime_fields:
+            result[key] = self._format_datetime(result[key])
         return result
+    
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild an instance from to_dict output without running __init__"""
+        obj = cls.__new__(cls)
+        for key, value in cls._defaults.items():
+            setattr(obj, key, value)
+        for key, value in data.items():
+            if key in cls._datetime_fields and isinstance(value, str):
+                value = datetime.fromisoformat(value)
+            setattr(obj, key, value)
+        return obj
 
 # Model definitions
 class User(BaseModel):
-    def __init__(self, id, username, email, password, role, full_name=None, agent_id=None):
+    _fields = ('id', 'username', 'email', 'password_hash', 'role', 'full_name', 'agent_id', 'created_at')
+    
+    def __init__(self, id, username, email, password, role, full_name=None, agent_id=None, password_hash=None):
         super().__init__()
         self.id = id
         self.username = username
         self.email = email
-        self.password_hash = generate_password_hash(password)
+        # Pass password_hash (with password=None) to skip hashing, e.g. for users loaded in bulk
+        self.password_hash = password_hash if password_hash is not None else hash_password(password)
         self.role = role  # 'admin', 'agent', 'collaborator'
         self.full_name = full_name
         self.agent_id = agent_id  # For collaborators, this links to their agent
@@ -34,6 +62,9 @@ class User(BaseModel):
         return check_password_hash(self.password_hash, password)
 
 class Customer(BaseModel):
+    _fields = ('id', 'name', 'vat_number', 'address', 'city', 'zip_code', 'country',
+               'contact_person', 'email', 'phone', 'agent_id', 'created_at')
+    
     def __init__(self, id, name, vat_number, address, city, zip_code, country, contact_person=None, email=None, phone=None, agent_id=None):
         super().__init__()
         self.id = id
@@ -49,6 +80,8 @@ class Customer(BaseModel):
         self.agent_id = agent_id  # Which agent manages this customer
 
 class Product(BaseModel):
+    _fields = ('id', 'name', 'code', 'description', 'price', 'unit', 'category', 'created_at')
+    
     def __init__(self, id, name, code, description, price, unit, category=None):
         super().__init__()
         self.id = id
@@ -60,14 +93,22 @@ class Product(BaseModel):
         self.category = category
 
 class PriceList(BaseModel):
-    def __init__(self, id, customer_id, product_id, custom_price):
+    _fields = __slots__ = ('id', 'customer_id', 'product_id', 'custom_price', 'min_quantity', 'created_at')
+    _defaults = {'min_quantity': 1}
+    
+    def __init__(self, id, customer_id, product_id, custom_price, min_quantity=1):
         super().__init__()
         self.id = id
         self.customer_id = customer_id
         self.product_id = product_id
         self.custom_price = custom_price
+        self.min_quantity = min_quantity  # The price applies from this quantity up (quantity break)
 
 class Order(BaseModel):
+    _fields = __slots__ = ('id', 'customer_id', 'order_date', 'user_id', 'status', 'notes',
+                           'updated_at', 'order_code', 'created_at')
+    _datetime_fields = ('created_at', 'updated_at', 'order_date')
+    
     def __init__(self, id, customer_id, order_date, user_id, status='pending', notes=None, order_code=None):
         super().__init__()
         self.id = id
@@ -86,6 +127,8 @@ class Order(BaseModel):
             self.order_code = order_code or f"ORD-{id:06d}"
 
 class OrderItem(BaseModel):
+    _fields = __slots__ = ('id', 'order_id', 'product_id', 'quantity', 'price', 'commission_rate', 'created_at')
+    
     def __init__(self, id, order_id, product_id, quantity, price, commission_rate=0.0):
         super().__init__()
         self.id = id
@@ -106,6 +149,9 @@ class OrderItem(BaseModel):
         return self.total * self.commission_rate / 100
 
 class Payment(BaseModel):
+    _fields = __slots__ = ('id', 'order_id', 'amount', 'payment_date', 'payment_method', 'notes', 'created_at')
+    _datetime_fields = ('created_at', 'payment_date')
+    
     def __init__(self, id, order_id, amount, payment_date, payment_method, notes=None):
         super().__init__()
         self.id = id
@@ -0,0 +1,75 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Key derivation cost, as a werkzeug method: 'scrypt:n:r:p' or 'pbkdf2:hash:iterations'
+HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+# Threads verifying passwords; 0 verifies on the request thread
+WORKERS = int(os.environ.get('PASSWORD_WORKERS', min(4, os.cpu_count() or 1)))
+# Verifications running or queued at once, and how long a login waits for a place
+MAX_PENDING = int(os.environ.get('PASSWORD_MAX_PENDING', 64))
+QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_QUEUE_TIMEOUT', 10))
+
+
+def _full_method(method):
+    """Spell out the default parameters werkzeug fills in, as they appear in stored hashes"""
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return 'scrypt:32768:8:1'
+    if name == 'pbkdf2' and len(args) < 2:
+        return f"pbkdf2:{args[0] if args else 'sha256'}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+def hash_password(password):
+    """Hash a password with the configured method and cost"""
+    return generate_password_hash(password, HASH_METHOD, SALT_LENGTH)
+
+
+def needs_rehash(password_hash):
+    """Whether a stored hash was made with another method or cost than the configured one"""
+    return password_hash.split('$', 1)[0] != _full_method(HASH_METHOD)
+
+
+class PasswordBusy(Exception):
+    """Raised when too many password derivations are already waiting"""
+
+
+# Key derivation pool
+class PasswordPool:
+    """Runs password hashing and verification on a small pool of threads.
+
+    A key derivation holds a CPU for tens of milliseconds and, with scrypt,
+    32 MiB of memory. hashlib releases the GIL while deriving, so a burst of
+    logins runs at most `workers` derivations at a time and the other
+    requests keep being served. Calls beyond max_pending wait up to timeout
+    seconds for a place, then PasswordBusy is raised.
+    """
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING, timeout=QUEUE_TIMEOUT):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='password') if workers > 0 else None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._timeout = timeout
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise PasswordBusy()
+        try:
+            if self._executor is None:
+                return function(*args)
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def verify(self, password_hash, password):
+        """Check a password against its stored hash"""
+        return bool(password_hash) and self._run(check_password_hash, password_hash, password)
+
+    def hash(self, password):
+        """hash_password on the pool"""
+        return self._run(hash_password, password)
+
+
+password_pool = PasswordPool()
@@ -0,0 +1,98 @@
+import threading
+
+
+def scope_of(role, user_id, agent_id):
+    """Agent whose customers a principal may see: themselves for agents, their agent for collaborators"""
+    if role == 'agent':
+        return user_id
+    if role == 'collaborator':
+        return agent_id
+    return None
+
+
+# Per-principal authorization index
+class AccessIndex:
+    """Customer and order visibility of every logged-in principal.
+
+    Admins see everything. Agents see the customers assigned to them,
+    collaborators the customers of their agent, and both see the orders of
+    those customers plus the orders they created. The customer IDs of an
+    agent are loaded once into a set shared by the whole team, tagged with
+    the customers generation of the storage: any customer write moves the
+    generation and the set is reloaded on the next check. Orders are read
+    as they are, so checks are one storage lookup plus set membership and
+    a list of IDs is filtered with one batched lookup.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._customers = {}  # agent_id -> (customers generation, frozenset of customer IDs)
+        self._lock = threading.Lock()
+        self._hits = self._misses = 0
+
+    def customer_ids(self, agent_id):
+        """IDs of the customers assigned to an agent, reloaded after customer writes"""
+        generation = self._storage.generation('customers')
+        entry = self._customers.get(agent_id)
+        if entry is not None and entry[0] == generation:
+            with self._lock:
+                self._hits += 1
+            return entry[1]
+        # The generation is read first, so a set loaded during a write is reloaded next time
+        ids = frozenset(customer.id for customer in self._storage.get_customers_by_agent(agent_id))
+        with self._lock:
+            self._misses += 1
+            self._customers[agent_id] = (generation, ids)
+        return ids
+
+    def load(self, role, user_id, agent_id):
+        """Build the index of a principal, called at login"""
+        scope = scope_of(role, user_id, agent_id)
+        if scope is not None:
+            self.customer_ids(scope)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'evictions': 0, 'size': len(self._customers)}
+
+    # ---------- Checks ----------
+
+    def can_view_customer(self, role, user_id, agent_id, customer_id):
+        if role == 'admin':
+            return True
+        scope = scope_of(role, user_id, agent_id)
+        return scope is not None and customer_id in self.customer_ids(scope)
+
+    def can_view_order(self, role, user_id, agent_id, order_id):
+        if role == 'admin':
+            return True
+        order = self._storage.get_order_by_id(order_id)
+        if order is None:
+            return False
+        if order.user_id == user_id:
+            return True
+        scope = scope_of(role, user_id, agent_id)
+        return scope is not None and order.customer_id in self.customer_ids(scope)
+
+    def visible_customer_ids(self, role, user_id, agent_id, customer_ids):
+        """The given customer IDs the principal may see, in their order"""
+        if role == 'admin':
+            return list(customer_ids)
+        scope = scope_of(role, user_id, agent_id)
+        if scope is None:
+            return []
+        visible = self.customer_ids(scope)
+        return [customer_id for customer_id in customer_ids if customer_id in visible]
+
+    def visible_order_ids(self, role, user_id, agent_id, order_ids):
+        """The given order IDs the principal may see, in their order"""
+        order_ids = list(order_ids)
+        if role == 'admin':
+            return order_ids
+        orders = self._storage.get_orders_by_ids(order_ids)
+        scope = scope_of(role, user_id, agent_id)
+        customers = self.customer_ids(scope) if scope is not None else frozenset()
+        return [
+            order_id for order_id in order_ids
+            if order_id in orders and (orders[order_id].user_id == user_id or orders[order_id].customer_id in customers)
+        ]
@@ -0,0 +1,335 @@
+import atexit
+import json
+import os
+import threading
+import time
+from models import User, Customer, Product, PriceList, Order, OrderItem, Payment
+
+# Model class of each Storage table, used to rebuild rows on restore
+MODEL_CLASSES = {
+    'users': User,
+    'customers': Customer,
+    'products': Product,
+    'price_lists': PriceList,
+    'orders': Order,
+    'order_items': OrderItem,
+    'payments': Payment
+}
+
+SEGMENT_PREFIX = 'wal-'
+SNAPSHOT_PREFIX = 'snapshot-'
+
+def _encode(record):
+    """Encode a log/snapshot record as one compact JSON line"""
+    return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+def _list_numbered(directory, prefix, suffix):
+    """List (number, path) pairs of files named <prefix><number><suffix>, oldest first"""
+    result = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix):
+            number = name[len(prefix):-len(suffix)]
+            if number.isdigit():
+                result.append((int(number), os.path.join(directory, name)))
+    return sorted(result)
+
+def _fsync_directory(directory):
+    """Make renames and unlinks in a directory durable (no-op where unsupported)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """Append-only log of Storage writes, split into numbered segments.
+
+    Appends only go to an in-memory buffer. A background thread writes the
+    buffer out as one group (group commit) every ``flush_interval`` seconds, or
+    as soon as ``max_buffer`` records are pending, and fsyncs every
+    ``fsync_batch`` groups (0 leaves syncing to the OS). With
+    ``synchronous=True`` an append blocks until its group has been written.
+    """
+
+    def __init__(self, directory, segment, flush_interval=0.05, fsync_batch=1,
+                 synchronous=False, max_buffer=1024):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.fsync_batch = fsync_batch
+        self.synchronous = synchronous
+        self.max_buffer = max_buffer
+
+        self._lock = threading.Lock()  # guards the buffer and LSN counters
+        self._io_lock = threading.Lock()  # guards the open segment file
+        self._written = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._buffer = []
+        self._appended_lsn = 0
+        self._written_lsn = 0
+        self._groups_since_fsync = 0
+
+        self.segment = segment
+        self._file = open(self._segment_path(segment), 'ab')
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='storage-wal', daemon=True)
+        self._thread.start()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment:08d}.log")
+
+    @property
+    def appended_lsn(self):
+        """Sequence number of the last appended record"""
+        return self._appended_lsn
+
+    def append(self, record):
+        """Queue a record for the next group commit and return its sequence number"""
+        line = _encode(record)
+        with self._lock:
+            self._buffer.append(line)
+            self._appended_lsn += 1
+            lsn = self._appended_lsn
+            pending = len(self._buffer)
+        if self.synchronous or pending >= self.max_buffer:
+            self._wake.set()
+        if self.synchronous:
+            self.wait_written(lsn)
+        return lsn
+
+    def wait_written(self, lsn):
+        """Block until the record with the given sequence number has been written"""
+        with self._written:
+            while self._written_lsn < lsn and not self._closed:
+                self._written.wait()
+
+    def flush(self, fsync=False):
+        """Write every buffered record as one group; fsync per policy or when asked"""
+        with self._io_lock:
+            if not self._closed:
+                self._flush_locked(fsync)
+
+    def _flush_locked(self, fsync):
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            lsn = self._appended_lsn
+        if batch:
+            self._file.write(b''.join(batch))
+            self._file.flush()
+            self._groups_since_fsync += 1
+        if self._groups_since_fsync and (fsync or (self.fsync_batch and self._groups_since_fsync >= self.fsync_batch)):
+            os.fsync(self._file.fileno())
+            self._groups_since_fsync = 0
+        with self._written:
+            self._written_lsn = lsn
+            self._written.notify_all()
+
+    def rotate(self):
+        """Seal the current segment and continue in a new one; returns the new segment number"""
+        with self._io_lock:
+            self._flush_locked(fsync=True)
+            self._file.close()
+            self.segment += 1
+            self._file = open(self._segment_path(self.segment), 'ab')
+            _fsync_directory(self.directory)
+            return self.segment
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if not self._closed:
+                self.flush()
+
+    def close(self):
+        """Flush and fsync outstanding records and stop the flusher thread"""
+        if self._closed:
+            return
+        with self._io_lock:
+            self._flush_locked(fsync=True)
+            self._closed = True
+            self._file.close()
+        self._wake.set()
+        with self._written:
+            self._written.notify_all()
+
+
+class Persistence:
+    """Durable state for an in-memory Storage: write-ahead log plus periodic snapshots.
+
+    A snapshot is written by sealing the current log segment first and then
+    dumping every table, so every write missing from the snapshot is in a
+    segment at or after the one it records. Restoring loads the latest
+    snapshot and replays those segments; replay is idempotent, so a write
+    that is both in the snapshot and in the log is harmless. A directory must
+    be owned by a single process.
+    """
+
+    def __init__(self, directory, snapshot_interval=300, flush_interval=0.05,
+                 fsync_batch=1, synchronous=False):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.flush_interval = flush_interval
+        self.fsync_batch = fsync_batch
+        self.synchronous = synchronous
+        self._storage = None
+        self._wal = None
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_lsn = 0
+        self._pending = None  # records of the open batch, written as one entry
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Build from STORAGE_* environment variables, or None when STORAGE_DATA_DIR is unset"""
+        directory = os.environ.get('STORAGE_DATA_DIR')
+        if not directory:
+            return None
+        return cls(
+            directory,
+            snapshot_interval=float(os.environ.get('STORAGE_SNAPSHOT_INTERVAL', 300)),
+            flush_interval=float(os.environ.get('STORAGE_FLUSH_INTERVAL', 0.05)),
+            fsync_batch=int(os.environ.get('STORAGE_FSYNC_BATCH', 1)),
+            synchronous=os.environ.get('STORAGE_SYNC_COMMIT', '0') == '1'
+        )
+
+    # ---------- Restore ----------
+
+    def restore(self, storage):
+        """Load the latest snapshot and replay the log tail into storage; False if there is no state"""
+        snapshots = _list_numbered(self.directory, SNAPSHOT_PREFIX, '.jsonl')
+        segments = _list_numbered(self.directory, SEGMENT_PREFIX, '.log')
+        first_segment = 0
+
+        if snapshots:
+            with open(snapshots[-1][1], 'rb') as f:
+                header = json.loads(f.readline())
+                for line in f:
+                    entity_type, row = json.loads(line)
+                    storage._put(entity_type, MODEL_CLASSES[entity_type].from_dict(row))
+            first_segment = header['segment']
+            for entity_type, last_id in header.get('sequences', {}).items():
+                storage._sequences[entity_type] = max(storage._sequences[entity_type], last_id)
+
+        for segment, path in segments:
+            if segment >= first_segment:
+                self._replay(storage, path)
+
+        return bool(snapshots or segments)
+
+    def _replay(self, storage, path):
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn record can only be the tail of a crashed segment
+                    break
+                # A batch is one line, so it is either replayed whole or not at all
+                for op, entity_type, payload in (record[1] if record[0] == 'b' else (record,)):
+                    if op == 'p':
+                        storage._put(entity_type, MODEL_CLASSES[entity_type].from_dict(payload))
+                    elif op == 'd' and payload in getattr(storage, entity_type):
+                        storage._remove(entity_type, payload)
+
+    # ---------- Logging ----------
+
+    def start(self, storage, snapshot_now=False):
+        """Start logging writes of storage to a fresh segment and start the snapshotter"""
+        self._storage = storage
+        segments = _list_numbered(self.directory, SEGMENT_PREFIX, '.log')
+        next_segment = segments[-1][0] + 1 if segments else 1
+        self._wal = WriteAheadLog(
+            self.directory, next_segment,
+            flush_interval=self.flush_interval,
+            fsync_batch=self.fsync_batch,
+            synchronous=self.synchronous
+        )
+        if snapshot_now:
+            self.snapshot()
+        if self.snapshot_interval:
+            self._thread = threading.Thread(target=self._run, name='storage-snapshot', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _log(self, record):
+        if self._pending is not None:
+            self._pending.append(record)
+        else:
+            self._wal.append(record)
+
+    def log_put(self, entity_type, entity):
+        """Record an insert or update"""
+        self._log(('p', entity_type, entity.to_dict()))
+
+    def log_delete(self, entity_type, entity_id):
+        """Record a delete"""
+        self._log(('d', entity_type, entity_id))
+
+    def begin_batch(self):
+        """Collect the following records until end_batch instead of appending them"""
+        self._pending = []
+
+    def end_batch(self):
+        """Append the collected records as one log entry"""
+        records, self._pending = self._pending, None
+        if records:
+            self._wal.append(('b', records))
+
+    # ---------- Snapshots ----------
+
+    def snapshot(self):
+        """Write the full state of storage and drop the log segments it covers"""
+        with self._snapshot_lock:
+            lsn = self._wal.appended_lsn
+            segment = self._wal.rotate()
+            # Copy under the read lock so the snapshot never holds half of a batch
+            with self._storage._lock.read():
+                tables = {name: dict(getattr(self._storage, name)) for name in MODEL_CLASSES}
+                sequences = dict(self._storage._sequences)
+
+            path = os.path.join(self.directory, f"{SNAPSHOT_PREFIX}{segment:08d}.jsonl")
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(_encode({
+                    'segment': segment,
+                    'created_at': time.time(),
+                    'sequences': sequences
+                }))
+                for entity_type, rows in tables.items():
+                    f.writelines(_encode((entity_type, row.to_dict())) for row in rows.values())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            _fsync_directory(self.directory)
+
+            # The new snapshot covers every older snapshot and sealed segment
+            for number, old_path in _list_numbered(self.directory, SNAPSHOT_PREFIX, '.jsonl'):
+                if number < segment:
+                    os.remove(old_path)
+            for number, old_path in _list_numbered(self.directory, SEGMENT_PREFIX, '.log'):
+                if number < segment:
+                    os.remove(old_path)
+            self._snapshot_lsn = lsn
+            return path
+
+    def _run(self):
+        while not self._stop.wait(self.snapshot_interval):
+            if self._wal.appended_lsn != self._snapshot_lsn:
+                self.snapshot()
+
+    def close(self):
+        """Stop the snapshotter and make every logged write durable"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._wal is not None:
+            self._wal.close()
@@ -0,0 +1,108 @@
+from bisect import bisect_right, insort
+
+
+class _Tiers:
+    """Quantity breaks of one (customer, product) pair"""
+    __slots__ = ('rows', 'quantities', 'prices')
+
+    def __init__(self):
+        self.rows = []  # (min_quantity, price_list_id, custom_price), sorted
+        self.quantities = ()
+        self.prices = ()
+
+    def rebuild(self):
+        quantities, prices = [], []
+        for min_quantity, _, price in self.rows:
+            # Two rows on the same break: the one with the lowest ID wins
+            if quantities and quantities[-1] == min_quantity:
+                continue
+            quantities.append(min_quantity)
+            prices.append(price)
+        self.quantities, self.prices = tuple(quantities), tuple(prices)
+
+
+# Effective-price index
+class PriceMatrix:
+    """Effective unit prices of every customer and product, by quantity.
+
+    Each (customer, product) pair with price list rows keeps its quantity
+    breaks as two parallel sorted tuples, so resolving a price is a binary
+    search over the pair's tiers: the custom price of the highest break the
+    quantity reaches, or the product's list price below the first break and
+    for pairs without rows. Price list and product writes update only the
+    pair or the list price they touch.
+
+    Registered as a Storage listener; reads happen under the storage read lock.
+    """
+
+    def __init__(self):
+        self._tiers = {}  # (customer_id, product_id) -> _Tiers
+        self._filed = {}  # price_list_id -> ((customer_id, product_id), row) it is filed as
+        self._list_prices = {}  # product_id -> list price
+
+    # ---------- Storage listener ----------
+
+    def on_put(self, entity_type, entity):
+        if entity_type == 'price_lists':
+            self._unfile(entity.id)
+            self._file(entity)
+        elif entity_type == 'products':
+            self._list_prices[entity.id] = entity.price
+
+    def on_remove(self, entity_type, entity):
+        if entity_type == 'price_lists':
+            self._unfile(entity.id)
+        elif entity_type == 'products':
+            self._list_prices.pop(entity.id, None)
+
+    def _file(self, price_list):
+        # Rows without a price leave the list price in place
+        if price_list.custom_price is None:
+            return
+        min_quantity = price_list.min_quantity if price_list.min_quantity is not None else 1
+        key = (price_list.customer_id, price_list.product_id)
+        row = (min_quantity, price_list.id, price_list.custom_price)
+        tiers = self._tiers.get(key)
+        if tiers is None:
+            tiers = self._tiers[key] = _Tiers()
+        insort(tiers.rows, row)
+        tiers.rebuild()
+        self._filed[price_list.id] = (key, row)
+
+    def _unfile(self, price_list_id):
+        filed = self._filed.pop(price_list_id, None)
+        if filed is None:
+            return
+        key, row = filed
+        tiers = self._tiers[key]
+        tiers.rows.remove(row)
+        if tiers.rows:
+            tiers.rebuild()
+        else:
+            del self._tiers[key]
+
+    # ---------- Reads ----------
+
+    def price(self, customer_id, product_id, quantity=1):
+        """Unit price of a product for a customer buying quantity of it, None for unknown products"""
+        if product_id not in self._list_prices:
+            return None
+        tiers = self._tiers.get((customer_id, product_id))
+        if tiers is not None:
+            index = bisect_right(tiers.quantities, quantity)
+            if index:
+                return tiers.prices[index - 1]
+        return self._list_prices[product_id]
+
+    def prices(self, customer_id, product_ids=None, quantity=1):
+        """{product_id: unit price} at one quantity; the whole catalog when product_ids is None"""
+        if product_ids is None:
+            product_ids = self._list_prices
+        price, known = self.price, self._list_prices
+        return {product_id: price(customer_id, product_id, quantity) for product_id in product_ids if product_id in known}
+
+    def order_prices(self, customer_id, lines):
+        """Unit price of every (product_id, quantity) line, None for unknown products"""
+        price = self.price
+        return [price(customer_id, product_id, quantity) for product_id, quantity in lines]
+
@@ -0,0 +1,205 @@
+from columnar import _month_key
+
+# Materialized monthly sales rollups
+class SalesRollups:
+    """Sales, commission and order count per month, kept up to date by deltas.
+
+    Four rollups are maintained: per (user, month), (agent, month),
+    (customer, month) and per month overall. Every bucket holds
+    ``[sales, commission, orders]``. Item writes apply the difference
+    between the item's old and new contribution, moving or re-dating an
+    order moves its running totals between buckets, and reassigning a
+    customer to another agent moves that customer's monthly buckets.
+    Reads cost O(months in the range) whatever the number of orders.
+
+    Registered as a Storage listener.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self.by_user = {}
+        self.by_agent = {}
+        self.by_customer = {}
+        self.by_month = {}
+        self._item_values = {}  # item_id -> (order_id, sales, commission) last applied
+        self._order_totals = {}  # order_id -> [sales, commission]
+        self._order_keys = {}  # order_id -> (month, user_id, customer_id)
+        self._agent_by_customer = {}
+
+    # ---------- Storage listener ----------
+
+    def on_put(self, entity_type, entity):
+        if entity_type == 'order_items':
+            self._put_item(entity)
+        elif entity_type == 'orders':
+            self._put_order(entity)
+        elif entity_type == 'customers':
+            self._set_agent(entity.id, entity.agent_id)
+
+    def on_remove(self, entity_type, entity):
+        if entity_type == 'order_items':
+            self._remove_item(entity.id)
+        elif entity_type == 'orders':
+            self._remove_order(entity.id)
+        elif entity_type == 'customers':
+            self._set_agent(entity.id, None)
+            self._agent_by_customer.pop(entity.id, None)
+
+    # ---------- Delta application ----------
+
+    @staticmethod
+    def _add(buckets, key, sales, commission, orders):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [0.0, 0.0, 0]
+        bucket[0] += sales
+        bucket[1] += commission
+        bucket[2] += orders
+        # A bucket without orders has no items either; dropping it also drops float residue
+        if bucket[2] <= 0:
+            del buckets[key]
+
+    def _apply(self, order_id, sales, commission, orders):
+        """Add a delta to every bucket the order belongs to"""
+        key = self._order_keys.get(order_id)
+        if key is None:
+            return
+        month, user_id, customer_id = key
+        self._add(self.by_month, month, sales, commission, orders)
+        self._add(self.by_user, (user_id, month), sales, commission, orders)
+        self._add(self.by_customer, (customer_id, month), sales, commission, orders)
+        agent_id = self._agent_by_customer.get(customer_id)
+        if agent_id is not None:
+            self._add(self.by_agent, (agent_id, month), sales, commission, orders)
+
+    def _order_delta(self, order_id, sales, commission):
+        totals = self._order_totals.setdefault(order_id, [0.0, 0.0])
+        totals[0] += sales
+        totals[1] += commission
+        self._apply(order_id, sales, commission, 0)
+
+    def _put_item(self, item):
+        total = item.price * item.quantity
+        commission = total * (item.commission_rate or 0.0) / 100
+        old = self._item_values.get(item.id)
+        if old is not None:
+            self._order_delta(old[0], -old[1], -old[2])
+        self._item_values[item.id] = (item.order_id, total, commission)
+        self._order_delta(item.order_id, total, commission)
+
+    def _remove_item(self, item_id):
+        old = self._item_values.pop(item_id, None)
+        if old is not None:
+            self._order_delta(old[0], -old[1], -old[2])
+
+    def _put_order(self, order):
+        key = (_month_key(order.order_date), order.user_id, order.customer_id)
+        old_key = self._order_keys.get(order.id)
+        if old_key == key:
+            return
+        sales, commission = self._order_totals.get(order.id, (0.0, 0.0))
+        if old_key is not None:
+            self._apply(order.id, -sales, -commission, -1)
+        self._order_keys[order.id] = key
+        self._apply(order.id, sales, commission, 1)
+
+    def _remove_order(self, order_id):
+        if order_id not in self._order_keys:
+            return
+        sales, commission = self._order_totals.get(order_id, (0.0, 0.0))
+        self._apply(order_id, -sales, -commission, -1)
+        del self._order_keys[order_id]
+        # Items left behind keep their totals and count again if the order comes back
+        if not self._storage._items_by_order.ids(order_id):
+            self._order_totals.pop(order_id, None)
+
+    def _set_agent(self, customer_id, agent_id):
+        old_agent_id = self._agent_by_customer.get(customer_id)
+        self._agent_by_customer[customer_id] = agent_id
+        if old_agent_id == agent_id:
+            return
+        # The customer's monthly buckets are exactly what moves between agents
+        months = {self._order_keys[order_id][0]
+                  for order_id in self._storage._orders_by_customer.ids(customer_id)
+                  if order_id in self._order_keys}
+        for month in months:
+            bucket = self.by_customer.get((customer_id, month))
+            if bucket is None:
+                continue
+            sales, commission, orders = bucket
+            if old_agent_id is not None:
+                self._add(self.by_agent, (old_agent_id, month), -sales, -commission, -orders)
+            if agent_id is not None:
+                self._add(self.by_agent, (agent_id, month), sales, commission, orders)
+
+    # ---------- Reads ----------
+
+    def _buckets(self, user_id=None, agent_id=None, customer_id=None):
+        if user_id is not None:
+            return self.by_user, lambda month: (user_id, month)
+        if agent_id is not None:
+            return self.by_agent, lambda month: (agent_id, month)
+        if customer_id is not None:
+            return self.by_customer, lambda month: (customer_id, month)
+        return self.by_month, lambda month: month
+
+    def order_total(self, order_id):
+        """Sales of a single order, i.e. the sum of its item totals"""
+        totals = self._order_totals.get(order_id)
+        return totals[0] if totals is not None else 0.0
+
+    def monthly_sales(self, year, user_id=None, agent_id=None, customer_id=None):
+        """Sales of each month of a year"""
+        buckets, key = self._buckets(user_id, agent_id, customer_id)
+        first = year * 12
+        return [buckets.get(key(month), (0.0,))[0] for month in range(first, first + 12)]
+
+    def period_totals(self, start_month, end_month, user_id=None, agent_id=None, customer_id=None):
+        """(sales, commission, orders) over whole months, given as inclusive (year, month) bounds"""
+        buckets, key = self._buckets(user_id, agent_id, customer_id)
+        sales = commission = 0.0
+        orders = 0
+        for month in range(start_month[0] * 12 + start_month[1] - 1, end_month[0] * 12 + end_month[1]):
+            bucket = buckets.get(key(month))
+            if bucket is not None:
+                sales += bucket[0]
+                commission += bucket[1]
+                orders += bucket[2]
+        return sales, commission, orders
+
+    # ---------- Consistency check ----------
+
+    def verify(self, tolerance=1e-6):
+        """Recompute every rollup from the Storage tables and list the buckets that differ"""
+        storage = self._storage
+        expected = {'by_user': {}, 'by_agent': {}, 'by_customer': {}, 'by_month': {}}
+        totals = {}
+        for item in storage.order_items.values():
+            total = item.price * item.quantity
+            sales, commission = totals.get(item.order_id, (0.0, 0.0))
+            totals[item.order_id] = (sales + total, commission + total * (item.commission_rate or 0.0) / 100)
+
+        for order in storage.orders.values():
+            month = _month_key(order.order_date)
+            sales, commission = totals.get(order.id, (0.0, 0.0))
+            customer = storage.customers.get(order.customer_id)
+            keys = [('by_month', month), ('by_user', (order.user_id, month)), ('by_customer', (order.customer_id, month))]
+            if customer is not None and customer.agent_id is not None:
+                keys.append(('by_agent', (customer.agent_id, month)))
+            for rollup, key in keys:
+                bucket = expected[rollup].setdefault(key, [0.0, 0.0, 0])
+                bucket[0] += sales
+                bucket[1] += commission
+                bucket[2] += 1
+
+        mismatches = []
+        for rollup, buckets in expected.items():
+            actual = getattr(self, rollup)
+            for key in buckets.keys() | actual.keys():
+                want = buckets.get(key, [0.0, 0.0, 0])
+                have = actual.get(key, [0.0, 0.0, 0])
+                if (want[2] != have[2]
+                        or abs(want[0] - have[0]) > tolerance * max(1.0, abs(want[0]))
+                        or abs(want[1] - have[1]) > tolerance * max(1.0, abs(want[1]))):
+                    mismatches.append({'rollup': rollup, 'key': key, 'expected': want, 'actual': have})
+        return mismatches
@@ -1,15 +1,28 @@
+import hashlib
+import io
+import logging
 from datetime import datetime
+from operator import attrgetter
+import click
 from flask import render_template, request, redirect, url_for, flash, jsonify, session
 from app import app
+from cache import GenerationCache
 from auth import login_user, logout_user, login_required, admin_required, agent_required, can_view_customer, can_view_order
 from models import User, Customer, Product, PriceList, Order, OrderItem, Payment
 from storage import db
-from utils import format_currency, format_date, get_order_total, get_order_paid_amount, get_order_balance, get_order_with_details, get_customer_orders, calculate_commission
+from passwords import PasswordBusy
+from importer import FORMATS, IMPORTERS, detect_format, read_rows, import_rows
+from utils import (
+    format_currency, format_date, parse_date, encode_order_cursor, decode_order_cursor,
+    enrich_orders, get_order_with_details, get_order_items_with_details, get_customer_orders, calculate_commissions
+)
 from forms import (
     LoginForm, CustomerForm, ProductForm, OrderForm, 
     OrderItemForm, PaymentForm, PriceListForm
 )
 
+logger = logging.getLogger(__name__)
+
 # Register custom filters
 app.jinja_env.filters['currency'] = format_currency
 app.jinja_env.filters['format_date'] = format_date
@@ -41,7 +54,11 @@ def login():
         username = form.username.data
         password = form.password.data
         
-        success, token = login_user(username, password)
+        try:
+            success, token = login_user(username, password)
+        except PasswordBusy:
+            flash('Troppi accessi in corso, riprova tra qualche secondo', 'warning')
+            return render_template('login.html', form=form), 503
         if success:
             return redirect(url_for('dashboard'))
         else:
@@ -60,63 +77,25 @@ def logout():
 @login_required
 def dashboard():
     user_id = session.get('user_id')
-    role = session.get('role')
     
-    # Get stats for the current month
+    # Figures of the user's role, kept up to date by the storage as orders are written
+    snapshot = db.get_dashboard_snapshot(user_id)
     now = datetime.now()
-    first_day = datetime(now.year, now.month, 1)
-    
-    if role == 'admin':
-        all_orders = db.get_all_orders()
-        customers_count = len(db.get_all_customers())
-        users_count = len(db.get_all_users())
-    elif role == 'agent':
-        all_orders = db.get_orders_by_agent(user_id)
-        customers_count = len(db.get_customers_by_agent(user_id))
-        users_count = len(db.get_collaborators_by_agent(user_id)) + 1  # +1 for the agent
-    else:  # collaborator
-        all_orders = db.get_orders_by_user(user_id)
-        agent_id = session.get('agent_id')
-        customers_count = len(db.get_customers_by_agent(agent_id))
-        users_count = 1  # Just themselves
-    
-    # Filter orders for the current month
-    month_orders = [o for o in all_orders if o.order_date.month == now.month and o.order_date.year == now.year]
-    
-    # Calculate total sales
-    total_sales = 0
-    for order in month_orders:
-        total_sales += get_order_total(order.id)
-    
-    # Get recent orders
-    recent_orders = sorted(all_orders, key=lambda o: o.order_date, reverse=True)[:5]
-    recent_orders_with_details = []
-    
-    for order in recent_orders:
-        customer = db.get_customer_by_id(order.customer_id)
-        order_dict = order.to_dict()
-        order_dict['customer_name'] = customer.name if customer else "Unknown"
-        order_dict['total_amount'] = get_order_total(order.id)
-        recent_orders_with_details.append(order_dict)
-    
-    # Get sales data for chart
-    sales_data = db.get_monthly_sales_data(
-        user_id=user_id if role == 'collaborator' else None,
-        agent_id=user_id if role == 'agent' else (session.get('agent_id') if role == 'collaborator' else None),
-        year=now.year
-    )
-    
-    # Get commission data
-    commission_info = calculate_commission(user_id, first_day, now)
+    commission_info = {
+        'total_sales': snapshot['total_sales'],
+        'total_commission': snapshot['total_commission'],
+        'start_date': datetime(now.year, now.month, 1),
+        'end_date': now
+    }
     
     return render_template(
         'dashboard.html',
-        orders_count=len(month_orders),
-        customers_count=customers_count,
-        users_count=users_count,
-        total_sales=total_sales,
-        recent_orders=recent_orders_with_details,
-        sales_data=sales_data,
+        orders_count=snapshot['orders_count'],
+        customers_count=snapshot['customers_count'],
+        users_count=snapshot['users_count'],
+        total_sales=snapshot['total_sales'],
+        recent_orders=enrich_orders(snapshot['recent_orders']),
+        sales_data=snapshot['sales_data'],
         commission_info=commission_info
     )
 
@@ -180,18 +159,20 @@ def customer_detail(customer_id):
     orders = get_customer_orders(customer_id)
     
     # Get custom price lists for the customer
-    price_lists = db.get_price_lists_by_customer(customer_id)
+    price_lists = sorted(db.get_price_lists_by_customer(customer_id), key=attrgetter('product_id', 'min_quantity', 'id'))
+    products_by_id = db.get_products_by_ids(pl.product_id for pl in price_lists)
     price_list_items = []
     
     for pl in price_lists:
-        product = db.get_product_by_id(pl.product_id)
+        product = products_by_id.get(pl.product_id)
         if product:
             price_list_items.append({
                 'id': pl.id,
                 'product_id': pl.product_id,
                 'product_name': product.name,
                 'standard_price': product.price,
-                'custom_price': pl.custom_price
+                'custom_price': pl.custom_price,
+                'min_quantity': pl.min_quantity
             })
     
     # Get all products for the custom price list form
@@ -261,6 +242,10 @@ def customer_price_list_add(customer_id):
     
     product_id = request.form.get('product_id', type=int)
     custom_price = request.form.get('custom_price', type=float)
+    min_quantity = request.form.get('min_quantity', 1, type=int)
+    if min_quantity < 1:
+        flash('La quantità minima deve essere almeno 1', 'danger')
+        return redirect(url_for('customer_detail', customer_id=customer_id))
     
     # Check if product exists
     product = db.get_product_by_id(product_id)
@@ -268,20 +253,21 @@ def customer_price_list_add(customer_id):
         flash('Prodotto non trovato', 'danger')
         return redirect(url_for('customer_detail', customer_id=customer_id))
     
-    # Check if price list already exists for this product
-    for pl in db.get_price_lists_by_customer(customer_id):
-        if pl.product_id == product_id:
-            pl.custom_price = custom_price
-            db.update_price_list(pl)
-            flash('Prezzo personalizzato aggiornato con successo', 'success')
-            return redirect(url_for('customer_detail', customer_id=customer_id))
+    # Check if price list already exists for this product and quantity break
+    pl = db.get_price_list_for_customer_product(customer_id, product_id, min_quantity)
+    if pl:
+        pl.custom_price = custom_price
+        db.update_price_list(pl)
+        flash('Prezzo personalizzato aggiornato con successo', 'success')
+        return redirect(url_for('customer_detail', customer_id=customer_id))
     
     # Create new price list
     price_list = PriceList(
         id=None,
         customer_id=customer_id,
         product_id=product_id,
-        custom_price=custom_price
+        custom_price=custom_price,
+        min_quantity=min_quantity
     )
     
     db.add_price_list(price_list)
@@ -360,28 +346,57 @@ def product_delete(product_id):
     return redirect(url_for('products_list'))
 
 # Orders routes
+ORDERS_PER_PAGE = 25
+
 @app.route('/orders')
 @login_required
 def orders_list():
     role = session.get('role')
     user_id = session.get('user_id')
     
+    # Orders and customers visible to the user
     if role == 'admin':
-        orders = db.get_all_orders()
+        scope = {}
+        customers = db.get_all_customers()
     elif role == 'agent':
-        orders = db.get_orders_by_agent(user_id)
+        scope = {'agent_id': user_id}
+        customers = db.get_customers_by_agent(user_id)
     else:  # collaborator
-        orders = db.get_orders_by_user(user_id)
+        scope = {'user_id': user_id}
+        customers = db.get_customers_by_agent(session.get('agent_id'))
+    
+    # Filters, sorting and the keyset cursor come from the query string
+    start_date = parse_date(request.args.get('start_date'))
+    end_date = parse_date(request.args.get('end_date'))
+    if end_date:
+        end_date = datetime.combine(end_date, datetime.max.time())
+    cursor = decode_order_cursor(request.args.get('cursor'))
+    orders, next_cursor = db.get_orders_page(
+        customer_id=request.args.get('customer_id', type=int),
+        status=request.args.get('status') or None,
+        start_date=start_date,
+        end_date=end_date,
+        descending=request.args.get('sort') != 'asc',
+        cursor=cursor,
+        limit=ORDERS_PER_PAGE,
+        **scope
+    )
+    
+    # Enrich only the page being shown, with one batched lookup per kind
+    orders_with_details = enrich_orders(orders)
     
-    orders_with_details = []
-    for order in orders:
-        customer = db.get_customer_by_id(order.customer_id)
-        order_dict = order.to_dict()
-        order_dict['customer_name'] = customer.name if customer else "Unknown"
-        order_dict['total_amount'] = get_order_total(order.id)
-        orders_with_details.append(order_dict)
+    filters = {key: value for key, value in request.args.items() if key != 'cursor' and value}
+    next_url = url_for('orders_list', cursor=encode_order_cursor(next_cursor), **filters) if next_cursor else None
+    first_url = url_for('orders_list', **filters) if cursor else None
     
-    return render_template('orders.html', orders=orders_with_details)
+    return render_template(
+        'orders.html',
+        orders=orders_with_details,
+        customers=customers,
+        filters=filters,
+        next_url=next_url,
+        first_url=first_url
+    )
 
 @app.route('/orders/new', methods=['GET', 'POST'])
 @login_required
@@ -419,64 +434,34 @@ def order_new():
             notes=request.form.get('notes')
         )
         
-        # Add the order
-        order = db.add_order(order)
-        
-        # Add order items from form data
+        # Collect order items from form data
         item_count = int(request.form.get('item_count', 0))
         
-        # Log all form data for debugging
-        print("==== ORDER FORM DATA START ====")
-        for key, value in request.form.items():
-            print(f"Field: {key}, Value: {value}")
-        print("==== ORDER FORM DATA END ====")
+        logger.debug("Order form received", extra={'customer_id': customer_id, 'item_count': item_count})
         
+        order_items = []
         for i in range(item_count):
             try:
                 product_id = int(request.form.get(f'product_id_{i}'))
                 quantity = int(request.form.get(f'quantity_{i}'))
                 price = float(request.form.get(f'price_{i}'))
                 commission_rate = float(request.form.get(f'commission_rate_{i}', 0.0))
-                
-                # Print debugging information
-                print(f"Processing item {i}")
-                print(f"Product ID: {product_id}")
-                print(f"Quantity: {quantity}")
-                print(f"Price: {price}")
-                print(f"Commission Rate: {commission_rate}")
             except (ValueError, TypeError) as e:
-                print(f"Error processing item {i}: {str(e)}")
+                logger.info("Skipping order line %d: %s", i, e)
                 continue
             
             if product_id and quantity > 0:
-                try:
-                    # Prima di creare l'item, verifica che l'ordine esista ancora
-                    order_check = db.get_order_by_id(order.id)
-                    if not order_check:
-                        print(f"ERRORE: Ordine {order.id} non trovato nel database durante l'aggiunta dell'articolo")
-                        continue
-                    
-                    order_item = OrderItem(
-                        id=None,
-                        order_id=order.id,
-                        product_id=product_id,
-                        quantity=quantity,
-                        price=price,
-                        commission_rate=commission_rate
-                    )
-                    print(f"Aggiunta item all'ordine {order.id}: Prodotto={product_id}, Quantità={quantity}, Prezzo={price}")
-                    
-                    # Verifica che l'item abbia tutti i campi corretti prima di aggiungerlo
-                    if order_item.order_id is None or order_item.product_id is None:
-                        print(f"ERRORE: Dati item incompleti - order_id={order_item.order_id}, product_id={order_item.product_id}")
-                        continue
-                        
-                    # Aggiungi l'item all'ordine
-                    result_item = db.add_order_item(order_item)
-                    print(f"Item aggiunto con successo, ID: {result_item.id}")
-                except Exception as e:
-                    print(f"ECCEZIONE durante l'aggiunta dell'item: {str(e)}")
-                    continue
+                order_items.append(OrderItem(
+                    id=None,
+                    order_id=None,
+                    product_id=product_id,
+                    quantity=quantity,
+                    price=price,
+                    commission_rate=commission_rate
+                ))
+        
+        # Add the order together with all of its items in one step
+        order = db.add_order_with_items(order, order_items)
         
         flash('Ordine creato con successo', 'success')
         return redirect(url_for('order_detail', order_id=order.id))
@@ -589,30 +574,108 @@ def reports():
         sales_data = db.get_monthly_sales_data(user_id=user_id, year=year)
         user_list = [db.get_user_by_id(user_id)]  # Just the collaborator
     
-    # Calculate commission for each user
-    user_commissions = []
-    for user in user_list:
-        if role == 'admin' or (role == 'agent' and user.id == user_id) or user.id == user_id:
-            commission_info = calculate_commission(user.id)
-            user_commissions.append({
-                'id': user.id,
-                'name': user.full_name or user.username,
-                'role': user.role,
-                'total_sales': commission_info['total_sales'],
-                'total_commission': commission_info['total_commission']
-            })
+    # Sales and commission of every listed user in one pass, agents rolled up over their collaborators
+    user_commissions = calculate_commissions(user_list)
     
     return render_template('reports.html', sales_data=sales_data, user_commissions=user_commissions)
 
+# Bulk import
+@app.route('/admin/import', methods=['GET', 'POST'])
+@admin_required
+def admin_import():
+    result = None
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        if kind not in IMPORTERS or not upload or not upload.filename:
+            flash('Seleziona il tipo di dati e un file da importare', 'danger')
+            return redirect(url_for('admin_import'))
+        
+        try:
+            fmt = request.form.get('format') or detect_format(upload.filename)
+            # Uploads larger than a few hundred KB are spooled to disk by werkzeug,
+            # so the file is streamed row by row instead of being read into memory
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            result = import_rows(db, kind, read_rows(stream, fmt))
+        except ValueError as e:
+            flash(f'Importazione non riuscita: {e}', 'danger')
+            return redirect(url_for('admin_import'))
+        
+        flash(f'Importazione completata: {result.inserted} inseriti, {result.updated} aggiornati, {result.rejected} scartati', 'success')
+    
+    return render_template('import.html', result=result, kinds=list(IMPORTERS), formats=FORMATS)
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(list(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows written per batch.')
+@click.option('--agent-id', type=int, help='Agent assigned to new customers without an agent_id column.')
+def import_data_command(kind, path, fmt, batch_size, agent_id):
+    """Import customers, products or price lists from a CSV or JSONL file."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        result = import_rows(db, kind, read_rows(f, fmt or detect_format(path)), batch_size=batch_size, agent_id=agent_id)
+    
+    click.echo(
+        f"{result.rows} rows in {result.seconds:.2f}s ({result.rows_per_second:,.0f} rows/s): "
+        f"{result.inserted} inserted, {result.updated} updated, {result.rejected} rejected"
+    )
+    for error in result.errors:
+        click.echo(f"  row {error['row']}: {error['errors']}", err=True)
+
+@app.cli.command('check-rollups')
+def check_rollups_command():
+    """Compare the monthly sales rollups with a full recomputation."""
+    mismatches = db.check_rollups()
+    for mismatch in mismatches:
+        click.echo(f"  {mismatch['rollup']} {mismatch['key']}: expected {mismatch['expected']}, got {mismatch['actual']}", err=True)
+    click.echo(f"{len(mismatches)} inconsistent buckets")
+    if mismatches:
+        raise SystemExit(1)
+
 # API endpoints for AJAX requests
+
+# Serialized payloads of the conditional JSON endpoints, keyed by URL and storage generations
+api_responses = GenerationCache(maxsize=512)
+
+def _conditional_json(depends_on, build):
+    """JSON response of build() with a strong ETag derived from the generations of depends_on.
+    
+    The payload only changes when one of those entity types is written, so a
+    matching If-None-Match gets an empty 304 without calling build, and the
+    serialized bytes are cached until a generation moves. The ETag depends only
+    on the storage, so workers sharing a SQLite database hand out the same one.
+    Returns None when build() returns None, leaving the error response to the caller."""
+    generations = tuple(db.generation(entity_type) for entity_type in depends_on)
+    digest = hashlib.blake2b(repr((request.full_path, generations)).encode(), digest_size=10).hexdigest()
+    etag = f'{db.instance_id}-{digest}'
+    
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        def serialize():
+            payload = build()
+            return None if payload is None else app.json.dumps(payload).encode()
+        body = api_responses.get_or_compute('json', (request.full_path, generations), (), serialize)
+        if body is None:
+            return None
+        response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Browsers keep the payload but revalidate it on every fetch
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/api/products/<int:product_id>')
 @login_required
 def api_product_detail(product_id):
-    product = db.get_product_by_id(product_id)
-    if not product:
+    response = _conditional_json(('products',), lambda: _product_payload(product_id))
+    if response is None:
         return jsonify({'error': 'Prodotto non trovato'}), 404
-    
-    return jsonify(product.to_dict())
+    return response
+
+def _product_payload(product_id):
+    product = db.get_product_by_id(product_id)
+    return product.to_dict() if product else None
 
 @app.route('/api/customers/<int:customer_id>/price/<int:product_id>')
 @login_required
@@ -620,11 +683,46 @@ def api_customer_price(customer_id, product_id):
     if not can_view_customer(customer_id):
         return jsonify({'error': 'Permesso negato'}), 403
     
-    price = db.get_price_for_customer_product(customer_id, product_id)
-    if price is None:
+    quantity = request.args.get('quantity', 1, type=int)
+    if quantity < 1:
+        return jsonify({'error': 'Quantità non valida'}), 400
+    
+    response = _conditional_json(('products', 'price_lists'), lambda: _price_payload(customer_id, product_id, quantity))
+    if response is None:
         return jsonify({'error': 'Prezzo non trovato'}), 404
+    return response
+
+def _price_payload(customer_id, product_id, quantity):
+    price = db.get_price_for_customer_product(customer_id, product_id, quantity)
+    return None if price is None else {'price': price}
+
+PRICES_MAX_PRODUCTS = 1000
+
+# Effective prices of many products in one response: ?product_ids=1,2,3, or the whole catalog
+# without it, at ?quantity= (default 1)
+@app.route('/api/customers/<int:customer_id>/prices')
+@login_required
+def api_customer_prices(customer_id):
+    if not can_view_customer(customer_id):
+        return jsonify({'error': 'Permesso negato'}), 403
     
-    return jsonify({'price': price})
+    product_ids = None
+    if 'product_ids' in request.args:
+        values = [value.strip() for value in request.args['product_ids'].split(',') if value.strip()]
+        if not all(value.isdigit() for value in values):
+            return jsonify({'error': 'ID prodotto non valido'}), 400
+        if len(values) > PRICES_MAX_PRODUCTS:
+            return jsonify({'error': f'Troppi prodotti (massimo {PRICES_MAX_PRODUCTS})'}), 400
+        product_ids = [int(value) for value in values]
+    quantity = request.args.get('quantity', 1, type=int)
+    if quantity < 1:
+        return jsonify({'error': 'Quantità non valida'}), 400
+    
+    return _conditional_json(('products', 'price_lists'), lambda: {
+        'customer_id': customer_id,
+        'quantity': quantity,
+        'prices': db.get_prices_for_customer(customer_id, product_ids, quantity)
+    })
 
 @app.route('/api/customers/<int:customer_id>/price-list')
 @login_required
@@ -632,28 +730,43 @@ def api_customer_price_list(customer_id):
     if not can_view_customer(customer_id):
         return jsonify({'error': 'Permesso negato'}), 403
     
+    return _conditional_json(('products', 'price_lists'), lambda: _price_list_payload(customer_id))
+
+def _price_list_payload(customer_id):
     # Ottieni tutti i prodotti
     all_products = db.get_all_products()
     products_with_prices = []
     
-    # Ottieni il listino prezzi personalizzato per questo cliente
-    custom_price_list = db.get_price_lists_by_customer(customer_id)
-    custom_prices = {item.product_id: item.custom_price for item in custom_price_list}
+    # Ottieni il listino prezzi personalizzato per questo cliente, con gli scaglioni di quantità
+    custom_price_list = sorted(db.get_price_lists_by_customer(customer_id), key=attrgetter('min_quantity', 'id'))
+    price_tiers = {}
+    for item in custom_price_list:
+        # Rows without a price add no tier, so the product keeps its list price;
+        # a break listed twice takes the price of the older row, like the pricing engine
+        if item.custom_price is None:
+            continue
+        tiers = price_tiers.get(item.product_id)
+        if tiers is None:
+            price_tiers[item.product_id] = [{'min_quantity': item.min_quantity, 'price': item.custom_price}]
+        elif tiers[-1]['min_quantity'] != item.min_quantity:
+            tiers.append({'min_quantity': item.min_quantity, 'price': item.custom_price})
+    unit_prices = db.get_prices_for_customer(customer_id, price_tiers)
     
     # Prepara i dati dei prodotti con i prezzi personalizzati
     for product in all_products:
         product_dict = product.to_dict()
-        # Se esiste un prezzo personalizzato per questo prodotto, usalo
-        if product.id in custom_prices:
-            product_dict['price'] = custom_prices[product.id]
+        # Se esiste un prezzo personalizzato per questo prodotto, usalo (prezzo per quantità 1)
+        if product.id in price_tiers:
+            product_dict['price'] = unit_prices[product.id]
             product_dict['has_custom_price'] = True
+            product_dict['price_tiers'] = price_tiers[product.id]
             products_with_prices.append(product_dict)
         # Se il cliente non ha un listino prezzi personalizzato, mostra tutti i prodotti
-        elif not custom_prices:
+        elif not price_tiers:
             product_dict['has_custom_price'] = False
             products_with_prices.append(product_dict)
     
-    return jsonify(products_with_prices)
+    return products_with_prices
 
 @app.route('/api/orders/<int:order_id>/items')
 @login_required
@@ -661,5 +774,107 @@ def api_order_items(order_id):
     if not can_view_order(order_id):
         return jsonify({'error': 'Permesso negato'}), 403
     
-    items = get_order_items_with_details(order_id)
-    return jsonify(items)
+    return _conditional_json(('order_items', 'products'), lambda: get_order_items_with_details(order_id))
+
+ORDER_STATUSES = ('pending', 'confirmed', 'shipped', 'delivered', 'cancelled')
+ORDER_MAX_LINES = 1000
+
+def _parse_order_lines(lines):
+    """Validate the lines of a JSON order; return (line number, product_id, quantity,
+    commission_rate) tuples and the errors found"""
+    parsed, errors = [], []
+    if not isinstance(lines, list) or not lines:
+        return parsed, ["'lines' deve essere una lista non vuota"]
+    if len(lines) > ORDER_MAX_LINES:
+        return parsed, [f"Un ordine può avere al massimo {ORDER_MAX_LINES} righe"]
+    for index, line in enumerate(lines):
+        if not isinstance(line, dict):
+            errors.append(f"Riga {index}: deve essere un oggetto")
+            continue
+        product_id, quantity = line.get('product_id'), line.get('quantity')
+        commission_rate = line.get('commission_rate', 0.0)
+        if not isinstance(product_id, int) or isinstance(product_id, bool):
+            errors.append(f"Riga {index}: product_id non valido")
+        elif not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+            errors.append(f"Riga {index}: la quantità deve essere un intero positivo")
+        elif not isinstance(commission_rate, (int, float)) or isinstance(commission_rate, bool) \
+                or not 0 <= commission_rate <= 100:
+            errors.append(f"Riga {index}: commission_rate deve essere tra 0 e 100")
+        else:
+            parsed.append((index, product_id, quantity, float(commission_rate)))
+    return parsed, errors
+
+@app.route('/api/orders', methods=['POST'])
+@login_required
+def api_order_create():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Corpo JSON non valido'}), 400
+    
+    customer_id = data.get('customer_id')
+    if not isinstance(customer_id, int) or db.get_customer_by_id(customer_id) is None:
+        return jsonify({'error': 'Cliente non trovato'}), 404
+    if not can_view_customer(customer_id):
+        return jsonify({'error': 'Permesso negato'}), 403
+    status = data.get('status', 'pending')
+    notes = data.get('notes')
+    
+    # Every line is checked before anything is written
+    lines, errors = _parse_order_lines(data.get('lines'))
+    if status not in ORDER_STATUSES:
+        errors.append('Stato non valido')
+    if notes is not None and not isinstance(notes, str):
+        errors.append('Le note devono essere un testo')
+    # Prices come from the customer's price list and quantity breaks, never from the client
+    prices = db.get_order_prices(customer_id, [(product_id, quantity) for _, product_id, quantity, _ in lines])
+    errors.extend(
+        f"Riga {index}: prodotto {product_id} non trovato"
+        for (index, product_id, _, _), price in zip(lines, prices) if price is None
+    )
+    if errors:
+        return jsonify({'error': 'Ordine non valido', 'details': errors}), 400
+    
+    order = Order(
+        id=None,
+        customer_id=customer_id,
+        order_date=datetime.now(),
+        user_id=session.get('user_id'),
+        status=status,
+        notes=notes
+    )
+    items = [
+        OrderItem(id=None, order_id=None, product_id=product_id, quantity=quantity,
+                  price=price, commission_rate=commission_rate)
+        for (_, product_id, quantity, commission_rate), price in zip(lines, prices)
+    ]
+    # The order and all of its items are written in one batch
+    order = db.add_order_with_items(order, items)
+    return jsonify(get_order_with_details(order.id)), 201
+
+SEARCH_TYPES = ('customers', 'products')
+SEARCH_MAX_LIMIT = 50
+
+@app.route('/api/search')
+@login_required
+def api_search():
+    query = request.args.get('q', '').strip()
+    search_type = request.args.get('type', 'all')
+    if search_type != 'all' and search_type not in SEARCH_TYPES:
+        return jsonify({'error': 'Tipo di ricerca non valido'}), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), SEARCH_MAX_LIMIT)
+    
+    # Agenti e collaboratori cercano solo tra i clienti dell'agente
+    role = session.get('role')
+    if role == 'admin':
+        agent_id = None
+    elif role == 'agent':
+        agent_id = session.get('user_id')
+    else:  # collaborator
+        agent_id = session.get('agent_id')
+    
+    types = SEARCH_TYPES if search_type == 'all' else (search_type,)
+    results = {
+        entity_type: [row.to_dict() for row in db.search(entity_type, query, limit=limit, agent_id=agent_id)]
+        for entity_type in types
+    }
+    return jsonify(results)
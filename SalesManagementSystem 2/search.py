@@ -0,0 +1,217 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+
+# Searchable attributes of each entity type; the first two also rank exact and prefix matches
+SEARCH_FIELDS = {
+    'customers': ('name', 'vat_number', 'city', 'contact_person'),
+    'products': ('name', 'code', 'category')
+}
+_PRIMARY_FIELDS = 2
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def normalize_term(value):
+    """Casefolded, stripped text of a field value or query; '' for None"""
+    return str(value).casefold().strip() if value is not None else ''
+
+
+def split_words(text):
+    """The words of normalized text, as matched by search"""
+    return _WORD_RE.findall(text)
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _Collection:
+    """Search structures of one entity type.
+
+    ``postings`` maps every indexed word to the ids containing it and
+    ``words`` keeps the distinct words sorted, so all words starting with a
+    prefix are one bisect away. New words are merged into ``words`` on the
+    next query (one sort for a bulk load, insort for a few) and words whose
+    postings emptied are skipped until a compaction. ``trigrams`` maps each
+    three-character substring of the indexed text to the ids containing it,
+    so substring candidates are the intersection of a few posting sets.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.values = {}  # id -> normalized field values
+        self.postings = {}
+        self.trigrams = {}
+        self._words = []
+        self._new_words = []
+        self._stale_words = 0
+        self._words_lock = threading.Lock()  # concurrent readers may merge new words
+        self._words_by_id = {}
+
+    def add(self, entity):
+        values = tuple(normalize_term(getattr(entity, field, None)) for field in self.fields)
+        if self.values.get(entity.id) == values:
+            return
+        self.remove(entity.id)
+        self.values[entity.id] = values
+        # Whole values are indexed too, so codes like "PRD-001" match as typed
+        words = set()
+        for value in values:
+            if value:
+                words.add(value)
+                words.update(split_words(value))
+        primary_words = tuple(word for value in values[:_PRIMARY_FIELDS] for word in split_words(value))
+        self._words_by_id[entity.id] = (primary_words, words)
+        for word in words:
+            ids = self.postings.get(word)
+            if ids is None:
+                ids = self.postings[word] = set()
+                self._new_words.append(word)
+            ids.add(entity.id)
+        for trigram in _trigrams('\x1f'.join(values)):
+            self.trigrams.setdefault(trigram, set()).add(entity.id)
+
+    def remove(self, entity_id):
+        values = self.values.pop(entity_id, None)
+        if values is None:
+            return
+        for word in self._words_by_id.pop(entity_id)[1]:
+            ids = self.postings[word]
+            ids.discard(entity_id)
+            if not ids:
+                del self.postings[word]
+                self._stale_words += 1
+        for trigram in _trigrams('\x1f'.join(values)):
+            ids = self.trigrams[trigram]
+            ids.discard(entity_id)
+            if not ids:
+                del self.trigrams[trigram]
+
+    def _sorted_words(self):
+        with self._words_lock:
+            if self._stale_words > len(self.postings) or len(self._new_words) > 64:
+                self._words = sorted(self.postings)
+                self._stale_words = 0
+            else:
+                for word in self._new_words:
+                    insort(self._words, word)
+            self._new_words = []
+            return self._words
+
+    def prefix_ids(self, prefix):
+        """Yield the ids having a word that starts with prefix, in word order"""
+        words = self._sorted_words()
+        for position in range(bisect_left(words, prefix), len(words)):
+            word = words[position]
+            if not word.startswith(prefix):
+                break
+            yield from self.postings.get(word, ())
+
+    def substring_ids(self, words):
+        """Yield the ids containing every trigram of the words (a superset of their substring matches)"""
+        postings = sorted(
+            (self.trigrams.get(trigram, ()) for word in words for trigram in _trigrams(word)),
+            key=len
+        )
+        if not postings:
+            return
+        smallest, others = postings[0], postings[1:]
+        for entity_id in smallest:
+            if all(entity_id in ids for ids in others):
+                yield entity_id
+
+    def _word_match(self, entity_id, word, primary_only=False):
+        indexed = self._words_by_id[entity_id][0 if primary_only else 1]
+        return any(candidate.startswith(word) for candidate in indexed)
+
+    def matches(self, entity_id, words):
+        """True if every query word is a word prefix or, from three characters, a substring"""
+        text = '\x1f'.join(self.values[entity_id])
+        return all(
+            (len(word) >= 3 and word in text) or self._word_match(entity_id, word)
+            for word in words
+        )
+
+    def score(self, entity_id, phrase, words):
+        """0 exact name/code, 1 name/code prefix, 2 word prefixes in name/code,
+        3 word prefixes in any field, 4 substrings only"""
+        primary = self.values[entity_id][:_PRIMARY_FIELDS]
+        if phrase in primary:
+            return 0
+        if any(value.startswith(phrase) for value in primary):
+            return 1
+        if all(self._word_match(entity_id, word, primary_only=True) for word in words):
+            return 2
+        if all(self._word_match(entity_id, word) for word in words):
+            return 3
+        return 4
+
+
+# In-memory search index over customers and products
+class SearchIndex:
+    """Prefix and substring search over the fields in SEARCH_FIELDS.
+
+    Registered as a Storage listener, so it follows every add, update and
+    delete. Queries examine a bounded number of entities (max_candidates)
+    whatever the table size: prefix matches of the longest query word come
+    first in word order, substring matches are only examined when those do
+    not fill the page, and the matches are ranked by quality and name.
+    """
+
+    def __init__(self, max_candidates=200):
+        self.max_candidates = max_candidates
+        self._collections = {entity_type: _Collection(fields) for entity_type, fields in SEARCH_FIELDS.items()}
+
+    # ---------- Storage listener ----------
+
+    def on_put(self, entity_type, entity):
+        collection = self._collections.get(entity_type)
+        if collection is not None:
+            collection.add(entity)
+
+    def on_remove(self, entity_type, entity):
+        collection = self._collections.get(entity_type)
+        if collection is not None:
+            collection.remove(entity.id)
+
+    # ---------- Queries ----------
+
+    def search(self, entity_type, query, limit=20, allowed=None):
+        """Return the ids of the best matches for query, best first.
+
+        allowed, when given, is the collection of ids the caller may see."""
+        collection = self._collections[entity_type]
+        phrase = normalize_term(query)
+        words = split_words(phrase)
+        if not words or limit <= 0:
+            return []
+
+        if allowed is not None and len(allowed) <= self.max_candidates:
+            # A small scope is cheaper to check row by row than to search
+            candidates = [i for i in allowed if i in collection.values and collection.matches(i, words)]
+        else:
+            # Prefix matches of the most selective word come first, substring
+            # matches only fill up when they are too few to fill the page
+            candidates = {}
+            examined = 0
+            for entity_id in collection.prefix_ids(max(words, key=len)):
+                if examined >= self.max_candidates:
+                    break
+                examined += 1
+                if entity_id not in candidates and (allowed is None or entity_id in allowed) \
+                        and collection.matches(entity_id, words):
+                    candidates[entity_id] = None
+            long_words = [word for word in words if len(word) >= 3]
+            if len(candidates) < limit and long_words:
+                for entity_id in collection.substring_ids(long_words):
+                    if len(candidates) >= limit or examined >= 2 * self.max_candidates:
+                        break
+                    examined += 1
+                    if entity_id not in candidates and (allowed is None or entity_id in allowed) \
+                            and collection.matches(entity_id, words):
+                        candidates[entity_id] = None
+
+        ranked = ((collection.score(i, phrase, words), collection.values[i][0], i) for i in candidates)
+        return [entity_id for _, _, entity_id in heapq.nsmallest(limit, ranked)]
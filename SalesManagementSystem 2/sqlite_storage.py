@@ -0,0 +1,776 @@
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from cache import GenerationCache
+from dashboard import RECENT_ORDERS, order_scope, principal_of
+from persistence import MODEL_CLASSES
+from search import SEARCH_FIELDS, normalize_term, split_words
+
+# Columns of each table, in the order used by the INSERT/UPDATE statements
+COLUMNS = {
+    'users': ('id', 'username', 'email', 'password_hash', 'role', 'full_name', 'agent_id', 'created_at'),
+    'customers': ('id', 'name', 'vat_number', 'address', 'city', 'zip_code', 'country',
+                  'contact_person', 'email', 'phone', 'agent_id', 'created_at'),
+    'products': ('id', 'name', 'code', 'description', 'price', 'unit', 'category', 'created_at'),
+    'price_lists': ('id', 'customer_id', 'product_id', 'custom_price', 'min_quantity', 'created_at'),
+    'orders': ('id', 'customer_id', 'order_date', 'user_id', 'status', 'notes', 'updated_at',
+               'order_code', 'created_at'),
+    'order_items': ('id', 'order_id', 'product_id', 'quantity', 'price', 'commission_rate', 'created_at'),
+    'payments': ('id', 'order_id', 'amount', 'payment_date', 'payment_method', 'notes', 'created_at')
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE, email TEXT, password_hash TEXT,
+    role TEXT NOT NULL, full_name TEXT, agent_id INTEGER, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_users_agent ON users (agent_id, role);
+
+CREATE TABLE IF NOT EXISTS customers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, vat_number TEXT, address TEXT, city TEXT, zip_code TEXT,
+    country TEXT, contact_person TEXT, email TEXT, phone TEXT, agent_id INTEGER, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_customers_agent ON customers (agent_id);
+CREATE INDEX IF NOT EXISTS ix_customers_vat_number ON customers (vat_number);
+
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, code TEXT, description TEXT, price REAL, unit TEXT,
+    category TEXT, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_products_code ON products (code);
+
+CREATE TABLE IF NOT EXISTS price_lists (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, customer_id INTEGER NOT NULL, product_id INTEGER NOT NULL,
+    custom_price REAL, min_quantity NUMERIC NOT NULL DEFAULT 1, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_price_lists_customer ON price_lists (customer_id, product_id);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, customer_id INTEGER NOT NULL, order_date TEXT NOT NULL,
+    user_id INTEGER NOT NULL, status TEXT, notes TEXT, updated_at TEXT, order_code TEXT, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_orders_user ON orders (user_id, order_date);
+CREATE INDEX IF NOT EXISTS ix_orders_customer ON orders (customer_id, order_date);
+CREATE INDEX IF NOT EXISTS ix_orders_date ON orders (order_date);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, order_id INTEGER NOT NULL, product_id INTEGER NOT NULL,
+    quantity NUMERIC, price REAL, commission_rate REAL, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_order_items_order ON order_items (order_id);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, order_id INTEGER NOT NULL, amount REAL, payment_date TEXT,
+    payment_method TEXT, notes TEXT, created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_payments_order ON payments (order_id);
+
+CREATE TABLE IF NOT EXISTS generations (entity_type TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# Columns added after the first release, as (table, column, definition)
+_ADDED_COLUMNS = (
+    ('price_lists', 'min_quantity', 'NUMERIC NOT NULL DEFAULT 1'),
+)
+
+# Statements are module constants so sqlite3's per-connection statement cache
+# compiles each of them once and reuses the prepared statement afterwards
+_INSERT_SQL = {
+    table: f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+    for table, cols in COLUMNS.items()
+}
+_UPSERT_SQL = {table: sql.replace('INSERT', 'INSERT OR REPLACE', 1) for table, sql in _INSERT_SQL.items()}
+_UPDATE_SQL = {
+    table: f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in cols[1:])} WHERE id = ?"
+    for table, cols in COLUMNS.items()
+}
+_SELECT_SQL = {table: f"SELECT * FROM {table}" for table in COLUMNS}
+_BUMP_GENERATION_SQL = "UPDATE generations SET value = value + 1 WHERE entity_type = ?"
+
+_ORDER_ITEM_TOTAL = "i.price * i.quantity"
+_ORDER_ITEM_COMMISSION = "i.price * i.quantity * i.commission_rate / 100"
+_DATE_RANGE = "(?1 IS NULL OR o.order_date >= ?1) AND (?2 IS NULL OR o.order_date <= ?2)"
+
+_SUM_BY_USER_SQL = f"""
+    SELECT COALESCE(SUM({{expr}}), 0) FROM order_items i JOIN orders o ON o.id = i.order_id
+    WHERE o.user_id = ?3 AND {_DATE_RANGE}
+"""
+_TOTAL_SALES_BY_USER_SQL = _SUM_BY_USER_SQL.format(expr=_ORDER_ITEM_TOTAL)
+_TOTAL_COMMISSIONS_BY_USER_SQL = _SUM_BY_USER_SQL.format(expr=_ORDER_ITEM_COMMISSION)
+_TOTAL_SALES_BY_AGENT_SQL = f"""
+    SELECT COALESCE(SUM({_ORDER_ITEM_TOTAL}), 0) FROM order_items i
+    JOIN orders o ON o.id = i.order_id JOIN customers c ON c.id = o.customer_id
+    WHERE c.agent_id = ?3 AND {_DATE_RANGE}
+"""
+_SALES_AND_COMMISSIONS_SQL = f"""
+    SELECT COALESCE(SUM({_ORDER_ITEM_TOTAL}), 0), COALESCE(SUM({_ORDER_ITEM_COMMISSION}), 0)
+    FROM order_items i JOIN orders o ON o.id = i.order_id LEFT JOIN customers c ON c.id = o.customer_id
+    WHERE {_DATE_RANGE} AND (?3 IS NULL OR o.user_id = ?3) AND (?4 IS NULL OR c.agent_id = ?4)
+"""
+_SALES_BY_USER_SQL = f"""
+    SELECT o.user_id, SUM({_ORDER_ITEM_TOTAL}), SUM({_ORDER_ITEM_COMMISSION}), COUNT(DISTINCT o.id)
+    FROM order_items i JOIN orders o ON o.id = i.order_id
+    WHERE {_DATE_RANGE}
+    GROUP BY o.user_id
+"""
+_MONTHLY_SALES_SQL = f"""
+    SELECT CAST(substr(o.order_date, 6, 2) AS INTEGER), SUM({_ORDER_ITEM_TOTAL})
+    FROM order_items i JOIN orders o ON o.id = i.order_id LEFT JOIN customers c ON c.id = o.customer_id
+    WHERE o.order_date >= ?1 AND o.order_date < ?2
+      AND (?3 IS NULL OR o.user_id = ?3) AND (?4 IS NULL OR c.agent_id = ?4)
+    GROUP BY 1
+"""
+_PERIOD_TOTALS_SQL = f"""
+    SELECT COALESCE(SUM((SELECT SUM({_ORDER_ITEM_TOTAL}) FROM order_items i WHERE i.order_id = o.id)), 0),
+           COALESCE(SUM((SELECT SUM({_ORDER_ITEM_COMMISSION}) FROM order_items i WHERE i.order_id = o.id)), 0),
+           COUNT(*)
+    FROM orders o LEFT JOIN customers c ON c.id = o.customer_id
+    WHERE o.order_date >= ?1 AND o.order_date < ?2
+      AND (?3 IS NULL OR o.user_id = ?3) AND (?4 IS NULL OR c.agent_id = ?4) AND (?5 IS NULL OR o.customer_id = ?5)
+"""
+_ORDERS_PAGE_SQL = """
+    SELECT o.* FROM orders o
+    WHERE (?1 IS NULL OR o.user_id = ?1)
+      AND (?2 IS NULL OR o.customer_id IN (SELECT id FROM customers WHERE agent_id = ?2))
+      AND (?3 IS NULL OR o.customer_id = ?3) AND (?4 IS NULL OR o.status = ?4)
+      AND (?5 IS NULL OR o.order_date >= ?5) AND (?6 IS NULL OR o.order_date <= ?6)
+      AND (?7 IS NULL OR (o.order_date, o.id) {op} (?7, ?8))
+    ORDER BY o.order_date {direction}, o.id {direction} LIMIT ?9
+"""
+_ORDERS_PAGE_DESC_SQL = _ORDERS_PAGE_SQL.format(op='<', direction='DESC')
+_ORDERS_PAGE_ASC_SQL = _ORDERS_PAGE_SQL.format(op='>', direction='ASC')
+# The custom price of the highest quantity break reached by {quantity}, for customer ?2 and product p
+_TIER_PRICE = """(
+    SELECT pl.custom_price FROM price_lists pl
+    WHERE pl.customer_id = ?2 AND pl.product_id = p.id AND pl.min_quantity <= {quantity}
+      AND pl.custom_price IS NOT NULL
+    ORDER BY pl.min_quantity DESC, pl.id LIMIT 1
+)"""
+_CATALOG_PRICES_FOR_CUSTOMER_SQL = f"SELECT p.id, COALESCE({_TIER_PRICE.format(quantity='?3')}, p.price) FROM products p"
+_PRICE_FOR_CUSTOMER_PRODUCT_SQL = _CATALOG_PRICES_FOR_CUSTOMER_SQL + " WHERE p.id = ?1"
+# Lines are a JSON array of [product_id, quantity] pairs; the key is the line index
+_ORDER_PRICES_SQL = f"""
+    SELECT l.key, COALESCE({_TIER_PRICE.format(quantity="json_extract(l.value, '$[1]')")}, p.price)
+    FROM json_each(?1) l JOIN products p ON p.id = json_extract(l.value, '$[0]')
+"""
+_PRICES_FOR_CUSTOMER_SQL = _CATALOG_PRICES_FOR_CUSTOMER_SQL + " WHERE p.id IN (SELECT value FROM json_each(?1))"
+_ORDER_TOTALS_SQL = f"""
+    SELECT i.order_id, SUM({_ORDER_ITEM_TOTAL}) FROM order_items i
+    WHERE i.order_id IN (SELECT value FROM json_each(?)) GROUP BY i.order_id
+"""
+_PAID_AMOUNTS_SQL = """
+    SELECT order_id, SUM(amount) FROM payments
+    WHERE order_id IN (SELECT value FROM json_each(?)) GROUP BY order_id
+"""
+_CUSTOMERS_PAGE_SQL = _SELECT_SQL['customers'] + """
+    WHERE (?1 IS NULL OR agent_id = ?1) AND (?2 IS NULL OR id > ?2) ORDER BY id LIMIT ?3
+"""
+_PRODUCTS_PAGE_SQL = _SELECT_SQL['products'] + " WHERE (?1 IS NULL OR id > ?1) ORDER BY id LIMIT ?2"
+
+
+# Every query word must occur in one of the searched columns; exact and
+# prefix matches on the first two columns rank first, as in search.SearchIndex.
+# Columns are compared through normalize_term, registered on every connection,
+# because lower() and LIKE only fold ASCII letters; it turns NULL into ''
+_SEARCH_SQL_TEMPLATE = """
+    SELECT * FROM {table}
+    WHERE NOT EXISTS (
+        SELECT 1 FROM json_each(?1) w
+        WHERE NOT ({any_column})
+    ) AND {scope}
+    ORDER BY CASE WHEN normalize_term({first}) = ?2 OR normalize_term({second}) = ?2 THEN 0
+                  WHEN instr(normalize_term({first}), ?2) = 1 OR instr(normalize_term({second}), ?2) = 1 THEN 1
+                  ELSE 2 END, normalize_term({first}), id
+    LIMIT ?3
+"""
+_SEARCH_SQL = {
+    table: _SEARCH_SQL_TEMPLATE.format(
+        table=table,
+        any_column=' OR '.join(f"instr(normalize_term({column}), w.value) > 0" for column in columns),
+        scope='(?4 IS NULL OR agent_id = ?4)' if table == 'customers' else '?4 IS NULL',
+        first=columns[0],
+        second=columns[1]
+    )
+    for table, columns in SEARCH_FIELDS.items()
+}
+
+
+def _to_db(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class _ConnectionPool:
+    """Hands each thread its own connection to the database, opened on first use"""
+
+    def __init__(self, path, cached_statements=256):
+        self.path = path
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=30,
+                isolation_level=None,  # transactions are managed explicitly
+                check_same_thread=False,
+                cached_statements=self.cached_statements
+            )
+            conn.row_factory = sqlite3.Row
+            conn.create_function('normalize_term', 1, normalize_term, deterministic=True)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+# SQLite storage engine, a drop-in replacement for the in-memory Storage
+class SQLiteStorage:
+    """Storage backend on a SQLite database in WAL mode.
+
+    Exposes the same methods as ``storage.Storage``. Several processes can
+    share one database file, so nothing is cached in-process: ``cache`` is a
+    zero-size GenerationCache and the generation counters live in the database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pool = _ConnectionPool(path)
+        self.cache = GenerationCache(maxsize=0)
+
+        conn = self._pool.connection()
+        conn.executescript(SCHEMA)
+        with self._transaction() as conn:
+            self._add_new_columns(conn)
+            conn.executemany(
+                "INSERT OR IGNORE INTO generations (entity_type, value) VALUES (?, 0)",
+                [(table,) for table in COLUMNS]
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES ('instance_id', ?)", (uuid.uuid4().hex[:8],)
+            )
+            # Shared by every process on this file, like the generations
+            self.instance_id = conn.execute("SELECT value FROM metadata WHERE name = 'instance_id'").fetchone()[0]
+            if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+                self._init_demo_data()
+
+    def _add_new_columns(self, conn):
+        """Bring tables created by earlier versions up to COLUMNS"""
+        for table, column, definition in _ADDED_COLUMNS:
+            if column not in {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def close(self):
+        """Close every pooled connection"""
+        self._pool.close()
+
+    # Demo data is shared with the in-memory backend and written through _put
+    def _init_demo_data(self):
+        from storage import Storage
+        Storage._init_demo_data(self)
+
+    @contextmanager
+    def _transaction(self, *entity_types):
+        """Run a write transaction and bump the generation of the given entity types"""
+        conn = self._pool.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            for entity_type in entity_types:
+                conn.execute(_BUMP_GENERATION_SQL, (entity_type,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def batch(self):
+        """Group writes into a single transaction"""
+        return self._transaction(*COLUMNS)
+
+    def generation(self, entity_type):
+        """Get the generation counter of an entity type, bumped on every write to it"""
+        row = self._pool.connection().execute(
+            "SELECT value FROM generations WHERE entity_type = ?", (entity_type,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    # ---------- Generic row helpers ----------
+
+    def _row_values(self, table, entity):
+        return [_to_db(getattr(entity, column, None)) for column in COLUMNS[table]]
+
+    def _put(self, table, entity):
+        with self._transaction(table) as conn:
+            conn.execute(_UPSERT_SQL[table], self._row_values(table, entity))
+        return entity
+
+    def _insert(self, table, entity):
+        with self._transaction(table) as conn:
+            values = self._row_values(table, entity)
+            cursor = conn.execute(_INSERT_SQL[table], values)
+            if entity.id is None:
+                entity.id = cursor.lastrowid
+        return entity
+
+    def _update(self, table, entity):
+        values = self._row_values(table, entity)
+        with self._transaction(table) as conn:
+            cursor = conn.execute(_UPDATE_SQL[table], values[1:] + values[:1])
+        return entity if cursor.rowcount else None
+
+    def _delete(self, table, entity_id):
+        with self._transaction(table) as conn:
+            cursor = conn.execute(f"DELETE FROM {table} WHERE id = ?", (entity_id,))
+        return cursor.rowcount > 0
+
+    def _fetch_one(self, table, where, params):
+        row = self._pool.connection().execute(f"{_SELECT_SQL[table]} WHERE {where}", params).fetchone()
+        return MODEL_CLASSES[table].from_dict(dict(row)) if row else None
+
+    def _fetch_all(self, table, where=None, params=(), sql=None):
+        if sql is None:
+            sql = f"{_SELECT_SQL[table]} WHERE {where} ORDER BY id" if where else f"{_SELECT_SQL[table]} ORDER BY id"
+        model = MODEL_CLASSES[table]
+        return [model.from_dict(dict(row)) for row in self._pool.connection().execute(sql, params)]
+
+    # User methods
+    def get_user_by_id(self, user_id):
+        """Get a user by ID"""
+        return self._fetch_one('users', "id = ?", (user_id,))
+
+    def get_user_by_username(self, username):
+        """Get a user by username"""
+        return self._fetch_one('users', "username = ?", (username,))
+
+    def add_user(self, user):
+        return self._insert('users', user)
+
+    def update_user(self, user):
+        return self._update('users', user)
+
+    def delete_user(self, user_id):
+        return self._delete('users', user_id)
+
+    def get_all_users(self):
+        return self._fetch_all('users')
+
+    def get_collaborators_by_agent(self, agent_id):
+        return self._fetch_all('users', "agent_id = ? AND role = 'collaborator'", (agent_id,))
+
+    # Customer methods
+    def get_customer_by_id(self, customer_id):
+        """Get a customer by ID"""
+        return self._fetch_one('customers', "id = ?", (customer_id,))
+
+    def get_customer_by_vat_number(self, vat_number):
+        """Get a customer by VAT number"""
+        return self._fetch_one('customers', "vat_number = ? ORDER BY id LIMIT 1", (vat_number,))
+
+    def add_customer(self, customer):
+        """Add a new customer with automatic ID assignment"""
+        return self._insert('customers', customer)
+
+    def update_customer(self, customer):
+        """Update an existing customer"""
+        return self._update('customers', customer)
+
+    def delete_customer(self, customer_id):
+        """Delete a customer by ID"""
+        return self._delete('customers', customer_id)
+
+    def get_all_customers(self):
+        """Get all customers"""
+        return self._fetch_all('customers')
+
+    def get_customers_by_agent(self, agent_id):
+        """Get customers by agent ID"""
+        return self._fetch_all('customers', "agent_id = ?", (agent_id,))
+
+    def get_customers_page(self, agent_id=None, after_id=None, limit=25):
+        """Get one page of customers sorted by ID and the cursor of the next page"""
+        customers = self._fetch_all('customers', sql=_CUSTOMERS_PAGE_SQL, params=(agent_id, after_id, limit + 1))
+        next_cursor = customers[limit - 1].id if len(customers) > limit else None
+        return customers[:limit], next_cursor
+
+    # Product methods
+    def get_product_by_id(self, product_id):
+        """Get a product by ID"""
+        return self._fetch_one('products', "id = ?", (product_id,))
+
+    def get_product_by_code(self, code):
+        """Get a product by its code"""
+        return self._fetch_one('products', "code = ? ORDER BY id LIMIT 1", (code,))
+
+    def add_product(self, product):
+        """Add a new product with automatic ID assignment"""
+        return self._insert('products', product)
+
+    def update_product(self, product):
+        """Update an existing product"""
+        return self._update('products', product)
+
+    def delete_product(self, product_id):
+        """Delete a product by ID"""
+        return self._delete('products', product_id)
+
+    def get_all_products(self):
+        """Get all products"""
+        return self._fetch_all('products')
+
+    def get_products_page(self, after_id=None, limit=25):
+        """Get one page of products sorted by ID and the cursor of the next page"""
+        products = self._fetch_all('products', sql=_PRODUCTS_PAGE_SQL, params=(after_id, limit + 1))
+        next_cursor = products[limit - 1].id if len(products) > limit else None
+        return products[:limit], next_cursor
+
+    # Price list methods
+    def get_price_list_by_id(self, price_list_id):
+        """Get a price list by ID"""
+        return self._fetch_one('price_lists', "id = ?", (price_list_id,))
+
+    def get_price_list_for_customer_product(self, customer_id, product_id, min_quantity=1):
+        """Get the price list row of a customer for a product at a quantity break"""
+        return self._fetch_one(
+            'price_lists', "customer_id = ? AND product_id = ? AND min_quantity = ? ORDER BY id LIMIT 1",
+            (customer_id, product_id, min_quantity)
+        )
+
+    def add_price_list(self, price_list):
+        """Add a new price list with automatic ID assignment"""
+        return self._insert('price_lists', price_list)
+
+    def update_price_list(self, price_list):
+        """Update an existing price list"""
+        return self._update('price_lists', price_list)
+
+    def delete_price_list(self, price_list_id):
+        """Delete a price list by ID"""
+        return self._delete('price_lists', price_list_id)
+
+    def get_price_lists_by_customer(self, customer_id):
+        """Get price lists for a customer"""
+        return self._fetch_all('price_lists', "customer_id = ?", (customer_id,))
+
+    def get_price_for_customer_product(self, customer_id, product_id, quantity=1):
+        """Get the unit price of a product for a customer buying quantity of it: the
+        custom price of the highest quantity break reached in the customer's price
+        list, the product's list price otherwise. None for unknown products."""
+        row = self._pool.connection().execute(
+            _PRICE_FOR_CUSTOMER_PRODUCT_SQL, (product_id, customer_id, quantity)
+        ).fetchone()
+        return row[1] if row else None
+
+    def get_prices_for_customer(self, customer_id, product_ids=None, quantity=1):
+        """Get {product_id: unit price} for a customer at one quantity, priced like
+        get_price_for_customer_product. product_ids=None prices the whole catalog;
+        unknown products are skipped."""
+        if product_ids is None:
+            rows = self._pool.connection().execute(_CATALOG_PRICES_FOR_CUSTOMER_SQL, (None, customer_id, quantity))
+        else:
+            rows = self._pool.connection().execute(
+                _PRICES_FOR_CUSTOMER_SQL, (json.dumps(list(set(product_ids))), customer_id, quantity)
+            )
+        return dict(rows.fetchall())
+
+    def get_order_prices(self, customer_id, lines):
+        """Price a whole order in one call: the unit price of every (product_id,
+        quantity) line for the customer, None for unknown products"""
+        lines = [[product_id, quantity] for product_id, quantity in lines]
+        prices = dict(self._pool.connection().execute(_ORDER_PRICES_SQL, (json.dumps(lines), customer_id)).fetchall())
+        return [prices.get(index) for index in range(len(lines))]
+
+    # Order methods
+    def get_order_by_id(self, order_id):
+        """Get an order by ID"""
+        return self._fetch_one('orders', "id = ?", (order_id,))
+
+    def add_order(self, order):
+        """Add a new order with automatic ID assignment"""
+        return self._insert('orders', order)
+
+    def update_order(self, order):
+        """Update an existing order"""
+        order.updated_at = datetime.now()
+        return self._update('orders', order)
+
+    def delete_order(self, order_id):
+        """Delete an order by ID and its related items"""
+        with self._transaction('orders', 'order_items') as conn:
+            conn.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
+            cursor = conn.execute("DELETE FROM orders WHERE id = ?", (order_id,))
+        return cursor.rowcount > 0
+
+    def add_order_with_items(self, order, items):
+        """Add an order and all of its items in one transaction"""
+        with self._transaction('orders', 'order_items') as conn:
+            self._insert('orders', order)
+            for item in items:
+                item.order_id = order.id
+            new_items = [item for item in items if item.id is None]
+            conn.executemany(_INSERT_SQL['order_items'], [
+                self._row_values('order_items', item) for item in items if item.id is not None
+            ])
+            if new_items:
+                # Rows inserted in one transaction get consecutive AUTOINCREMENT ids
+                conn.executemany(_INSERT_SQL['order_items'], [
+                    self._row_values('order_items', item) for item in new_items
+                ])
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                for offset, item in enumerate(new_items):
+                    item.id = last_id - len(new_items) + 1 + offset
+        return order
+
+    def get_all_orders(self):
+        """Get all orders"""
+        return self._fetch_all('orders')
+
+    def get_orders_by_user(self, user_id):
+        """Get orders by user ID"""
+        return self._fetch_all('orders', "user_id = ?", (user_id,))
+
+    def get_orders_by_customer(self, customer_id):
+        """Get orders by customer ID"""
+        return self._fetch_all('orders', "customer_id = ?", (customer_id,))
+
+    def get_orders_by_agent(self, agent_id):
+        """Get orders for all customers of an agent"""
+        return self._fetch_all('orders', sql=(
+            "SELECT o.* FROM orders o JOIN customers c ON c.id = o.customer_id "
+            "WHERE c.agent_id = ? ORDER BY o.id"
+        ), params=(agent_id,))
+
+    def get_orders_page(self, user_id=None, agent_id=None, customer_id=None, status=None,
+                        start_date=None, end_date=None, descending=True, cursor=None, limit=25):
+        """Get one page of orders sorted by (order_date, id) and the cursor of the next page"""
+        cursor_date, cursor_id = (_to_db(cursor[0]), cursor[1]) if cursor else (None, None)
+        orders = self._fetch_all('orders', sql=_ORDERS_PAGE_DESC_SQL if descending else _ORDERS_PAGE_ASC_SQL, params=(
+            user_id, agent_id, customer_id, status, _to_db(start_date), _to_db(end_date),
+            cursor_date, cursor_id, limit + 1
+        ))
+        next_cursor = (orders[limit - 1].order_date, orders[limit - 1].id) if len(orders) > limit else None
+        return orders[:limit], next_cursor
+
+    # Order item methods
+    def get_order_item_by_id(self, order_item_id):
+        """Get an order item by ID"""
+        return self._fetch_one('order_items', "id = ?", (order_item_id,))
+
+    def add_order_item(self, order_item):
+        """Add a new order item with automatic ID assignment"""
+        return self._insert('order_items', order_item)
+
+    def update_order_item(self, order_item):
+        """Update an existing order item"""
+        return self._update('order_items', order_item)
+
+    def delete_order_item(self, order_item_id):
+        """Delete an order item by ID"""
+        return self._delete('order_items', order_item_id)
+
+    def get_items_by_order(self, order_id):
+        """Get all items for an order"""
+        return self._fetch_all('order_items', "order_id = ?", (order_id,))
+
+    # Payment methods
+    def get_payment_by_id(self, payment_id):
+        """Get a payment by ID"""
+        return self._fetch_one('payments', "id = ?", (payment_id,))
+
+    def add_payment(self, payment):
+        """Add a new payment with automatic ID assignment"""
+        return self._insert('payments', payment)
+
+    def update_payment(self, payment):
+        """Update an existing payment"""
+        return self._update('payments', payment)
+
+    def delete_payment(self, payment_id):
+        """Delete a payment by ID"""
+        return self._delete('payments', payment_id)
+
+    def get_payments_by_order(self, order_id):
+        """Get all payments for an order"""
+        return self._fetch_all('payments', "order_id = ?", (order_id,))
+
+    # Analytical methods, each a single SQL aggregate
+    def _scalar(self, sql, params):
+        return self._pool.connection().execute(sql, params).fetchone()[0]
+
+    def get_total_sales_by_user(self, user_id, start_date=None, end_date=None):
+        """Calculate total sales by user in a date range"""
+        return self._scalar(_TOTAL_SALES_BY_USER_SQL, (_to_db(start_date), _to_db(end_date), user_id))
+
+    def get_total_sales_by_agent(self, agent_id, start_date=None, end_date=None):
+        """Calculate total sales by agent in a date range"""
+        return self._scalar(_TOTAL_SALES_BY_AGENT_SQL, (_to_db(start_date), _to_db(end_date), agent_id))
+
+    def get_total_commissions_by_user(self, user_id, start_date=None, end_date=None):
+        """Calculate total commissions by user in a date range"""
+        return self._scalar(_TOTAL_COMMISSIONS_BY_USER_SQL, (_to_db(start_date), _to_db(end_date), user_id))
+
+    def get_sales_and_commissions(self, user_id=None, agent_id=None, start_date=None, end_date=None):
+        """Calculate (total sales, total commissions) in a date range, optionally
+        restricted to a user's orders or to the orders of an agent's customers"""
+        row = self._pool.connection().execute(
+            _SALES_AND_COMMISSIONS_SQL, (_to_db(start_date), _to_db(end_date), user_id, agent_id)
+        ).fetchone()
+        return row[0], row[1]
+
+    def get_sales_by_user(self, start_date=None, end_date=None):
+        """Calculate {user_id: (total sales, total commissions, orders)} over the
+        orders each user created in a date range, in one pass over the items"""
+        rows = self._pool.connection().execute(_SALES_BY_USER_SQL, (_to_db(start_date), _to_db(end_date)))
+        return {user_id: (sales, commission, orders) for user_id, sales, commission, orders in rows}
+
+    # Search
+    def search(self, entity_type, query, limit=20, agent_id=None):
+        """Search 'customers' or 'products' by prefix and substring, best matches first.
+
+        With agent_id, customers are limited to the ones that agent manages."""
+        phrase = normalize_term(query)
+        words = split_words(phrase)
+        if not words or limit <= 0:
+            return []
+        return self._fetch_all(entity_type, sql=_SEARCH_SQL[entity_type], params=(
+            json.dumps(words),
+            phrase,
+            limit,
+            agent_id if entity_type == 'customers' else None
+        ))
+
+    # Batched lookups used to enrich listings with one call per kind of row
+    def _rows_by_ids(self, table, ids):
+        rows = self._fetch_all(table, "id IN (SELECT value FROM json_each(?))", (json.dumps(list(set(ids))),))
+        return {row.id: row for row in rows}
+
+    def get_customers_by_ids(self, customer_ids):
+        """Get {customer_id: customer} for the given IDs, skipping unknown ones"""
+        return self._rows_by_ids('customers', customer_ids)
+
+    def get_users_by_ids(self, user_ids):
+        """Get {user_id: user} for the given IDs, skipping unknown ones"""
+        return self._rows_by_ids('users', user_ids)
+
+    def get_products_by_ids(self, product_ids):
+        """Get {product_id: product} for the given IDs, skipping unknown ones"""
+        return self._rows_by_ids('products', product_ids)
+
+    def get_orders_by_ids(self, order_ids):
+        """Get {order_id: order} for the given IDs, skipping unknown ones"""
+        return self._rows_by_ids('orders', order_ids)
+
+    def _children_by_order(self, table, order_ids):
+        children = {order_id: [] for order_id in order_ids}
+        for row in self._fetch_all(table, "order_id IN (SELECT value FROM json_each(?))", (json.dumps(list(children)),)):
+            children[row.order_id].append(row)
+        return children
+
+    def get_items_by_orders(self, order_ids):
+        """Get {order_id: its items} for the given orders"""
+        return self._children_by_order('order_items', order_ids)
+
+    def get_payments_by_orders(self, order_ids):
+        """Get {order_id: its payments} for the given orders"""
+        return self._children_by_order('payments', order_ids)
+
+    def get_order_totals(self, order_ids):
+        """Get {order_id: total amount} for the given orders"""
+        totals = dict.fromkeys(order_ids, 0.0)
+        totals.update(self._pool.connection().execute(_ORDER_TOTALS_SQL, (json.dumps(list(totals)),)))
+        return totals
+
+    def get_paid_amounts(self, order_ids):
+        """Get {order_id: sum of its payments} for the given orders"""
+        paid = dict.fromkeys(order_ids, 0.0)
+        paid.update(self._pool.connection().execute(_PAID_AMOUNTS_SQL, (json.dumps(list(paid)),)))
+        return paid
+
+    def get_monthly_sales_data(self, user_id=None, agent_id=None, year=None):
+        """Get monthly sales data"""
+        if year is None:
+            year = datetime.now().year
+
+        # Same precedence as the in-memory backend: user_id wins over agent_id
+        if user_id:
+            agent_id = None
+        monthly_data = [0] * 12
+        rows = self._pool.connection().execute(
+            _MONTHLY_SALES_SQL,
+            (f"{year:04d}-01-01", f"{year + 1:04d}-01-01", user_id or None, agent_id or None)
+        )
+        for month, total in rows:
+            monthly_data[month - 1] = total
+        return monthly_data
+
+    def get_period_totals(self, start_month, end_month, user_id=None, agent_id=None, customer_id=None):
+        """Get (total sales, total commissions, order count) over whole months, from
+        start_month to end_month inclusive, each given as a (year, month) tuple"""
+        # Same precedence as the in-memory rollups: user, then agent, then customer
+        if user_id is not None:
+            agent_id = customer_id = None
+        elif agent_id is not None:
+            customer_id = None
+        end_year, end = divmod(end_month[0] * 12 + end_month[1], 12)
+        row = self._pool.connection().execute(_PERIOD_TOTALS_SQL, (
+            f"{start_month[0]:04d}-{start_month[1]:02d}-01", f"{end_year:04d}-{end + 1:02d}-01",
+            user_id, agent_id, customer_id
+        )).fetchone()
+        return row[0], row[1], row[2]
+
+    def get_dashboard_snapshot(self, user_id):
+        """Get the dashboard figures of a user: the current month's orders count, sales
+        and commission, the monthly sales series, customer and user counts and the
+        five most recent orders, as seen by the user's role"""
+        user = self.get_user_by_id(user_id)
+        if user is None:
+            return None
+        principal = principal_of(user)
+        scope = order_scope(principal)
+        now = datetime.now()
+        month = (now.year, now.month)
+        sales, commission, orders_count = self.get_period_totals(month, month, **scope)
+        if principal[0] == 'admin':
+            customers_count = self._scalar("SELECT COUNT(*) FROM customers", ())
+            users_count = self._scalar("SELECT COUNT(*) FROM users", ())
+        elif principal[0] == 'agent':
+            customers_count = self._scalar("SELECT COUNT(*) FROM customers WHERE agent_id = ?", (user.id,))
+            users_count = self._scalar(
+                "SELECT COUNT(*) FROM users WHERE role = 'collaborator' AND agent_id = ?", (user.id,)
+            ) + 1  # +1 for the agent
+        else:
+            customers_count = self._scalar("SELECT COUNT(*) FROM customers WHERE agent_id = ?", (user.agent_id,))
+            users_count = 1  # Just themselves
+        recent_orders, _ = self.get_orders_page(limit=RECENT_ORDERS, **scope)
+        return {
+            'month': month,
+            'orders_count': orders_count,
+            'total_sales': sales,
+            'total_commission': commission,
+            'customers_count': customers_count,
+            'users_count': users_count,
+            'sales_data': self.get_monthly_sales_data(year=now.year, **scope),
+            'recent_orders': recent_orders
+        }
+
+    def check_rollups(self):
+        """Monthly figures are aggregated by SQL on every call, so there is nothing to drift"""
+        return []
@@ -33,6 +33,10 @@ document.addEventListener('DOMContentLoaded', function() {
                     priceListSection.style.display = 'block';
                 }
                 
+                // Prezzi effettivi di tutto il catalogo per il cliente, con una sola richiesta;
+                // le letture successive la rivalidano con l'ETag
+                loadCustomerPrices(customerId).catch(error => console.error('Error fetching prices:', error));
+                
                 // Carica il listino prezzi per questo cliente
                 fetch(`/api/customers/${customerId}/price-list`)
                     .then(response => response.json())
@@ -75,29 +79,19 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
-    // Add event listener for product price lookup
+    // Add event listeners for product price lookup, at the tier of the entered quantity
     const productSelects = document.querySelectorAll('select[id^="modal_product_id"]');
     productSelects.forEach(select => {
         select.addEventListener('change', function() {
-            const productId = this.value;
-            const customerId = document.getElementById('customer_id')?.value;
-            
-            if (productId && customerId) {
-                // Fetch custom price for this customer and product
-                fetch(`/api/customers/${customerId}/price/${productId}`)
-                    .then(response => response.json())
-                    .then(data => {
-                        if (data.price) {
-                            const priceInput = document.getElementById('modal_price');
-                            if (priceInput) {
-                                priceInput.value = data.price;
-                            }
-                        }
-                    })
-                    .catch(error => console.error('Error fetching price:', error));
-            }
+            updateModalPrice(this.value);
         });
     });
+    const modalQuantity = document.getElementById('modal_quantity');
+    if (modalQuantity) {
+        modalQuantity.addEventListener('input', function() {
+            updateModalPrice(document.querySelector('select[id^="modal_product_id"]')?.value);
+        });
+    }
     
     // Handle sidebar toggling on mobile
     const sidebarToggle = document.getElementById('sidebarToggle');
@@ -147,6 +141,65 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
+// Richieste di prezzi in corso: "cliente:quantità" -> Promise di {productId: prezzo}
+const pendingPrices = new Map();
+
+/**
+ * Carica i prezzi di tutto il catalogo per un cliente alla quantità indicata.
+ * Le richieste uguali in corso sono condivise; ogni nuova lettura rivalida la
+ * risposta con l'ETag, così un listino modificato nel frattempo non resta in cache
+ * @param {string} customerId - ID del cliente
+ * @param {number} quantity - Quantità per cui scegliere lo scaglione
+ * @returns {Promise<Object>} Prezzi unitari per ID prodotto
+ */
+function loadCustomerPrices(customerId, quantity = 1) {
+    const key = `${customerId}:${quantity}`;
+    if (!pendingPrices.has(key)) {
+        const request = fetch(`/api/customers/${customerId}/prices?quantity=${quantity}`, {cache: 'no-cache'})
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => data.prices)
+            .finally(() => pendingPrices.delete(key));
+        pendingPrices.set(key, request);
+    }
+    return pendingPrices.get(key);
+}
+
+/**
+ * Quantità inserita nel modale, come intero da 1 in su: gli scaglioni partono da quantità intere
+ * @returns {number} Quantità
+ */
+function modalQuantity() {
+    const quantity = parseFloat(document.getElementById('modal_quantity')?.value);
+    return quantity >= 1 ? Math.floor(quantity) : 1;
+}
+
+/**
+ * Imposta nel modale il prezzo unitario del prodotto per il cliente e la quantità inseriti
+ * @param {string} productId - ID del prodotto selezionato
+ */
+function updateModalPrice(productId) {
+    const customerId = document.getElementById('customer_id')?.value;
+    const quantity = modalQuantity();
+    
+    if (productId && customerId) {
+        loadCustomerPrices(customerId, quantity)
+            .then(prices => {
+                const price = prices[productId];
+                const priceInput = document.getElementById('modal_price');
+                // Ignora le risposte superate da un altro cambio di quantità
+                if (price && priceInput && modalQuantity() === quantity) {
+                    priceInput.value = price;
+                }
+            })
+            .catch(error => console.error('Error fetching price:', error));
+    }
+}
+
 /**
  * Popola la tabella del listino prezzi del cliente con i prodotti ricevuti dall'API
  * @param {Array} products - Array di prodotti con prezzo personalizzato
@@ -173,6 +226,7 @@ function populateCustomerPriceList(products) {
                     data-product-id="${product.id}" 
                     data-product-name="${product.name}"
                     data-product-price="${product.price}" 
+                    data-price-tiers='${JSON.stringify(product.price_tiers || [])}'
                     min="0" value="0" step="0.01">
             </td>
             <td>
@@ -194,11 +248,16 @@ function populateCustomerPriceList(products) {
             const quantityInput = tableBody.querySelector(`input[data-product-id="${productId}"]`);
             
             if (quantityInput && parseFloat(quantityInput.value) > 0) {
+                const quantity = parseFloat(quantityInput.value);
                 addProductToOrder(
                     productId,
                     quantityInput.getAttribute('data-product-name'),
-                    parseFloat(quantityInput.value),
-                    parseFloat(quantityInput.getAttribute('data-product-price')),
+                    quantity,
+                    tierPrice(
+                        JSON.parse(quantityInput.getAttribute('data-price-tiers')),
+                        parseFloat(quantityInput.getAttribute('data-product-price')),
+                        quantity
+                    ),
                     5 // Tasso di commissione di default (5%)
                 );
                 
@@ -211,6 +270,23 @@ function populateCustomerPriceList(products) {
     });
 }
 
+/**
+ * Prezzo unitario per una quantità: lo scaglione più alto raggiunto, altrimenti il prezzo base
+ * @param {Array} tiers - Scaglioni {min_quantity, price} ordinati per quantità
+ * @param {number} price - Prezzo per quantità 1
+ * @param {number} quantity - Quantità ordinata
+ * @returns {number} Prezzo unitario
+ */
+function tierPrice(tiers, price, quantity) {
+    let unitPrice = price;
+    tiers.forEach(tier => {
+        if (quantity >= tier.min_quantity) {
+            unitPrice = tier.price;
+        }
+    });
+    return unitPrice;
+}
+
 /**
  * Aggiunge un prodotto all'ordine
  * @param {string} productId - ID del prodotto
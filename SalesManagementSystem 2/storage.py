@@ -1,10 +1,131 @@
+import heapq
+import os
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
 from datetime import datetime
-from functools import lru_cache
+from itertools import islice
+from cache import GenerationCache, cached
+from columnar import OrderItemColumns
+from concurrency import ReadWriteLock, read_locked, write_locked
+from dashboard import DashboardSnapshots
 from models import User, Customer, Product, PriceList, Order, OrderItem, Payment
+from persistence import Persistence
+from pricing import PriceMatrix
+from rollups import SalesRollups
+from search import SearchIndex
+
+# Hashes of the demo passwords, computed ahead so that starting a worker runs no key derivation
+DEMO_PASSWORD_HASHES = {
+    'admin123': 'scrypt:32768:8:1$6A0UiocQALozZYVe$f7ba5ad20a3004faca0a36c60f63b40a067bafce3dfa24173392351a71524245b9638c221ced1565aad2303b6e516ce63b2b72828dc4db61ddf2e9325b340e0b',
+    'agent123': 'scrypt:32768:8:1$lqbcjmBjaTTmn9aY$3adb8d47df7eab061b33f7ca7e81a3863780a32bbbaae6d6dc0e8884b122d6719d98040d7d2f7737c1ef8bd2a0ae6215eb1fb557b420d03e7f9b5be86f8b7dcc',
+    'collab123': 'scrypt:32768:8:1$tqdkWa7kQt9jUa8Z$69b09f13f7ce11b863f2d33aa22255c11fcd8b46238f99ac34499738d9ac2c855e6d6e10463865038188a5a1d400b7388383d1298caf22b702af1c6dbb5cf24f'
+}
+
+
+class _ForeignKeyIndex:
+    """Hash index mapping a foreign key value to the ids of the rows that reference it.
+
+    The index remembers which key each row was filed under, so it stays correct
+    even when callers mutate an entity in place and then call ``update_*``.
+    With several attributes the key is the tuple of their values.
+    """
+
+    def __init__(self, *attrs):
+        self.attrs = attrs
+        self._ids_by_key = {}  # key -> {row_id: None}, a dict keeps insertion order
+        self._key_by_id = {}
+
+    def key_of(self, entity):
+        if len(self.attrs) == 1:
+            return getattr(entity, self.attrs[0])
+        return tuple(getattr(entity, attr) for attr in self.attrs)
+
+    def add(self, entity):
+        key = self.key_of(entity)
+        self._key_by_id[entity.id] = key
+        self._ids_by_key.setdefault(key, {})[entity.id] = None
+
+    def remove(self, entity_id):
+        if entity_id not in self._key_by_id:
+            return
+        key = self._key_by_id.pop(entity_id)
+        ids = self._ids_by_key.get(key)
+        if ids is not None:
+            ids.pop(entity_id, None)
+            if not ids:
+                del self._ids_by_key[key]
+
+    def update(self, entity):
+        if self._key_by_id.get(entity.id, object()) != self.key_of(entity):
+            self.remove(entity.id)
+            self.add(entity)
+
+    def ids(self, key):
+        return list(self._ids_by_key.get(key, ()))
+
+    def count(self, key):
+        return len(self._ids_by_key.get(key, ()))
+
+    def members(self, key):
+        """Live read-only view of the ids filed under key, for membership tests"""
+        return self._ids_by_key.get(key, {}).keys()
+
+    def first(self, key):
+        ids = self._ids_by_key.get(key)
+        return next(iter(ids)) if ids else None
+
+
+class _SortedIndex:
+    """Ordered index of rows by one or more attributes.
+
+    Entries are ``(value..., row_id)`` tuples in a sorted list, so a range can
+    be located with bisect and walked from any position in either direction.
+    It has the same add/remove/update interface as _ForeignKeyIndex.
+    """
+
+    def __init__(self, *attrs):
+        self.attrs = attrs
+        self._entries = []
+        self._key_by_id = {}
+
+    def key_of(self, entity):
+        return tuple(getattr(entity, attr) for attr in self.attrs) + (entity.id,)
+
+    def add(self, entity):
+        key = self.key_of(entity)
+        self._key_by_id[entity.id] = key
+        insort(self._entries, key)
+
+    def remove(self, entity_id):
+        key = self._key_by_id.pop(entity_id, None)
+        if key is not None:
+            del self._entries[bisect_left(self._entries, key)]
+
+    def update(self, entity):
+        if self._key_by_id.get(entity.id) != self.key_of(entity):
+            self.remove(entity.id)
+            self.add(entity)
+
+    def key(self, entity_id):
+        return self._key_by_id.get(entity_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def walk(self, low=None, high=None, descending=False):
+        """Yield the entries strictly between low and high (None is unbounded).
+        Bounds compare as tuples, so (value,) sorts before every entry with that value"""
+        start = bisect_right(self._entries, low) if low is not None else 0
+        stop = bisect_left(self._entries, high) if high is not None else len(self._entries)
+        entries = self._entries
+        positions = range(stop - 1, start - 1, -1) if descending else range(start, stop)
+        for position in positions:
+            yield entries[position]
 
 # In-memory storage with caching for MVP
 class Storage:
-    def __init__(self):
+    def __init__(self, cache_size=1024, persistence=None):
         # Data stores
         self.users = {}
         self.customers = {}
@@ -14,27 +135,141 @@ class Storage:
         self.order_items = {}
         self.payments = {}
         
-        # Cache invalidation flags for each entity type
-        self._cache_invalidation_counters = {
-            'users': 0,
-            'customers': 0,
-            'products': 0,
-            'price_lists': 0,
-            'orders': 0,
-            'order_items': 0,
-            'payments': 0
+        # Read cache keyed by per-entity generation counters
+        self.cache = GenerationCache(maxsize=cache_size)
+        
+        # Secondary indexes on foreign keys, kept current by add_*/update_*/delete_*
+        self._items_by_order = _ForeignKeyIndex('order_id')
+        self._payments_by_order = _ForeignKeyIndex('order_id')
+        self._orders_by_user = _ForeignKeyIndex('user_id')
+        self._orders_by_customer = _ForeignKeyIndex('customer_id')
+        self._orders_by_date = _SortedIndex('order_date')
+        self._customers_by_agent = _ForeignKeyIndex('agent_id')
+        self._customers_by_id = _SortedIndex()
+        self._products_by_id = _SortedIndex()
+        self._price_lists_by_customer = _ForeignKeyIndex('customer_id')
+        
+        # Lookup indexes on the natural keys used to upsert imported rows
+        self._customers_by_vat_number = _ForeignKeyIndex('vat_number')
+        self._products_by_code = _ForeignKeyIndex('code')
+        self._price_lists_by_customer_product = _ForeignKeyIndex('customer_id', 'product_id', 'min_quantity')
+        
+        self._indexes = {
+            'users': (),
+            'customers': (self._customers_by_agent, self._customers_by_vat_number, self._customers_by_id),
+            'products': (self._products_by_code, self._products_by_id),
+            'price_lists': (self._price_lists_by_customer, self._price_lists_by_customer_product),
+            'orders': (self._orders_by_user, self._orders_by_customer, self._orders_by_date),
+            'order_items': (self._items_by_order,),
+            'payments': (self._payments_by_order,)
         }
         
-        # Initialize demo data
-        self._init_demo_data()
-    
-    def _get_cache_key(self, entity_type):
-        """Get a cache key for a specific entity type that changes on every cache invalidation"""
-        return f"{entity_type}_{self._cache_invalidation_counters[entity_type]}"
+        # Last ID handed out per entity type; never moves back, even after deletes
+        self._sequences = {entity_type: 0 for entity_type in self._indexes}
+        
+        # Writers take the write side, multi-row reads the read side; single
+        # dict lookups by ID are atomic on their own and stay unlocked
+        self._lock = ReadWriteLock()
+        
+        # Derived structures notified of every stored and removed row
+        self._listeners = []
+        self._columns = OrderItemColumns(self)
+        self.add_listener(self._columns)
+        self._rollups = SalesRollups(self)
+        self.add_listener(self._rollups)
+        self._search = SearchIndex()
+        self.add_listener(self._search)
+        self._dashboard = DashboardSnapshots(self)
+        self.add_listener(self._dashboard)
+        self._pricing = PriceMatrix()
+        self.add_listener(self._pricing)
+        
+        # Generations restart from zero with every instance, so values keyed on
+        # them outside the process (ETags) also carry this
+        self.instance_id = uuid.uuid4().hex[:8]
+        
+        # Entity types written inside the current batch(), invalidated when it ends
+        self._batch_invalidations = None
+        
+        # Restore durable state if there is any, otherwise start from demo data
+        self._journal = None
+        restored = persistence.restore(self) if persistence else False
+        if not restored:
+            self._init_demo_data()
+        if persistence:
+            persistence.start(self, snapshot_now=not restored)
+            self._journal = persistence
+    
+    def generation(self, entity_type):
+        """Get the generation counter of an entity type, bumped on every write to it"""
+        return self.cache.generation(entity_type)
+    
+    @write_locked
+    def add_listener(self, listener):
+        """Register an object whose on_put(entity_type, entity) and
+        on_remove(entity_type, entity) are called after every row change"""
+        self._listeners.append(listener)
     
     def _invalidate_cache(self, entity_type):
         """Invalidate the cache for a specific entity type"""
-        self._cache_invalidation_counters[entity_type] += 1
+        if self._batch_invalidations is not None:
+            self._batch_invalidations.add(entity_type)
+        else:
+            self.cache.invalidate(entity_type)
+    
+    def _next_id(self, entity_type, count=1):
+        """Allocate a block of count consecutive IDs and return the first one"""
+        first = self._sequences[entity_type] + 1
+        self._sequences[entity_type] += count
+        return first
+    
+    @contextmanager
+    def batch(self):
+        """Group writes atomically: the write lock is held for the whole block,
+        caches are invalidated once per entity type and the journal records the
+        whole group as a single entry when the block ends"""
+        with self._lock.write():
+            if self._batch_invalidations is not None:
+                yield self
+                return
+            self._batch_invalidations = set()
+            if self._journal is not None:
+                self._journal.begin_batch()
+            try:
+                yield self
+            finally:
+                invalidated, self._batch_invalidations = self._batch_invalidations, None
+                if self._journal is not None:
+                    self._journal.end_batch()
+                self.cache.invalidate(*invalidated)
+    
+    def _put(self, entity_type, entity):
+        """Store an entity and keep the secondary indexes of its type up to date"""
+        table = getattr(self, entity_type)
+        is_update = entity.id in table
+        table[entity.id] = entity
+        if entity.id > self._sequences[entity_type]:
+            self._sequences[entity_type] = entity.id
+        for index in self._indexes[entity_type]:
+            if is_update:
+                index.update(entity)
+            else:
+                index.add(entity)
+        for listener in self._listeners:
+            listener.on_put(entity_type, entity)
+        if self._journal is not None:
+            self._journal.log_put(entity_type, entity)
+        return entity
+    
+    def _remove(self, entity_type, entity_id):
+        """Remove an entity and drop it from the secondary indexes of its type"""
+        entity = getattr(self, entity_type).pop(entity_id)
+        for index in self._indexes[entity_type]:
+            index.remove(entity_id)
+        for listener in self._listeners:
+            listener.on_remove(entity_type, entity)
+        if self._journal is not None:
+            self._journal.log_delete(entity_type, entity_id)
 
     def _init_demo_data(self):
         # Create admin user
@@ -42,11 +277,12 @@ class Storage:
             id=1,
             username="admin",
             email="admin@example.com",
-            password="admin123",
+            password=None,
+            password_hash=DEMO_PASSWORD_HASHES['admin123'],
             role="admin",
             full_name="Administrator"
         )
-        self.users[admin.id] = admin
+        self._put('users', admin)
         
         # Create basic customer
         basic_customer = Customer(
@@ -62,7 +298,7 @@ class Storage:
             phone="+39 02 1234567",
             agent_id=2
         )
-        self.customers[basic_customer.id] = basic_customer
+        self._put('customers', basic_customer)
         
         # Create custom price for the basic customer
         basic_price = PriceList(
@@ -71,30 +307,32 @@ class Storage:
             product_id=6,
             custom_price=89.99  # Prezzo scontato per il cliente basic
         )
-        self.price_lists[basic_price.id] = basic_price
+        self._put('price_lists', basic_price)
 
         # Create agent user
         agent = User(
             id=2,
             username="agent1",
             email="agent1@example.com",
-            password="agent123",
+            password=None,
+            password_hash=DEMO_PASSWORD_HASHES['agent123'],
             role="agent",
             full_name="Main Agent"
         )
-        self.users[agent.id] = agent
+        self._put('users', agent)
         
         # Create collaborator user
         collaborator = User(
             id=3,
             username="collab1",
             email="collab1@example.com",
-            password="collab123",
+            password=None,
+            password_hash=DEMO_PASSWORD_HASHES['collab123'],
             role="collaborator",
             full_name="First Collaborator",
             agent_id=2  # Linked to agent1
         )
-        self.users[collaborator.id] = collaborator
+        self._put('users', collaborator)
         
         # Create some products
         products = [
@@ -107,426 +345,613 @@ class Storage:
         ]
         
         for product in products:
-            self.products[product.id] = product
+            self._put('products', product)
 
     # User methods
-    @lru_cache(maxsize=32)
     def get_user_by_id(self, user_id):
-        """Get a user by ID with caching for better performance"""
+        """Get a user by ID"""
         return self.users.get(user_id)
     
-    @lru_cache(maxsize=32)
+    @read_locked
+    @cached('users')
     def get_user_by_username(self, username):
         """Get a user by username with caching for better performance"""
         # Use more efficient lookup with dictionary
         username_to_user = {user.username: user for user in self.users.values()}
         return username_to_user.get(username)
     
+    @write_locked
     def add_user(self, user):
         if user.id is None:
-            user.id = max(self.users.keys(), default=0) + 1
-        self.users[user.id] = user
+            user.id = self._next_id('users')
+        self._put('users', user)
+        self._invalidate_cache('users')
         return user
     
+    @write_locked
     def update_user(self, user):
         if user.id in self.users:
-            self.users[user.id] = user
+            self._put('users', user)
+            self._invalidate_cache('users')
             return user
         return None
     
+    @write_locked
     def delete_user(self, user_id):
         if user_id in self.users:
-            del self.users[user_id]
+            self._remove('users', user_id)
+            self._invalidate_cache('users')
             return True
         return False
     
+    @read_locked
     def get_all_users(self):
         return list(self.users.values())
     
+    @read_locked
     def get_collaborators_by_agent(self, agent_id):
         return [u for u in self.users.values() if u.role == "collaborator" and u.agent_id == agent_id]
     
     # Customer methods
-    @lru_cache(maxsize=64)
     def get_customer_by_id(self, customer_id):
-        """Get a customer by ID with caching for better performance"""
+        """Get a customer by ID"""
         return self.customers.get(customer_id)
     
+    @read_locked
+    def get_customer_by_vat_number(self, vat_number):
+        """Get a customer by VAT number"""
+        customer_id = self._customers_by_vat_number.first(vat_number)
+        return self.customers[customer_id] if customer_id is not None else None
+    
+    @write_locked
     def add_customer(self, customer):
         """Add a new customer with automatic ID assignment"""
         if customer.id is None:
-            customer.id = max(self.customers.keys(), default=0) + 1
-        self.customers[customer.id] = customer
+            customer.id = self._next_id('customers')
+        self._put('customers', customer)
         self._invalidate_cache('customers')
         return customer
     
+    @write_locked
     def update_customer(self, customer):
         """Update an existing customer"""
         if customer.id in self.customers:
-            self.customers[customer.id] = customer
+            self._put('customers', customer)
             self._invalidate_cache('customers')
             return customer
         return None
     
+    @write_locked
     def delete_customer(self, customer_id):
         """Delete a customer by ID and invalidate cache"""
         if customer_id in self.customers:
-            del self.customers[customer_id]
+            self._remove('customers', customer_id)
             self._invalidate_cache('customers')
             return True
         return False
     
-    @lru_cache(maxsize=1)
+    @read_locked
+    @cached('customers')
     def get_all_customers(self):
         """Get all customers with caching"""
-        cache_key = self._get_cache_key('customers')  # This changes when customers are modified
         return list(self.customers.values())
     
-    @lru_cache(maxsize=16)
+    @read_locked
+    @cached('customers')
     def get_customers_by_agent(self, agent_id):
         """Get customers by agent ID with caching"""
-        cache_key = self._get_cache_key('customers')  # This changes when customers are modified
-        return [c for c in self.customers.values() if c.agent_id == agent_id]
+        return [self.customers[i] for i in self._customers_by_agent.ids(agent_id)]
+    
+    @read_locked
+    def get_customers_page(self, agent_id=None, after_id=None, limit=25):
+        """Get one page of customers sorted by ID, optionally of one agent, and the
+        cursor of the next page: the ID of the last customer of this page"""
+        if agent_id is None:
+            ids = [key[-1] for key in islice(self._customers_by_id.walk((after_id,) if after_id is not None else None), limit + 1)]
+        else:
+            ids = heapq.nsmallest(limit + 1, (
+                i for i in self._customers_by_agent.ids(agent_id) if after_id is None or i > after_id
+            ))
+        next_cursor = ids[limit - 1] if len(ids) > limit else None
+        return [self.customers[i] for i in ids[:limit]], next_cursor
     
     # Product methods
-    @lru_cache(maxsize=64)
     def get_product_by_id(self, product_id):
-        """Get a product by ID with caching"""
+        """Get a product by ID"""
         return self.products.get(product_id)
     
+    @read_locked
+    def get_product_by_code(self, code):
+        """Get a product by its code"""
+        product_id = self._products_by_code.first(code)
+        return self.products[product_id] if product_id is not None else None
+    
+    @write_locked
     def add_product(self, product):
         """Add a new product with automatic ID assignment"""
         if product.id is None:
-            product.id = max(self.products.keys(), default=0) + 1
-        self.products[product.id] = product
+            product.id = self._next_id('products')
+        self._put('products', product)
         self._invalidate_cache('products')
         return product
     
+    @write_locked
     def update_product(self, product):
         """Update an existing product"""
         if product.id in self.products:
-            self.products[product.id] = product
+            self._put('products', product)
             self._invalidate_cache('products')
             return product
         return None
     
+    @write_locked
     def delete_product(self, product_id):
         """Delete a product by ID and invalidate cache"""
         if product_id in self.products:
-            del self.products[product_id]
+            self._remove('products', product_id)
             self._invalidate_cache('products')
             return True
         return False
     
-    @lru_cache(maxsize=1)
+    @read_locked
+    @cached('products')
     def get_all_products(self):
         """Get all products with caching"""
-        cache_key = self._get_cache_key('products')  # This changes when products are modified
         return list(self.products.values())
     
+    @read_locked
+    def get_products_page(self, after_id=None, limit=25):
+        """Get one page of products sorted by ID and the cursor of the next page"""
+        ids = [key[-1] for key in islice(self._products_by_id.walk((after_id,) if after_id is not None else None), limit + 1)]
+        next_cursor = ids[limit - 1] if len(ids) > limit else None
+        return [self.products[i] for i in ids[:limit]], next_cursor
+    
     # Price list methods
-    @lru_cache(maxsize=32)
     def get_price_list_by_id(self, price_list_id):
-        """Get a price list by ID with caching"""
+        """Get a price list by ID"""
         return self.price_lists.get(price_list_id)
     
+    @read_locked
+    def get_price_list_for_customer_product(self, customer_id, product_id, min_quantity=1):
+        """Get the price list row of a customer for a product at a quantity break"""
+        price_list_id = self._price_lists_by_customer_product.first((customer_id, product_id, min_quantity))
+        return self.price_lists[price_list_id] if price_list_id is not None else None
+    
+    @write_locked
     def add_price_list(self, price_list):
         """Add a new price list with automatic ID assignment"""
         if price_list.id is None:
-            price_list.id = max(self.price_lists.keys(), default=0) + 1
-        self.price_lists[price_list.id] = price_list
+            price_list.id = self._next_id('price_lists')
+        self._put('price_lists', price_list)
         self._invalidate_cache('price_lists')
         return price_list
     
+    @write_locked
     def update_price_list(self, price_list):
         """Update an existing price list"""
         if price_list.id in self.price_lists:
-            self.price_lists[price_list.id] = price_list
+            self._put('price_lists', price_list)
             self._invalidate_cache('price_lists')
             return price_list
         return None
     
+    @write_locked
     def delete_price_list(self, price_list_id):
         """Delete a price list by ID and invalidate cache"""
         if price_list_id in self.price_lists:
-            del self.price_lists[price_list_id]
+            self._remove('price_lists', price_list_id)
             self._invalidate_cache('price_lists')
             return True
         return False
     
-    @lru_cache(maxsize=32)
+    @read_locked
+    @cached('price_lists')
     def get_price_lists_by_customer(self, customer_id):
         """Get price lists for a customer with caching"""
-        cache_key = self._get_cache_key('price_lists')  # This changes when price lists are modified
-        return [pl for pl in self.price_lists.values() if pl.customer_id == customer_id]
-    
-    @lru_cache(maxsize=64)
-    def get_price_for_customer_product(self, customer_id, product_id):
-        """Get the price for a specific customer and product with caching"""
-        cache_key = self._get_cache_key('price_lists')  # This changes when price lists are modified
-        
-        # Create a dictionary for faster lookup
-        customer_product_prices = {
-            (pl.customer_id, pl.product_id): pl.custom_price 
-            for pl in self.price_lists.values()
-        }
-        
-        # Look for a custom price
-        price = customer_product_prices.get((customer_id, product_id))
-        if price is not None:
-            return price
-            
-        # Return standard price if no custom price exists
-        product = self.get_product_by_id(product_id)
-        return product.price if product else None
+        return [self.price_lists[i] for i in self._price_lists_by_customer.ids(customer_id)]
+    
+    @read_locked
+    def get_price_for_customer_product(self, customer_id, product_id, quantity=1):
+        """Get the unit price of a product for a customer buying quantity of it: the
+        custom price of the highest quantity break reached in the customer's price
+        list, the product's list price otherwise. None for unknown products."""
+        return self._pricing.price(customer_id, product_id, quantity)
+    
+    @read_locked
+    def get_prices_for_customer(self, customer_id, product_ids=None, quantity=1):
+        """Get {product_id: unit price} for a customer at one quantity, priced like
+        get_price_for_customer_product. product_ids=None prices the whole catalog;
+        unknown products are skipped."""
+        return self._pricing.prices(customer_id, product_ids, quantity)
+    
+    @read_locked
+    def get_order_prices(self, customer_id, lines):
+        """Price a whole order in one call: the unit price of every (product_id,
+        quantity) line for the customer, None for unknown products"""
+        return self._pricing.order_prices(customer_id, lines)
     
     # Order methods
-    @lru_cache(maxsize=64)
     def get_order_by_id(self, order_id):
-        """Get an order by ID with caching"""
+        """Get an order by ID"""
         return self.orders.get(order_id)
     
+    @write_locked
     def add_order(self, order):
         """Add a new order with automatic ID assignment"""
         if order.id is None:
-            order.id = max(self.orders.keys(), default=0) + 1
-        self.orders[order.id] = order
+            order.id = self._next_id('orders')
+        self._put('orders', order)
         self._invalidate_cache('orders')
         return order
     
+    @write_locked
     def update_order(self, order):
         """Update an existing order"""
         if order.id in self.orders:
             order.updated_at = datetime.now()
-            self.orders[order.id] = order
+            self._put('orders', order)
             self._invalidate_cache('orders')
             return order
         return None
     
+    @write_locked
     def delete_order(self, order_id):
         """Delete an order by ID and its related items, and invalidate cache"""
         if order_id in self.orders:
-            # Also delete related order items
-            for item_id, item in list(self.order_items.items()):
-                if item.order_id == order_id:
-                    del self.order_items[item_id]
-            # Delete the order
-            del self.orders[order_id]
-            self._invalidate_cache('orders')
-            self._invalidate_cache('order_items')
+            # The order and its items go in one batch, so the journal never holds half a delete
+            with self.batch():
+                for item_id in self._items_by_order.ids(order_id):
+                    self._remove('order_items', item_id)
+                self._remove('orders', order_id)
+                self._invalidate_cache('orders')
+                self._invalidate_cache('order_items')
             return True
         return False
     
-    @lru_cache(maxsize=1)
+    @write_locked
+    def add_order_with_items(self, order, items):
+        """Add an order and all of its items in one step.
+        
+        IDs are allocated as one block and caches are invalidated once, so
+        large orders cost O(items) instead of one full write per line. If a
+        write fails partway, the rows it added are removed again."""
+        with self.batch():
+            added = []
+            try:
+                if order.id is None:
+                    order.id = self._next_id('orders')
+                if order.id not in self.orders:
+                    added.append(('orders', order.id))
+                self._put('orders', order)
+                
+                new_items = [item for item in items if item.id is None]
+                next_item_id = self._next_id('order_items', len(new_items)) if new_items else None
+                for item in items:
+                    if item.id is None:
+                        item.id = next_item_id
+                        next_item_id += 1
+                    item.order_id = order.id
+                    if item.id not in self.order_items:
+                        added.append(('order_items', item.id))
+                    self._put('order_items', item)
+            except Exception:
+                for entity_type, entity_id in reversed(added):
+                    if entity_id in getattr(self, entity_type):
+                        self._remove(entity_type, entity_id)
+                raise
+            finally:
+                self._invalidate_cache('orders')
+                self._invalidate_cache('order_items')
+        return order
+    
+    @read_locked
+    @cached('orders')
     def get_all_orders(self):
         """Get all orders with caching"""
-        cache_key = self._get_cache_key('orders')  # This changes when orders are modified
         return list(self.orders.values())
     
-    @lru_cache(maxsize=32)
+    @read_locked
+    @cached('orders')
     def get_orders_by_user(self, user_id):
         """Get orders by user ID with caching"""
-        cache_key = self._get_cache_key('orders')  # This changes when orders are modified
-        return [o for o in self.orders.values() if o.user_id == user_id]
+        return [self.orders[i] for i in self._orders_by_user.ids(user_id)]
     
-    @lru_cache(maxsize=32)
+    @read_locked
+    @cached('orders')
     def get_orders_by_customer(self, customer_id):
         """Get orders by customer ID with caching"""
-        cache_key = self._get_cache_key('orders')  # This changes when orders are modified
-        return [o for o in self.orders.values() if o.customer_id == customer_id]
+        return [self.orders[i] for i in self._orders_by_customer.ids(customer_id)]
     
-    @lru_cache(maxsize=16)
+    @read_locked
+    @cached('orders', 'customers')
     def get_orders_by_agent(self, agent_id):
         """Get orders for all customers of an agent with caching"""
-        orders_cache_key = self._get_cache_key('orders')  # This changes when orders are modified
-        customers_cache_key = self._get_cache_key('customers')  # This changes when customers are modified
         
-        # Get all customers for this agent (already cached by get_customers_by_agent)
-        agent_customers = {c.id for c in self.get_customers_by_agent(agent_id)}
+        # Walk agent -> customers -> orders through the indexes
+        return [
+            self.orders[order_id]
+            for customer_id in self._customers_by_agent.ids(agent_id)
+            for order_id in self._orders_by_customer.ids(customer_id)
+        ]
+    
+    @read_locked
+    def get_orders_page(self, user_id=None, agent_id=None, customer_id=None, status=None,
+                        start_date=None, end_date=None, descending=True, cursor=None, limit=25):
+        """Get one page of orders sorted by (order_date, id) and the cursor of the next page.
+        
+        user_id, agent_id and customer_id restrict the orders like the get_orders_by_*
+        methods (combined they intersect), status and the inclusive date range filter
+        them. cursor is the (order_date, id) of the last order of the previous page."""
+        low = (start_date,) if start_date else None
+        high = (end_date, float('inf')) if end_date else None
+        if cursor is not None:
+            if descending:
+                high = min(high, cursor) if high else cursor
+            else:
+                low = max(low, cursor) if low else cursor
+        
+        orders, customers = self.orders, self.customers
+        
+        def matches(order_id):
+            order = orders[order_id]
+            if user_id is not None and order.user_id != user_id:
+                return False
+            if customer_id is not None and order.customer_id != customer_id:
+                return False
+            if agent_id is not None:
+                customer = customers.get(order.customer_id)
+                if customer is None or customer.agent_id != agent_id:
+                    return False
+            return status is None or order.status == status
         
-        # Filter orders more efficiently
-        return [o for o in self.orders.values() if o.customer_id in agent_customers]
+        # The most selective of the principal and customer filters bounds the matches
+        narrowest = None
+        if customer_id is not None:
+            narrowest = (self._orders_by_customer.count(customer_id), lambda: self._orders_by_customer.ids(customer_id))
+        if user_id is not None:
+            count = self._orders_by_user.count(user_id)
+            if narrowest is None or count < narrowest[0]:
+                narrowest = (count, lambda: self._orders_by_user.ids(user_id))
+        if agent_id is not None and customer_id is None:
+            agent_customers = self._customers_by_agent.ids(agent_id)
+            count = sum(self._orders_by_customer.count(i) for i in agent_customers)
+            if narrowest is None or count < narrowest[0]:
+                narrowest = (count, lambda: [
+                    order_id for i in agent_customers for order_id in self._orders_by_customer.ids(i)
+                ])
+        
+        # Walking the date index costs about limit * total / matches steps, ranking
+        # the narrowest candidate list costs its length: take the cheaper one
+        if narrowest is None or narrowest[0] ** 2 >= limit * len(self._orders_by_date):
+            keys = []
+            for key in self._orders_by_date.walk(low, high, descending):
+                if matches(key[-1]):
+                    keys.append(key)
+                    if len(keys) > limit:
+                        break
+        else:
+            in_range = (
+                key for key in map(self._orders_by_date.key, narrowest[1]())
+                if (low is None or key > low) and (high is None or key < high) and matches(key[-1])
+            )
+            keys = (heapq.nlargest if descending else heapq.nsmallest)(limit + 1, in_range)
+        
+        next_cursor = keys[limit - 1] if len(keys) > limit else None
+        return [self.orders[key[-1]] for key in keys[:limit]], next_cursor
     
     # Order item methods
-    @lru_cache(maxsize=64)
     def get_order_item_by_id(self, order_item_id):
-        """Get an order item by ID with caching"""
+        """Get an order item by ID"""
         return self.order_items.get(order_item_id)
     
+    @write_locked
     def add_order_item(self, order_item):
         """Add a new order item with automatic ID assignment"""
         if order_item.id is None:
-            order_item.id = max(self.order_items.keys(), default=0) + 1
-        self.order_items[order_item.id] = order_item
+            order_item.id = self._next_id('order_items')
+        self._put('order_items', order_item)
         self._invalidate_cache('order_items')
         return order_item
     
+    @write_locked
     def update_order_item(self, order_item):
         """Update an existing order item"""
         if order_item.id in self.order_items:
-            self.order_items[order_item.id] = order_item
+            self._put('order_items', order_item)
             self._invalidate_cache('order_items')
             return order_item
         return None
     
+    @write_locked
     def delete_order_item(self, order_item_id):
         """Delete an order item by ID and invalidate cache"""
         if order_item_id in self.order_items:
-            del self.order_items[order_item_id]
+            self._remove('order_items', order_item_id)
             self._invalidate_cache('order_items')
             return True
         return False
     
-    @lru_cache(maxsize=64)
+    @read_locked
+    @cached('order_items')
     def get_items_by_order(self, order_id):
         """Get all items for an order with caching"""
-        cache_key = self._get_cache_key('order_items')  # This changes when order items are modified
-        return [i for i in self.order_items.values() if i.order_id == order_id]
+        return [self.order_items[i] for i in self._items_by_order.ids(order_id)]
     
     # Payment methods
-    @lru_cache(maxsize=32)
     def get_payment_by_id(self, payment_id):
-        """Get a payment by ID with caching"""
+        """Get a payment by ID"""
         return self.payments.get(payment_id)
     
+    @write_locked
     def add_payment(self, payment):
         """Add a new payment with automatic ID assignment"""
         if payment.id is None:
-            payment.id = max(self.payments.keys(), default=0) + 1
-        self.payments[payment.id] = payment
+            payment.id = self._next_id('payments')
+        self._put('payments', payment)
         self._invalidate_cache('payments')
         return payment
     
+    @write_locked
     def update_payment(self, payment):
         """Update an existing payment"""
         if payment.id in self.payments:
-            self.payments[payment.id] = payment
+            self._put('payments', payment)
             self._invalidate_cache('payments')
             return payment
         return None
     
+    @write_locked
     def delete_payment(self, payment_id):
         """Delete a payment by ID and invalidate cache"""
         if payment_id in self.payments:
-            del self.payments[payment_id]
+            self._remove('payments', payment_id)
             self._invalidate_cache('payments')
             return True
         return False
     
-    @lru_cache(maxsize=32)
+    @read_locked
+    @cached('payments')
     def get_payments_by_order(self, order_id):
         """Get all payments for an order with caching"""
-        cache_key = self._get_cache_key('payments')  # This changes when payments are modified
-        return [p for p in self.payments.values() if p.order_id == order_id]
+        return [self.payments[i] for i in self._payments_by_order.ids(order_id)]
     
-    # Analytical methods
-    @lru_cache(maxsize=32)
+    # Analytical methods, computed over the columnar mirror of order items
+    @read_locked
+    @cached('orders', 'order_items')
     def get_total_sales_by_user(self, user_id, start_date=None, end_date=None):
         """Calculate total sales by user in a date range with caching"""
-        # Convert date parameters to strings for caching
-        start_str = start_date.isoformat() if start_date else None
-        end_str = end_date.isoformat() if end_date else None
-        cache_key = f"sales_user_{user_id}_{start_str}_{end_str}_{self._get_cache_key('orders')}_{self._get_cache_key('order_items')}"
-        
-        # Get filtered orders by date range
-        orders = [
-            order for order in self.get_orders_by_user(user_id)
-            if (start_date is None or order.order_date >= start_date) and
-               (end_date is None or order.order_date <= end_date)
-        ]
-        
-        # Calculate total sales more efficiently
-        total = 0
-        for order in orders:
-            for item in self.get_items_by_order(order.id):
-                total += item.total  # Using the property from OrderItem
-        
-        return total
+        return self._columns.totals(user_id=user_id, start_date=start_date, end_date=end_date)[0]
     
-    @lru_cache(maxsize=32)
+    @read_locked
+    @cached('orders', 'order_items', 'customers')
     def get_total_sales_by_agent(self, agent_id, start_date=None, end_date=None):
         """Calculate total sales by agent in a date range with caching"""
-        # Convert date parameters to strings for caching
-        start_str = start_date.isoformat() if start_date else None
-        end_str = end_date.isoformat() if end_date else None
-        cache_key = f"sales_agent_{agent_id}_{start_str}_{end_str}_{self._get_cache_key('orders')}_{self._get_cache_key('order_items')}"
-        
-        # Get filtered orders by date range
-        orders = [
-            order for order in self.get_orders_by_agent(agent_id)
-            if (start_date is None or order.order_date >= start_date) and
-               (end_date is None or order.order_date <= end_date)
-        ]
-        
-        # Calculate total sales more efficiently
-        total = 0
-        for order in orders:
-            for item in self.get_items_by_order(order.id):
-                total += item.total  # Using the property from OrderItem
-        
-        return total
+        return self._columns.totals(agent_id=agent_id, start_date=start_date, end_date=end_date)[0]
     
-    @lru_cache(maxsize=32)
+    @read_locked
+    @cached('orders', 'order_items')
     def get_total_commissions_by_user(self, user_id, start_date=None, end_date=None):
         """Calculate total commissions by user in a date range with caching"""
-        # Convert date parameters to strings for caching
-        start_str = start_date.isoformat() if start_date else None
-        end_str = end_date.isoformat() if end_date else None
-        cache_key = f"commission_user_{user_id}_{start_str}_{end_str}_{self._get_cache_key('orders')}_{self._get_cache_key('order_items')}"
-        
-        # Get filtered orders by date range
-        orders = [
-            order for order in self.get_orders_by_user(user_id)
-            if (start_date is None or order.order_date >= start_date) and
-               (end_date is None or order.order_date <= end_date)
-        ]
-        
-        # Calculate total commissions more efficiently
-        total = 0
-        for order in orders:
-            for item in self.get_items_by_order(order.id):
-                total += item.commission_amount  # Using the property from OrderItem
+        return self._columns.totals(user_id=user_id, start_date=start_date, end_date=end_date)[1]
+    
+    @read_locked
+    @cached('orders', 'order_items', 'customers')
+    def get_sales_and_commissions(self, user_id=None, agent_id=None, start_date=None, end_date=None):
+        """Calculate (total sales, total commissions) in a date range, optionally
+        restricted to a user's orders or to the orders of an agent's customers"""
+        return self._columns.totals(user_id=user_id, agent_id=agent_id, start_date=start_date, end_date=end_date)
+    
+    @read_locked
+    @cached('orders', 'order_items')
+    def get_sales_by_user(self, start_date=None, end_date=None):
+        """Calculate {user_id: (total sales, total commissions, orders)} over the
+        orders each user created in a date range, in one pass over the items"""
+        return self._columns.totals_by('user_id', start_date=start_date, end_date=end_date)
+    
+    # Search
+    @read_locked
+    def search(self, entity_type, query, limit=20, agent_id=None):
+        """Search 'customers' or 'products' by prefix and substring, best matches first.
         
-        return total
-    
-    @lru_cache(maxsize=16)
+        With agent_id, customers are limited to the ones that agent manages."""
+        allowed = None
+        if entity_type == 'customers' and agent_id is not None:
+            allowed = self._customers_by_agent.members(agent_id)
+        table = getattr(self, entity_type)
+        return [table[i] for i in self._search.search(entity_type, query, limit=limit, allowed=allowed)]
+    
+    # Batched lookups used to enrich listings with one call per kind of row
+    @staticmethod
+    def _rows_by_ids(table, ids):
+        return {i: table[i] for i in set(ids) if i in table}
+    
+    @read_locked
+    def get_customers_by_ids(self, customer_ids):
+        """Get {customer_id: customer} for the given IDs, skipping unknown ones"""
+        return self._rows_by_ids(self.customers, customer_ids)
+    
+    @read_locked
+    def get_users_by_ids(self, user_ids):
+        """Get {user_id: user} for the given IDs, skipping unknown ones"""
+        return self._rows_by_ids(self.users, user_ids)
+    
+    @read_locked
+    def get_products_by_ids(self, product_ids):
+        """Get {product_id: product} for the given IDs, skipping unknown ones"""
+        return self._rows_by_ids(self.products, product_ids)
+    
+    @read_locked
+    def get_orders_by_ids(self, order_ids):
+        """Get {order_id: order} for the given IDs, skipping unknown ones"""
+        return self._rows_by_ids(self.orders, order_ids)
+    
+    @read_locked
+    def get_items_by_orders(self, order_ids):
+        """Get {order_id: its items} for the given orders"""
+        items = self.order_items
+        return {i: [items[item_id] for item_id in self._items_by_order.ids(i)] for i in order_ids}
+    
+    @read_locked
+    def get_payments_by_orders(self, order_ids):
+        """Get {order_id: its payments} for the given orders"""
+        payments = self.payments
+        return {i: [payments[payment_id] for payment_id in self._payments_by_order.ids(i)] for i in order_ids}
+    
+    @read_locked
+    def get_order_totals(self, order_ids):
+        """Get {order_id: total amount} for the given orders"""
+        return {i: self._rollups.order_total(i) for i in order_ids}
+    
+    @read_locked
+    def get_paid_amounts(self, order_ids):
+        """Get {order_id: sum of its payments} for the given orders"""
+        payments = self.payments
+        return {i: sum(payments[p].amount for p in self._payments_by_order.ids(i)) for i in order_ids}
+    
+    # Monthly figures, read from the incrementally maintained rollups
+    @read_locked
     def get_monthly_sales_data(self, user_id=None, agent_id=None, year=None):
-        """Get monthly sales data with caching"""
+        """Get monthly sales data"""
         # Set default year if not provided
         if year is None:
             year = datetime.now().year
         
-        # Create cache key based on parameters
-        cache_key = f"monthly_sales_{user_id}_{agent_id}_{year}_{self._get_cache_key('orders')}_{self._get_cache_key('order_items')}"
-        
-        monthly_data = [0] * 12  # Initialize with zeros for each month
-        
-        # Determine which orders to check (already cached)
+        # A user filter takes precedence over an agent filter
         if user_id:
-            orders = self.get_orders_by_user(user_id)
-        elif agent_id:
-            orders = self.get_orders_by_agent(agent_id)
-        else:
-            orders = self.get_all_orders()
-        
-        # Pre-filter orders by year for efficiency
-        filtered_orders = [o for o in orders if o.order_date.year == year]
-        
-        # Group orders by month for more efficient processing
-        orders_by_month = {}
-        for order in filtered_orders:
-            month_idx = order.order_date.month - 1  # 0-indexed
-            if month_idx not in orders_by_month:
-                orders_by_month[month_idx] = []
-            orders_by_month[month_idx].append(order)
-        
-        # Calculate monthly totals
-        for month_idx, month_orders in orders_by_month.items():
-            for order in month_orders:
-                for item in self.get_items_by_order(order.id):
-                    monthly_data[month_idx] += item.total  # Using the property from OrderItem
-        
-        return monthly_data
+            return self._rollups.monthly_sales(year, user_id=user_id)
+        if agent_id:
+            return self._rollups.monthly_sales(year, agent_id=agent_id)
+        return self._rollups.monthly_sales(year)
+    
+    @read_locked
+    def get_period_totals(self, start_month, end_month, user_id=None, agent_id=None, customer_id=None):
+        """Get (total sales, total commissions, order count) over whole months, from
+        start_month to end_month inclusive, each given as a (year, month) tuple"""
+        return self._rollups.period_totals(start_month, end_month, user_id=user_id, agent_id=agent_id, customer_id=customer_id)
+    
+    @read_locked
+    def get_dashboard_snapshot(self, user_id):
+        """Get the dashboard figures of a user: the current month's orders count, sales
+        and commission, the monthly sales series, customer and user counts and the
+        five most recent orders, as seen by the user's role"""
+        user = self.users.get(user_id)
+        return self._dashboard.snapshot(user) if user is not None else None
+    
+    @read_locked
+    def check_rollups(self):
+        """Recompute the monthly rollups from scratch and return the buckets that disagree"""
+        return self._rollups.verify()
+
+def create_storage():
+    """Build the backend selected by STORAGE_BACKEND: 'memory' (default) or 'sqlite'"""
+    backend = os.environ.get('STORAGE_BACKEND', 'memory')
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(os.environ.get('SQLITE_PATH', 'sales.db'))
+    if backend != 'memory':
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    # Set STORAGE_DATA_DIR to keep the in-memory state across restarts
+    return Storage(persistence=Persistence.from_env())
 
 # Initialize the storage
-db = Storage()
+db = create_storage()
@@ -0,0 +1,197 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from time import perf_counter
+from flask import before_render_template, g, request, template_rendered
+from instrumentation import instrument_storage
+
+# Attributes every LogRecord has; anything else was passed through extra= and is logged as a field
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+# Trace of the request being handled by the current thread, None outside requests
+_current_trace = ContextVar('current_trace', default=None)
+
+_listener = None
+
+
+class RequestTrace:
+    """Request ID and, for sampled requests, the spans recorded while handling it"""
+    __slots__ = ('request_id', 'started', 'spans')
+
+    def __init__(self, request_id, sampled):
+        self.request_id = request_id
+        self.started = perf_counter()
+        self.spans = [] if sampled else None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request ID and extra fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _RequestIdFilter(logging.Filter):
+    """Stamp records with the current request ID, in the thread that logs them"""
+
+    def filter(self, record):
+        trace = _current_trace.get()
+        if trace is not None and not hasattr(record, 'request_id'):
+            record.request_id = trace.request_id
+        return True
+
+
+def configure_logging(level=None, fmt=None, stream=None):
+    """Send all logging through a queue to a background thread that formats and writes it.
+
+    The level defaults to LOG_LEVEL or WARNING, so in production debug and
+    info calls on hot paths return after a level check. The format is
+    LOG_FORMAT: 'json' (default) or 'text'. Calling it again replaces the
+    previous configuration."""
+    global _listener
+    level = (level or os.environ.get('LOG_LEVEL') or 'WARNING').upper()
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'json')
+
+    output = logging.StreamHandler(stream)
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s', defaults={'request_id': '-'}))
+
+    # Callers only enqueue the record; formatting and I/O happen on the listener thread
+    handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    handler.addFilter(_RequestIdFilter())
+
+    if _listener is not None:
+        _listener.stop()
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def _flush_logs():
+    if _listener is not None:
+        _listener.stop()
+
+
+# ---------- Request tracing ----------
+
+@contextmanager
+def span(name, **fields):
+    """Time a block as a span of the current request when the request is sampled"""
+    trace = _current_trace.get()
+    if trace is None or trace.spans is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append({'name': name, 'ms': round((perf_counter() - started) * 1000, 3), **fields})
+
+
+def _storage_span(name, seconds):
+    """Record a 'storage.<method>' span for a storage call of a sampled request"""
+    trace = _current_trace.get()
+    if trace is not None and trace.spans is not None:
+        trace.spans.append({'name': f'storage.{name}', 'ms': round(seconds * 1000, 3)})
+
+
+def init_tracing(app, storage=None, sample_rate=None):
+    """Give requests an ID and log them, with spans for a sample of them.
+
+    sample_rate (TRACE_SAMPLE_RATE, default 0) is the fraction of requests
+    whose storage calls and template renders are recorded as spans and
+    logged, at INFO on the 'tracing' logger whatever the root level. Other
+    requests are logged on the 'requests' logger: at INFO, or at WARNING
+    when they are slower than TRACE_SLOW_MS or fail with a server error.
+    Unsampled requests record no spans, and with LOG_LEVEL=ERROR and no
+    sampling nothing at all is installed."""
+    if sample_rate is None:
+        sample_rate = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+    slow_ms = float(os.environ.get('TRACE_SLOW_MS', 1000))
+    request_logger = logging.getLogger('requests')
+    trace_logger = logging.getLogger('tracing')
+    if sample_rate <= 0 and not request_logger.isEnabledFor(logging.WARNING):
+        return
+
+    if sample_rate > 0:
+        trace_logger.setLevel(logging.INFO)
+        if storage is not None:
+            instrument_storage(storage, _storage_span)
+        before_render_template.connect(_template_started, app)
+        template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def _start_trace():
+        request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex
+        sampled = sample_rate > 0 and random.random() < sample_rate
+        g._trace_token = _current_trace.set(RequestTrace(request_id, sampled))
+
+    @app.after_request
+    def _log_request(response):
+        trace = _current_trace.get()
+        if trace is None:
+            return response
+        response.headers['X-Request-ID'] = trace.request_id
+        duration_ms = (perf_counter() - trace.started) * 1000
+        if trace.spans is not None:
+            target, level = trace_logger, logging.INFO
+        else:
+            target = request_logger
+            level = logging.WARNING if response.status_code >= 500 or duration_ms >= slow_ms else logging.INFO
+        if target.isEnabledFor(level):
+            fields = {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(duration_ms, 3)
+            }
+            if trace.spans is not None:
+                fields['spans'] = trace.spans
+            target.log(level, '%s %s %s', request.method, request.path, response.status_code, extra=fields)
+        return response
+
+    @app.teardown_request
+    def _end_trace(exc):
+        token = g.pop('_trace_token', None)
+        if token is not None:
+            _current_trace.reset(token)
+
+
+def _template_started(app, template, context, **extra):
+    trace = _current_trace.get()
+    if trace is not None and trace.spans is not None:
+        g._template_started = perf_counter()
+
+
+def _template_finished(app, template, context, **extra):
+    trace = _current_trace.get()
+    started = g.pop('_template_started', None)
+    if trace is not None and trace.spans is not None and started is not None:
+        trace.spans.append({'name': f'render.{template.name}', 'ms': round((perf_counter() - started) * 1000, 3)})
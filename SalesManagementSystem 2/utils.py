@@ -1,6 +1,4 @@
 from datetime import datetime
-from functools import lru_cache
-from flask import session
 from storage import db
 
 # ---------- Formatting functions ----------
@@ -25,34 +23,86 @@ def format_date(date_obj):
     
     return ""
 
+# ---------- Query parameter parsing ----------
+
+def parse_date(value):
+    """Parse a YYYY-MM-DD query parameter, ignoring missing or malformed values"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+def encode_order_cursor(cursor):
+    """Turn an (order_date, order_id) cursor into a query parameter"""
+    order_date, order_id = cursor
+    return f"{order_date.isoformat()}_{order_id}"
+
+def decode_order_cursor(value):
+    """Turn the cursor query parameter back into (order_date, order_id)"""
+    try:
+        order_date, order_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(order_date), int(order_id)
+    except (AttributeError, ValueError):
+        return None
+
 # ---------- Order calculation functions ----------
 
-@lru_cache(maxsize=128)
+def get_order_amounts(order_ids):
+    """Get {order_id: {'total_amount', 'paid_amount', 'balance'}} for many orders
+    with one batched lookup for the totals and one for the payments"""
+    order_ids = list(order_ids)
+    totals = db.get_order_totals(order_ids)
+    paid = db.get_paid_amounts(order_ids)
+    return {
+        order_id: {
+            'total_amount': totals[order_id],
+            'paid_amount': paid[order_id],
+            'balance': totals[order_id] - paid[order_id]
+        }
+        for order_id in order_ids
+    }
+
 def get_order_total(order_id):
-    """Calculate the total amount for an order with caching for performance"""
-    items = db.get_items_by_order(order_id)
-    return sum(item.total for item in items)
+    """Calculate the total amount for an order"""
+    return db.get_order_totals([order_id])[order_id]
 
-@lru_cache(maxsize=128)
 def get_order_paid_amount(order_id):
-    """Calculate the total paid amount for an order with caching for performance"""
-    payments = db.get_payments_by_order(order_id)
-    return sum(payment.amount for payment in payments)
+    """Calculate the total paid amount for an order"""
+    return db.get_paid_amounts([order_id])[order_id]
 
 def get_order_balance(order_id):
     """Calculate the remaining balance for an order"""
-    return get_order_total(order_id) - get_order_paid_amount(order_id)
+    return get_order_amounts([order_id])[order_id]['balance']
 
 # ---------- Data retrieval functions with enrichment ----------
 
+def enrich_orders(orders):
+    """Turn orders into dictionaries with customer and creator names and amounts.
+    
+    The whole list costs one batched lookup per kind of related row, however
+    many orders it holds."""
+    amounts = get_order_amounts(order.id for order in orders)
+    customers = db.get_customers_by_ids(order.customer_id for order in orders)
+    users = db.get_users_by_ids(order.user_id for order in orders)
+    
+    result = []
+    for order in orders:
+        customer = customers.get(order.customer_id)
+        user = users.get(order.user_id)
+        order_dict = order.to_dict()
+        order_dict.update(amounts[order.id])
+        order_dict['customer_name'] = customer.name if customer else "Unknown"
+        order_dict['created_by'] = user.username if user else "Unknown"
+        result.append(order_dict)
+    return result
+
 def get_order_items_with_details(order_id):
     """Get order items with product details"""
     items = db.get_items_by_order(order_id)
     result = []
     
     # Get all products at once to avoid multiple database calls
-    product_ids = [item.product_id for item in items]
-    products = {p.id: p for p in [db.get_product_by_id(pid) for pid in set(product_ids)] if p}
+    products = db.get_products_by_ids(item.product_id for item in items)
     
     for item in items:
         product = products.get(item.product_id)
@@ -74,72 +124,42 @@ def get_order_with_details(order_id):
     if not order:
         return None
     
-    # Get related entities in parallel
-    customer = db.get_customer_by_id(order.customer_id)
-    user = db.get_user_by_id(order.user_id)
-    
-    # Create enriched order dictionary
-    order_dict = order.to_dict()
-    order_dict.update({
-        'customer_name': customer.name if customer else "Unknown",
-        'created_by': user.username if user else "Unknown",
-        'total_amount': get_order_total(order.id),
-        'paid_amount': get_order_paid_amount(order.id),
-        'balance': get_order_balance(order.id),
-        'order_items': get_order_items_with_details(order.id)
-    })
-    
+    order_dict = enrich_orders([order])[0]
+    order_dict['order_items'] = get_order_items_with_details(order.id)
     return order_dict
 
 def get_customer_orders(customer_id):
     """Get all orders for a customer with details"""
-    orders = db.get_orders_by_customer(customer_id)
-    
-    # Process all orders in a more efficient way
-    result = []
-    for order in orders:
-        order_dict = order.to_dict()
-        order_dict.update({
-            'total_amount': get_order_total(order.id),
-            'paid_amount': get_order_paid_amount(order.id),
-            'balance': get_order_balance(order.id)
-        })
-        result.append(order_dict)
-    
-    return result
+    return enrich_orders(db.get_orders_by_customer(customer_id))
 
 # ---------- Business logic functions ----------
 
+def _current_month_range(start_date=None, end_date=None):
+    """Fill in a missing bound with the start of the current month or now"""
+    now = datetime.now()
+    return start_date or datetime(now.year, now.month, 1), end_date or now
+
 def calculate_commission(user_id, start_date=None, end_date=None):
     """Calculate commission for a user in a date range"""
-    # Set default date range if not provided
-    if start_date is None:
-        start_date = datetime(datetime.now().year, datetime.now().month, 1)
-    if end_date is None:
-        end_date = datetime.now()
-    
-    # Get orders based on user role
-    role = session.get('role')
-    if role == 'admin':
-        orders = db.get_all_orders()
-    elif role == 'agent':
-        orders = db.get_orders_by_agent(user_id)
+    # Filter based on the user's own role, whoever is logged in
+    user = db.get_user_by_id(user_id)
+    if user is None:
+        filters = {'user_id': user_id}
+    elif user.role == 'admin':
+        filters = {}
+    elif user.role == 'agent':
+        filters = {'agent_id': user_id}
     else:
-        orders = db.get_orders_by_user(user_id)
-    
-    # Filter orders by date range and calculate totals
-    total_commission = 0.0
-    total_sales = 0.0
+        filters = {'user_id': user_id}
     
-    for order in orders:
-        if (start_date and order.order_date < start_date) or (end_date and order.order_date > end_date):
-            continue
-        
-        items = db.get_items_by_order(order.id)
-        for item in items:
-            item_total = item.total
-            total_sales += item_total
-            total_commission += item.commission_amount
+    # The default range is the current month, read straight from the monthly rollups
+    if start_date is None and end_date is None:
+        start_date, end_date = _current_month_range()
+        month = (start_date.year, start_date.month)
+        total_sales, total_commission, _ = db.get_period_totals(month, month, **filters)
+    else:
+        start_date, end_date = _current_month_range(start_date, end_date)
+        total_sales, total_commission = db.get_sales_and_commissions(start_date=start_date, end_date=end_date, **filters)
     
     return {
         'total_sales': total_sales,
@@ -147,3 +167,40 @@ def calculate_commission(user_id, start_date=None, end_date=None):
         'start_date': start_date,
         'end_date': end_date
     }
+
+def calculate_commissions(users, start_date=None, end_date=None):
+    """Calculate sales, commission and orders of every user in a date range
+    (the current month by default) with one pass over the order items.
+    
+    Each user is credited with the orders they created. Agents also get team
+    figures: their own plus those of their collaborators."""
+    start_date, end_date = _current_month_range(start_date, end_date)
+    totals = db.get_sales_by_user(start_date=start_date, end_date=end_date)
+    
+    rows = []
+    team_by_agent = {}
+    for user in users:
+        sales, commission, orders = totals.get(user.id, (0.0, 0.0, 0))
+        row = {
+            'id': user.id,
+            'name': user.full_name or user.username,
+            'role': user.role,
+            'orders': orders,
+            'total_sales': sales,
+            'total_commission': commission
+        }
+        if user.role == 'agent':
+            row.update(team_orders=orders, team_sales=sales, team_commission=commission)
+            team_by_agent[user.id] = row
+        rows.append(row)
+    
+    # Roll collaborators up into their agent, whether or not they are listed
+    if team_by_agent:
+        for user in db.get_all_users():
+            team = team_by_agent.get(user.agent_id) if user.role == 'collaborator' else None
+            if team is not None:
+                sales, commission, orders = totals.get(user.id, (0.0, 0.0, 0))
+                team['team_orders'] += orders
+                team['team_sales'] += sales
+                team['team_commission'] += commission
+    return rows